@@ -21,21 +21,24 @@ from rest_framework.decorators import api_view
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import RefreshToken as RestRefreshToken, AccessToken
 
 from account.api.serializers import UserSerializer, RegisterSerializer, response_verify_code, UserUpdateSerializer, \
     UserWithPerm, PermSerializer, GroupPermSerializer, UserListSerializer, AllowanceOrder, send_sms, ViewOtpSerializer
+from account.handlers.bulk_users import bulk_create_users
 from account.handlers.perms import get_full_permname, get_perm_name
 from account.handlers.token import deactivate_user_token, deactivate_user_phone_token
 from account.handlers.validate_perm import check_perm
 from account.models import User, Verify, PhoneNumber, RefreshToken, TokenMapping, GroupPerm, Perm, GrantAccess
+from account.token_cache import invalidate_refresh_token
 from app.api_routes.handlers import get_token_for_user
 from app.logs import app_log
 from app.redis_db import redis_db, verify_deactivate_key
 from app.settings import pusher_client
 from marketing.price_list.models import PriceList
+from system_func.api.views import report_job_response
 from system_func.models import PeriodSeason, PointOfSeason
 from user_system.client_profile.models import ClientProfile
 from utils.constants import status as user_status, maNhomND, admin_role, phone_magic, magic_verify_code, perm_actions
@@ -112,61 +115,7 @@ class ApiAccount(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateMo
         return Response(response, status.HTTP_200_OK)
 
     def export_users(self, request, *args, **kwargs):
-        queryset = User.objects.all().select_related('clientprofile', 'employeeprofile').prefetch_related(
-            'phone_numbers', 'group_user')
-
-        get_user = self.request.query_params.get('get_user', None)
-        queryset = self.get_users_query(queryset, get_user)
-
-        queryset = queryset.order_by('id').distinct()
-
-        data = []
-        for user in queryset:
-            phone_numbers = ', '.join(user.phone_numbers.all().values_list('phone_number', flat=True))
-            main_phone_number = user.phone_numbers.filter(type='main').first()
-            main_phone = main_phone_number.phone_number if main_phone_number else ''
-
-            if user.user_type == 'employee':
-                try:
-                    user_profile = [user.employeeprofile.register_name, '', '', user.employeeprofile.address]
-                except Exception:
-                    user_profile = ['', '', '', '']
-            else:
-                try:
-                    user_profile = [user.clientprofile.register_name,
-                                    user.clientprofile.client_lv1_id,
-                                    user.clientprofile.nvtt_id,
-                                    user.clientprofile.address
-                                ]
-                except Exception:
-                    user_profile = ['', '', '', '']
-
-            print_data = [
-                user.id,
-                user.email,
-                main_phone,
-                phone_numbers,
-            ]
-            result_data = print_data + user_profile
-            data.append(result_data)
-
-        # Chuyển đổi danh sách thành DataFrame
-        df = pd.DataFrame(data, columns=['Mã KH', 'Email', 'SĐT chính', 'Danh sách SĐT', 'Tên đăng ký', 'Mã NPP', 'Mã NVTT', 'Địa chỉ'])
-
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="users.xlsx"'
-
-        with pd.ExcelWriter(response, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Users')
-            workbook = writer.book
-            worksheet = writer.sheets['Users']
-
-            # Set column widths
-            widths = {'A': 14, 'B': 24, 'C': 11.6, 'D': 28, 'E': 30, 'F': 10.8, 'G': 12, 'H': 36}
-            for col_num, width in widths.items():
-                worksheet.column_dimensions[col_num].width = width
-
-        return response
+        return report_job_response(request, 'users', {'get_user': request.query_params.get('get_user')})
 
     def import_users(self, request, *args, **kwargs):
         file = request.FILES.get('file_import', None)
@@ -199,67 +148,13 @@ class ApiAccount(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateMo
         return Response({'message': 'ok', 'success': success, 'errors': error})
 
     def handle_create_users(self, users_data):
-        success = list()
-        errors = list()
         for user_data in users_data:
-            try:
-                with transaction.atomic():
-                    user_insert = {
-                        'id': user_data['id'].upper(),
-                        'username': user_data['id'],
-                        'email': user_data['email'],
-                        'user_type': 'client',
-                        'status': 'active'
-                    }
-                    try:
-                        user = User.objects.create(**user_insert)
-                    except Exception as e:
-                        raise ValidationError(f"error create user: {e}")
-                    user_profile = ClientProfile.objects.filter(client_id=user)
-                    if user_profile.exists():
-                        user_profile = user_profile.first()
-                    else:
-                        user_profile = user.create_profile()
-                    user_profile.register_name = user_data['register_name']
-                    user_profile.nvtt_id = user_data['nvtt_id']
-                    user_profile.address = user_data['address']
-                    user_profile.client_lv1_id = user_data['client_lv1_id']
-                    if user_data['client_lv1_id'] == 'npp':
-                        user_profile.is_npp = True
-                    user_profile.save()
-                    try:
-                        main_phone = PhoneNumber.objects.create(
-                            phone_number=user_data['main_phone'], user=user, type='main'
-                        )
-                    except Exception as e:
-                        raise ValidationError(f"error main phone: {e}")
-                    try:
-                        sub_phone = PhoneNumber.objects.create(phone_number=user_data['phone_number'], user=user)
-                    except Exception as e:
-                        raise ValidationError(f"error sub phone: {e}")
-                    success.append({
-                        'line': user_data['line_number'],
-                        'message': f"new user_id: {user.id}"
-                    })
-                    perm_name = ''
-                    group = GroupPerm.objects.filter()
-            except ValidationError as e:
-                error = str(e)
-                detail_message = error.split('\\n')[1]
-                error_data = {
-                    'line': user_data['line_number'],
-                    'message': f"{detail_message}"
-                }
-                errors.append(error_data)
-            except Exception as e:
-                error_data = {
-                    'line': user_data['line_number'],
-                    'message': f"unexpected error during import file: {e}"
-                }
-                errors.append(error_data)
-        return success, errors
+            user_data['user_type'] = 'client'
+            user_data['status'] = 'active'
+        return bulk_create_users(users_data)
 
-    def get_users_query(self, queryset, get_user):
+    @staticmethod
+    def get_users_query(queryset, get_user):
         match get_user:
             case 'nvtt':
                 app_log.info(f"Case nvtt")
@@ -292,6 +187,56 @@ class ApiAccount(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateMo
         return queryset
 
 
+def export_users_file(params, output):
+    queryset = User.objects.all().select_related('clientprofile', 'employeeprofile').prefetch_related(
+        'phone_numbers', 'group_user')
+    queryset = ApiAccount.get_users_query(queryset, params.get('get_user'))
+    queryset = queryset.order_by('id').distinct()
+
+    data = []
+    for user in queryset:
+        # Dùng phone_numbers đã prefetch, không query lại từng user
+        phones = list(user.phone_numbers.all())
+        phone_numbers = ', '.join(phone.phone_number for phone in phones)
+        main_phone = next((phone.phone_number for phone in phones if phone.type == 'main'), '')
+
+        if user.user_type == 'employee':
+            try:
+                user_profile = [user.employeeprofile.register_name, '', '', user.employeeprofile.address]
+            except Exception:
+                user_profile = ['', '', '', '']
+        else:
+            try:
+                user_profile = [user.clientprofile.register_name,
+                                user.clientprofile.client_lv1_id,
+                                user.clientprofile.nvtt_id,
+                                user.clientprofile.address
+                                ]
+            except Exception:
+                user_profile = ['', '', '', '']
+
+        print_data = [
+            user.id,
+            user.email,
+            main_phone,
+            phone_numbers,
+        ]
+        data.append(print_data + user_profile)
+
+    # Chuyển đổi danh sách thành DataFrame
+    df = pd.DataFrame(data, columns=['Mã KH', 'Email', 'SĐT chính', 'Danh sách SĐT', 'Tên đăng ký', 'Mã NPP', 'Mã NVTT', 'Địa chỉ'])
+
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Users')
+        worksheet = writer.sheets['Users']
+
+        # Set column widths
+        widths = {'A': 14, 'B': 24, 'C': 11.6, 'D': 28, 'E': 30, 'F': 10.8, 'G': 12, 'H': 36}
+        for col_num, width in widths.items():
+            worksheet.column_dimensions[col_num].width = width
+    return 'users.xlsx'
+
+
 def extract_detail_message(error_message):
     # Tìm kiếm phần chi tiết từ thông điệp lỗi
     match = re.search(r"DETAIL: ([^\n]+)", error_message)
@@ -568,6 +513,7 @@ def logout(request):
                 current_token.save()
                 token = RestRefreshToken(current_token.refresh_token)
                 token.blacklist()
+                invalidate_refresh_token(token['jti'])
                 return Response({'message': 'logout thành công'}, status.HTTP_200_OK)
             return Response({'message': 'Token không tồn tại'}, status.HTTP_400_BAD_REQUEST)
         return Response({'message': 'Bạn cần nhập refresh token'}, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,14 @@
+from rest_framework_simplejwt import authentication
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """
+    Reuse (user, token) already authenticated by CheckBlacklistMiddleware,
+    so JWT is decoded and user is loaded once per request.
+    """
+
+    def authenticate(self, request):
+        auth_result = getattr(request._request, 'jwt_auth', None)
+        if auth_result is not None:
+            return auth_result
+        return super().authenticate(request)
@@ -0,0 +1,189 @@
+import time
+from typing import NamedTuple
+
+from django.apps import apps
+from django.db import transaction
+
+from account.perm_cache import invalidate_user_perms
+from account.queries import get_users_perm_details, get_users_group_perm_names, delete_rows_by_ids
+from account.visibility import sync_visibility
+from app.logs import app_log
+
+BATCH_SIZE = 2000
+REFRESH_BATCH_SIZE = 500
+
+
+class DelegationDiff(NamedTuple):
+    grants: int
+    added: int
+    updated: int
+    removed: int
+    # Managers whose perms are changed
+    managers: frozenset
+
+    @property
+    def size(self):
+        return self.added + self.updated + self.removed
+
+    def __add__(self, other):
+        return DelegationDiff(self.grants + other.grants, self.added + other.added, self.updated + other.updated,
+                              self.removed + other.removed, self.managers | other.managers)
+
+
+EMPTY_DIFF = DelegationDiff(0, 0, 0, 0, frozenset())
+
+
+def resolve_allow(resolution):
+    """ Group allow of highest level group has priority, then user allow """
+    if resolution.group_allow is not None:
+        return resolution.group_allow
+    if resolution.allow is not None:
+        return resolution.allow
+    return True
+
+
+def apply_grant_access(grants, dry_run=False) -> DelegationDiff:
+    """
+    Make delegated perms of managers match perms of their grant users.
+    Active and allowed grant delegates every perm of grant user which manager doesn't own (directly or by
+    groups), other grants delegate nothing. Reads current state with one query per table and writes in bulk.
+    Reads run inside the caller's transaction, so they see the uncommitted change which triggered the signal.
+    Former handle_grant_perm took its "before" perms from a separate connection (committed state only), here the
+    wanted perms are compared with the stored GrantAccess.grant_perms rows instead, no before snapshot is needed.
+    """
+    GrantAccess = apps.get_model('account', 'GrantAccess')
+    UserPerm = apps.get_model('account', 'UserPerm')
+    GrantPerm = GrantAccess.grant_perms.through
+
+    grants = list(grants.values_list('id', 'manager_id', 'grant_user_id', 'active', 'allow'))
+    if not grants:
+        return EMPTY_DIFF
+    grant_ids = [grant[0] for grant in grants]
+    manager_ids = {grant[1] for grant in grants}
+
+    enabled_users = {grant_user_id for _, _, grant_user_id, active, allow in grants if active and allow}
+    user_perms = get_users_perm_details(enabled_users)
+
+    # {grant_id: {perm_name: through row id}}
+    delegated = {grant_id: dict() for grant_id in grant_ids}
+    for row_id, grant_id, perm_name in GrantPerm.objects.filter(
+            grantaccess_id__in=grant_ids).values_list('id', 'grantaccess_id', 'perm_id'):
+        delegated[grant_id][perm_name] = row_id
+    # {manager_id: {perm_name: (row id, allow)}}
+    manager_rows = {manager_id: dict() for manager_id in manager_ids}
+    for row_id, manager_id, perm_name, allow in UserPerm.objects.filter(
+            user_id__in=manager_ids).values_list('id', 'user_id', 'perm_id', 'allow'):
+        manager_rows[manager_id][perm_name] = (row_id, allow)
+
+    manager_delegated = {manager_id: set() for manager_id in manager_ids}
+    for grant_id, manager_id, _, _, _ in grants:
+        manager_delegated[manager_id].update(delegated[grant_id])
+    # Perms manager owns: from groups, and direct rows which are not delegated
+    manager_own = get_users_group_perm_names(manager_ids)
+    for manager_id in manager_ids:
+        manager_own[manager_id].update(manager_rows[manager_id].keys() - manager_delegated[manager_id])
+
+    # Wanted delegated perms of each grant and merged by manager
+    grant_wanted = dict()
+    manager_wanted = {manager_id: dict() for manager_id in manager_ids}
+    for grant_id, manager_id, grant_user_id, active, allow in grants:
+        wanted = dict()
+        if active and allow:
+            wanted = {perm_name: resolve_allow(resolution)
+                      for perm_name, resolution in user_perms.get(grant_user_id, dict()).items()
+                      if perm_name not in manager_own[manager_id]}
+        grant_wanted[grant_id] = wanted
+        manager_wanted[manager_id].update(wanted)
+
+    grant_perm_create = [(grant_id, perm_name) for grant_id, wanted in grant_wanted.items()
+                         for perm_name in wanted if perm_name not in delegated[grant_id]]
+    grant_perm_delete = [row_id for grant_id, rows in delegated.items()
+                         for perm_name, row_id in rows.items() if perm_name not in grant_wanted[grant_id]]
+
+    user_perm_create = list()
+    user_perm_update = {True: [], False: []}
+    user_perm_delete = list()
+    changed_managers = set()
+    for manager_id, wanted in manager_wanted.items():
+        rows = manager_rows[manager_id]
+        for perm_name, allow in wanted.items():
+            if perm_name not in rows:
+                user_perm_create.append(UserPerm(user_id=manager_id, perm_id=perm_name, allow=allow))
+                changed_managers.add(manager_id)
+            elif rows[perm_name][1] != allow:
+                user_perm_update[allow].append(rows[perm_name][0])
+                changed_managers.add(manager_id)
+        for perm_name in manager_delegated[manager_id] - wanted.keys():
+            if perm_name in rows:
+                user_perm_delete.append(rows[perm_name][0])
+                changed_managers.add(manager_id)
+
+    diff = DelegationDiff(len(grants), len(user_perm_create), len(user_perm_update[True] + user_perm_update[False]),
+                          len(user_perm_delete), frozenset(changed_managers))
+    if dry_run:
+        return diff
+
+    with transaction.atomic():
+        GrantPerm.objects.bulk_create([GrantPerm(grantaccess_id=grant_id, perm_id=perm_name)
+                                       for grant_id, perm_name in grant_perm_create],
+                                      batch_size=BATCH_SIZE, ignore_conflicts=True)
+        delete_rows_by_ids(GrantPerm, grant_perm_delete)
+        UserPerm.objects.bulk_create(user_perm_create, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        for allow, ids in user_perm_update.items():
+            if ids:
+                UserPerm.objects.filter(id__in=ids).update(allow=allow)
+        delete_rows_by_ids(UserPerm, user_perm_delete)
+
+    if changed_managers:
+        invalidate_user_perms(*changed_managers)
+        sync_visibility(user_ids=changed_managers)
+    return diff
+
+
+def propagate_grant_access(user_ids, dry_run=False) -> DelegationDiff:
+    """
+    Apply perm changes of users to managers they granted access to.
+    Managers which are grant users themselves are followed, each user once.
+    """
+    GrantAccess = apps.get_model('account', 'GrantAccess')
+
+    total = EMPTY_DIFF
+    seen = set()
+    pending = {user_id for user_id in user_ids if user_id}
+    while pending:
+        seen.update(pending)
+        diff = apply_grant_access(GrantAccess.objects.filter(grant_user_id__in=list(pending), active=True), dry_run)
+        total += diff
+        pending = set(diff.managers) - seen
+    return total
+
+
+def propagate_group_grant_access(group_ids, dry_run=False) -> DelegationDiff:
+    """ Group perms changed, apply to managers of grant users in groups """
+    GrantAccess = apps.get_model('account', 'GrantAccess')
+
+    grant_users = (GrantAccess.objects.filter(active=True, grant_user__usergroupperm__group_id__in=list(group_ids))
+                   .values_list('grant_user_id', flat=True).distinct())
+    return propagate_grant_access(set(grant_users), dry_run)
+
+
+def refresh_all_grant_access(dry_run=False, batch_size=REFRESH_BATCH_SIZE) -> DelegationDiff:
+    """ Recompute delegated perms of every grant in batches, dry_run only counts the diff """
+    GrantAccess = apps.get_model('account', 'GrantAccess')
+
+    start_time = time.time()
+    total = EMPTY_DIFF
+    # Grants with delegated perms or enabled need work, others are already empty
+    grant_ids = set(GrantAccess.objects.filter(active=True, allow=True).values_list('id', flat=True))
+    grant_ids.update(GrantAccess.grant_perms.through.objects.values_list('grantaccess_id', flat=True).distinct())
+    # All grants of a manager in same batch, so a perm moved between them is not removed
+    manager_ids = sorted(set(GrantAccess.objects.filter(id__in=list(grant_ids)).values_list('manager_id', flat=True)))
+    for i in range(0, len(manager_ids), batch_size):
+        grants = GrantAccess.objects.filter(id__in=list(grant_ids), manager_id__in=manager_ids[i:i + batch_size])
+        total += apply_grant_access(grants, dry_run)
+    if not dry_run and total.managers:
+        propagate_grant_access(total.managers)
+    app_log.info(f"Refresh grant access{' (dry run)' if dry_run else ''}: {total.grants} grants, "
+                 f"{total.added} added, {total.updated} updated, {total.removed} removed "
+                 f"in {time.time() - start_time}")
+    return total
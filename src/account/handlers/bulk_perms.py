@@ -0,0 +1,109 @@
+import time
+
+from django.db import transaction
+
+from account.delegation import propagate_grant_access, propagate_group_grant_access
+from account.models import UserPerm, GroupPermPerms
+from account.perm_cache import invalidate_user_perms, invalidate_all_perms
+from account.queries import delete_rows_by_ids
+from account.visibility import sync_visibility
+from app.logs import app_log
+from utils.constants import admin_role
+
+BATCH_SIZE = 2000
+
+
+def diff_perm_rows(existing, desired: dict, replace_allow, protected=frozenset()):
+    """
+    Compare current rows with desired state.
+    existing: iterable of (id, owner, perm_name, allow)
+    desired: {(owner, perm_name): allow}
+    replace_allow: allow values of rows which are replaced by desired, other rows are kept
+    protected: owners whose rows are never removed
+    Return (to_create [(owner, perm_name, allow)], to_update {allow: [id]}, to_delete [id])
+    """
+    to_update = {True: [], False: []}
+    to_delete = list()
+    seen = set()
+    for row_id, owner, perm_name, allow in existing:
+        key = (owner, perm_name)
+        if key in seen:
+            # Duplicated row of same owner and perm
+            to_delete.append(row_id)
+            continue
+        seen.add(key)
+        if key in desired:
+            if desired[key] != allow:
+                to_update[desired[key]].append(row_id)
+        elif allow in replace_allow and owner not in protected:
+            to_delete.append(row_id)
+    to_create = [(owner, perm_name, allow) for (owner, perm_name), allow in desired.items()
+                 if (owner, perm_name) not in seen]
+    return to_create, to_update, to_delete
+
+
+def apply_user_perms(perm_names: list, desired: dict, replace_allow=(True, False)):
+    """
+    Set UserPerm of perm_names to desired {(user_id, perm_name): allow} with one read and bulk writes.
+    Superuser rows are never removed. Cache, visibility and grant access are updated once at the end.
+    """
+    if not desired and not replace_allow:
+        return set()
+    start_time = time.time()
+    existing = UserPerm.objects.filter(perm_id__in=perm_names).order_by('id')
+    protected = set(existing.filter(user__is_superuser=True).values_list('user_id', flat=True))
+    to_create, to_update, to_delete = diff_perm_rows(
+        existing.values_list('id', 'user_id', 'perm_id', 'allow'), desired, replace_allow, protected)
+
+    with transaction.atomic():
+        UserPerm.objects.bulk_create([UserPerm(user_id=user_id, perm_id=perm_name, allow=allow)
+                                      for user_id, perm_name, allow in to_create],
+                                     batch_size=BATCH_SIZE, ignore_conflicts=True)
+        for allow, ids in to_update.items():
+            if ids:
+                UserPerm.objects.filter(id__in=ids).update(allow=allow)
+        deleted_users = set(UserPerm.objects.filter(id__in=to_delete).values_list('user_id', flat=True))
+        delete_rows_by_ids(UserPerm, to_delete)
+
+    changed_ids = to_update[True] + to_update[False]
+    affected = {user_id for user_id, _, _ in to_create} | deleted_users
+    affected.update(UserPerm.objects.filter(id__in=changed_ids).values_list('user_id', flat=True))
+    if affected:
+        invalidate_user_perms(*affected)
+        sync_visibility(perm_names=perm_names, user_ids=affected)
+        propagate_grant_access(affected)
+    app_log.info(f"Apply user perms: {len(to_create)} created, {len(changed_ids)} updated, "
+                 f"{len(to_delete)} deleted in {time.time() - start_time}")
+    return affected
+
+
+def apply_group_perms(perm_names: list, desired: dict, replace_allow=(True, False)):
+    """ Same as apply_user_perms for GroupPermPerms {(group_name, perm_name): allow}, admin group is kept """
+    if not desired and not replace_allow:
+        return set()
+    start_time = time.time()
+    existing = GroupPermPerms.objects.filter(perm_id__in=perm_names).order_by('id')
+    to_create, to_update, to_delete = diff_perm_rows(
+        existing.values_list('id', 'group_id', 'perm_id', 'allow'), desired, replace_allow, {admin_role})
+
+    with transaction.atomic():
+        GroupPermPerms.objects.bulk_create([GroupPermPerms(group_id=group, perm_id=perm_name, allow=allow)
+                                            for group, perm_name, allow in to_create],
+                                           batch_size=BATCH_SIZE, ignore_conflicts=True)
+        for allow, ids in to_update.items():
+            if ids:
+                GroupPermPerms.objects.filter(id__in=ids).update(allow=allow)
+        deleted_groups = set(GroupPermPerms.objects.filter(id__in=to_delete).values_list('group_id', flat=True))
+        delete_rows_by_ids(GroupPermPerms, to_delete)
+
+    changed_ids = to_update[True] + to_update[False]
+    affected = {group for group, _, _ in to_create} | deleted_groups
+    affected.update(GroupPermPerms.objects.filter(id__in=changed_ids).values_list('group_id', flat=True))
+    if affected:
+        invalidate_all_perms()
+        sync_visibility(perm_names=perm_names, group_ids=affected)
+        propagate_group_grant_access(affected)
+    app_log.info(f"Apply group perms: {len(to_create)} created, {len(changed_ids)} updated, "
+                 f"{len(to_delete)} deleted in {time.time() - start_time}")
+    return affected
+
@@ -0,0 +1,202 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from account.models import User, PhoneNumber, GroupPerm, UserGroupPerm, Perm, UserPerm
+from account.visibility import sync_visibility
+from app.logs import app_log
+from user_system.client_profile.models import ClientProfile, ClientGroup
+from user_system.employee_profile.models import EmployeeProfile
+from utils.constants import maNhomND, perm_actions
+from utils.helpers import self_ids, sync_id_sequences
+
+BATCH_SIZE = 1000
+# bcrypt release GIL, hash passwords in threads
+HASH_WORKERS = 8
+
+user_id_chars = {'employee': 'NV', 'client': 'KH', 'farmer': 'ND'}
+not_allow_status = ['deactivate', 'pending', 'inactive']
+
+
+def bulk_create_users(users_data: list[dict], default_type='client'):
+    """
+    Create many users in set-based stages, same result as User.save + create_profile + set_user_perm for each row.
+    Each user dict may has: id, username, email, password, user_type, status, register_name, main_phone,
+    phone_number, nvtt_id, client_lv1_id, address, line_number.
+    Return (success, errors) with {'line', 'message'} same as ApiAccount.handle_create_users.
+    """
+    start_time = time.time()
+    rows, errors = validate_rows(users_data, default_type)
+    if not rows:
+        return [], errors
+
+    # Ids given in file can be ahead of the sequences
+    sync_id_sequences(User, [row['id'] for row in rows if row['id']], user_id_chars.values())
+    allocate_ids(rows)
+    hash_passwords(rows)
+
+    with transaction.atomic():
+        users = User.objects.bulk_create([
+            User(id=row['id'], username=row['username'], email=row['email'], password=row['password'],
+                 user_type=row['user_type'], status=row['status'])
+            for row in rows
+        ], batch_size=BATCH_SIZE)
+        create_phones(rows)
+        create_profiles(rows)
+        create_groups(rows)
+        create_user_perms(users)
+        # bulk_create không gọi signal
+        sync_visibility(user_ids=[row['id'] for row in rows])
+
+    success = [{'line': row['line_number'], 'message': f"new user_id: {row['id']}"} for row in rows]
+    app_log.info(f"Bulk create {len(success)} users, {len(errors)} errors: {time.time() - start_time}")
+    return success, errors
+
+
+def validate_rows(users_data, default_type):
+    """ Check duplicate ids, emails, phones in file and in database with one query each """
+    errors = list()
+    rows = list()
+    for i, user_data in enumerate(users_data):
+        row = {
+            'line_number': user_data.get('line_number', i + 1),
+            'id': str(user_data.get('id') or '').strip().upper(),
+            'username': user_data.get('username') or None,
+            'email': user_data.get('email') or None,
+            'password': user_data.get('password') or None,
+            'user_type': user_data.get('user_type') or default_type,
+            'status': user_data.get('status') or 'active',
+            'register_name': user_data.get('register_name'),
+            'main_phone': str(user_data['main_phone']) if user_data.get('main_phone') else None,
+            'phone_number': str(user_data['phone_number']) if user_data.get('phone_number') else None,
+            'nvtt_id': user_data.get('nvtt_id'),
+            'client_lv1_id': user_data.get('client_lv1_id'),
+            'address': user_data.get('address'),
+        }
+        if row['user_type'] not in user_id_chars:
+            errors.append({'line': row['line_number'], 'message': f"user_type {row['user_type']} not valid"})
+            continue
+        rows.append(row)
+
+    ids = [row['id'] for row in rows if row['id']]
+    emails = [row['email'] for row in rows if row['email']]
+    phones = [phone for row in rows for phone in (row['main_phone'], row['phone_number']) if phone]
+    existed_ids = set(User.objects.filter(id__in=ids).values_list('id', flat=True))
+    existed_emails = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+    existed_phones = set(PhoneNumber.objects.filter(phone_number__in=phones).values_list('phone_number', flat=True))
+
+    valid_rows = list()
+    for row in rows:
+        row_phones = [phone for phone in (row['main_phone'], row['phone_number']) if phone]
+        message = None
+        if row['id'] and row['id'] in existed_ids:
+            message = f"user_id {row['id']} already existed"
+        elif row['email'] and row['email'] in existed_emails:
+            message = f"email {row['email']} already existed"
+        elif len(set(row_phones)) < len(row_phones):
+            message = f"main phone and sub phone are the same {row['main_phone']}"
+        else:
+            for phone in row_phones:
+                if phone in existed_phones:
+                    message = f"phone number {phone} already existed"
+                    break
+        if message:
+            errors.append({'line': row['line_number'], 'message': message})
+            continue
+        # Later rows of file conflict with previous valid rows
+        if row['id']:
+            existed_ids.add(row['id'])
+        if row['email']:
+            existed_emails.add(row['email'])
+        existed_phones.update(row_phones)
+        valid_rows.append(row)
+    return valid_rows, errors
+
+
+def allocate_ids(rows):
+    """ Reserve ids for rows without id, one query per user type """
+    for user_type, char in user_id_chars.items():
+        no_id_rows = [row for row in rows if not row['id'] and row['user_type'] == user_type]
+        if not no_id_rows:
+            continue
+        new_ids = self_ids(char, User, 4, len(no_id_rows))
+        for row, new_id in zip(no_id_rows, new_ids):
+            row['id'] = new_id
+    for row in rows:
+        row['username'] = row['username'] or row['id']
+
+
+def hash_passwords(rows):
+    def _hash(row):
+        return make_password(row['password'] or row['id'].lower())
+
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        passwords = list(executor.map(_hash, rows))
+    for row, password in zip(rows, passwords):
+        row['password'] = password
+
+
+def create_phones(rows):
+    phones = list()
+    for row in rows:
+        if row['main_phone']:
+            phones.append(PhoneNumber(phone_number=row['main_phone'], user_id=row['id'], type='main'))
+        if row['phone_number']:
+            phones.append(PhoneNumber(phone_number=row['phone_number'], user_id=row['id']))
+    PhoneNumber.objects.bulk_create(phones, batch_size=BATCH_SIZE)
+
+
+def create_profiles(rows):
+    new_client, _ = ClientGroup.objects.get_or_create(name='Khách hàng chưa xếp loại')
+    client_groups = {'client': new_client, 'farmer': ClientGroup.objects.filter(id=maNhomND).first()}
+    default_names = {'client': 'Khách hàng', 'farmer': 'Nông dân'}
+
+    client_profiles = list()
+    employee_profiles = list()
+    for row in rows:
+        if row['user_type'] == 'employee':
+            employee_profiles.append(EmployeeProfile(employee_id_id=row['id'], register_name=row['register_name'],
+                                                     address=row['address']))
+            continue
+        client_lv1_id = row['client_lv1_id']
+        client_profiles.append(ClientProfile(
+            client_id_id=row['id'],
+            client_group_id=client_groups[row['user_type']],
+            register_name=row['register_name'] or f"{default_names[row['user_type']]} {row['id']}",
+            nvtt_id=row['nvtt_id'],
+            client_lv1_id=client_lv1_id,
+            is_npp=client_lv1_id == 'npp',
+            address=row['address']
+        ))
+    ClientProfile.objects.bulk_create(client_profiles, batch_size=BATCH_SIZE)
+    EmployeeProfile.objects.bulk_create(employee_profiles, batch_size=BATCH_SIZE)
+
+
+def create_groups(rows):
+    groups = GroupPerm.objects.in_bulk(list(user_id_chars.keys()))
+    user_groups = [
+        UserGroupPerm(user_id=row['id'], group=groups[row['user_type']],
+                      allow=row['status'] not in not_allow_status)
+        for row in rows if row['user_type'] in groups
+    ]
+    UserGroupPerm.objects.bulk_create(user_groups, batch_size=BATCH_SIZE)
+
+
+def create_user_perms(users):
+    """ Same as set_user_perm for each user: own object perms, all actions except destroy are allowed """
+    content_type = ContentType.objects.get_for_model(User)
+    perm_name = f'{content_type.app_label}_{content_type.model}'
+    perms = list()
+    user_perms = list()
+    for user in users:
+        for task in perm_actions['full']:
+            perm_name_ = f'{task}_{perm_name}_{user.id}'
+            perms.append(Perm(name=perm_name_, note=f'{task.capitalize()} {content_type.model}',
+                              content_type=content_type, object_id=user.id, action=task))
+            if task != perm_actions['destroy']:
+                user_perms.append(UserPerm(user_id=user.id, perm_id=perm_name_, allow=True))
+    Perm.objects.bulk_create(perms, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    UserPerm.objects.bulk_create(user_perms, batch_size=BATCH_SIZE, ignore_conflicts=True)
@@ -3,13 +3,14 @@ import openpyxl
 from openpyxl.utils import get_column_letter
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models import Q, Model
+from django.db.models import Q, Model, Exists, OuterRef, CharField
+from django.db.models.functions import Cast
 from rest_framework import status
 from rest_framework.response import Response
 
-from account.models import Perm, User, GroupPerm, GroupPermPerms
+from account.models import Perm, User, GroupPerm, GroupPermPerms, UserGroupPerm, UserPerm, ObjectVisibility
 from app.logs import app_log
-from utils.constants import perm_actions
+from utils.constants import perm_actions, admin_role
 
 
 def get_action(view, method):
@@ -79,39 +80,32 @@ def perm_queryset(self, user):
         return Response({'message': 'User is not authenticate'}, status=status.HTTP_401_UNAUTHORIZED)
     if not self.permission_classes:
         return model_class.objects.all()
-    all_permissions = user.get_all_allow_perms()
-    has_perm_id = []
 
     content = ContentType.objects.get_for_model(model_class)
-    action_perm = perm_actions.get('view')
-    perm_name = f'{content.app_label}_{content.model}'
+    object_pk = Cast(OuterRef('pk'), CharField())
+    # Object has any perm of its own is restricted
+    restricted = Perm.objects.filter(content_type=content, object_id=object_pk)
+    # Object user can view directly or by an allowed group
+    user_groups = UserGroupPerm.objects.filter(user=user, allow=True).values('group_id')
+    visible = ObjectVisibility.objects.filter(
+        content_type=content, action=perm_actions.get('view'), object_id=object_pk
+    ).filter(Q(user=user) | Q(group__in=user_groups))
+
+    queryset = model_class.objects.filter(~Exists(restricted) | Exists(visible))
     if pk:
-        perm_name = f'{perm_name}_{pk}'
-    print(f"PERM QUERYSET: {perm_name}")
-    # Get all price list ids which required permissions
-    perms_content = Perm.objects.filter(name__icontains=perm_name)
-    perm_req_id = {v.object_id for v in perms_content if v.object_id}
-    # print(f"PERM perm_req_id: {perm_req_id}")
-
-    # Get all price list ids which user has permissions
-    for perm in all_permissions:
-        if perm.startswith(action_perm + '_' + perm_name):
-            _, object_id = perm.rsplit('_', 1)
-            has_perm_id.append(object_id)
-    # print(f"PERM has_perm_id: {has_perm_id}")
-
-    # Exclude item which use not has permission
-    exclude_id = list(perm_req_id - set(has_perm_id))
-
-    queryset = model_class.objects.exclude(id__in=exclude_id)
-    print(f"--------------")
-    print(f"Exclude id: {exclude_id}")
+        queryset = queryset.filter(pk=pk)
     # Check if the model has a 'status' field and exclude deactivated items
     if hasattr(model_class, 'status'):
         queryset = queryset.exclude(status='deactivate')
     return queryset
 
 
+def has_object_perms(model, pk):
+    """ Object has its own perms, lookup by indexed (content_type, object_id) """
+    content = ContentType.objects.get_for_model(model)
+    return Perm.objects.filter(content_type=content, object_id=str(pk)).exists()
+
+
 def get_full_permname(model, action, pk):
     perm_name = get_perm_name(model)
     if pk:
@@ -128,35 +122,21 @@ def get_user_by_permname(perm_name):
 
 
 def export_users_has_perm(model: Model, pk: str):
-    perm_name = get_perm_name(model)
-    perm_name_pk = perm_name + f'_{pk}'
-    # print(f"Test permname: {perm_name_pk}")
+    content = ContentType.objects.get_for_model(model)
+    # Perms of object found by indexed (content_type, object_id)
+    object_perms = Perm.objects.filter(content_type=content, object_id=str(pk)).values('name')
     # Tìm các nhóm có quyền liên quan và không phải là admin
-    group_perm_has_perm = GroupPermPerms.objects.filter(
-        perm__name__iendswith=perm_name_pk
-    ).values_list('group__name', flat=True).distinct()
-    groups_with_perm = (GroupPerm.objects.filter(name__in=group_perm_has_perm)
-                        .exclude(name='admin').distinct())
-    # print(f"Check group with perm: {groups_with_perm}")
-    # Tìm các user có UserPerm phù hợp và không thuộc nhóm admin
-    users_with_group_perm = User.objects.filter(
-        usergroupperm__group__in=groups_with_perm,
-        # usergroupperm__allow=True
-    ).distinct()
-    # print(f"Check user in group has perm: {users_with_group_perm}")
-    users_with_direct_perm = User.objects.filter(
-        userperm__perm__name__icontains=perm_name_pk,
-        # userperm__allow=True
-    ).distinct()
-    # print(f"Check user has perm: {users_with_direct_perm}")
+    groups_with_perm = (GroupPermPerms.objects.filter(perm__in=object_perms)
+                        .exclude(group_id=admin_role).values('group_id'))
+    # Tìm các user thuộc nhóm có quyền hoặc có UserPerm của object
+    users_with_group_perm = UserGroupPerm.objects.filter(group__in=groups_with_perm).values_list('user_id', flat=True)
+    users_with_direct_perm = UserPerm.objects.filter(perm__in=object_perms).values_list('user_id', flat=True)
 
     # Hợp nhất hai QuerySet
-    users_with_perm = users_with_group_perm.union(users_with_direct_perm)
-    print(f"Check final result: {users_with_perm}")
-    users_with_perm = users_with_perm.values_list('id', flat=True)
+    users_with_perm = list(users_with_group_perm.union(users_with_direct_perm))
     # Xử lý kết quả, chẳng hạn tạo response hoặc log thông tin
     app_log.info(
-        f"Found {users_with_perm.count()} users with permission '{perm_name_pk}' not in 'admin' group.")
+        f"Found {len(users_with_perm)} users with permission of '{content.model} {pk}' not in 'admin' group.")
 
     workbook = openpyxl.Workbook()
     sheet = workbook.active
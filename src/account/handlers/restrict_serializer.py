@@ -2,13 +2,14 @@ import time
 from typing import Union, Type
 
 from django.contrib.contenttypes.models import ContentType
-from django.db import models, transaction
-from django.db.models import Model, Q
+from django.db import transaction
+from django.db.models import Model
 from rest_framework import serializers
 
-from account.models import User, GroupPerm, Perm, UserPerm, UserGroupPerm, PhoneNumber
+from account.handlers.bulk_perms import apply_user_perms, apply_group_perms
+from account.models import User, GroupPerm, Perm, PhoneNumber
 from app.logs import app_log
-from utils.constants import perm_actions, admin_role
+from utils.constants import perm_actions
 from utils.helpers import phone_validate
 from utils.import_excel import get_user_list
 
@@ -99,159 +100,92 @@ class BaseRestrictSerializer(serializers.ModelSerializer):
         start_time = time.time()
         user_actions = data.get('allow_actions', [])
         list_perm = create_full_perm(model, _id, user_actions)
-        # Get users has perm
-        existed_user_allow = list_user_has_perm(list_perm, True)
-        existed_user_restrict = list_user_has_perm(list_perm, False)
-        existed_group_allow = list_group_has_perm(list_perm, True)
-        existed_group_restrict = list_group_has_perm(list_perm, False)
 
-        # Processing assign perm to user/nhom
-        add_perm({'type': 'users', 'data': data['allow_users'], 'existed': existed_user_allow,
-                  'hide': data['hide_users'], 'read_only': data['read_only_users']}, list_perm,
-                 True)
-        add_perm({'type': 'group', 'data': data['allow_nhom'], 'existed': existed_group_allow,
-                  'hide': data['hide_groups'], 'read_only': data['read_only_groups']}, list_perm,
-                 True)
-        add_perm({'type': 'users', 'data': data['restrict_users'], 'existed': existed_user_restrict},
-                 list_perm, False)
-        add_perm({'type': 'group', 'data': data['restrict_nhom'], 'existed': existed_group_restrict},
-                 list_perm, False)
+        # Desired rows of restrict list first, allow list wins when both have same user/group
+        allow_users = resolve_users(data['allow_users'], 'allow')
+        restrict_users = resolve_users(data['restrict_users'], 'restrict')
+        desired_users = dict()
+        desired_users.update(desired_perm_rows(restrict_users, list_perm, False))
+        desired_users.update(desired_perm_rows(allow_users, list_perm, True, data.get('read_only_users'),
+                                               data.get('hide_users')))
+
+        allow_groups = resolve_groups(data['allow_nhom'], 'allow')
+        restrict_groups = resolve_groups(data['restrict_nhom'], 'restrict')
+        desired_groups = dict()
+        desired_groups.update(desired_perm_rows(restrict_groups, list_perm, False))
+        desired_groups.update(desired_perm_rows(allow_groups, list_perm, True, data.get('read_only_groups'),
+                                                data.get('hide_groups')))
+
+        # Empty list keeps current rows of that kind
+        apply_user_perms(list_perm, desired_users, replace_allow(allow_users, restrict_users))
+        apply_group_perms(list_perm, desired_groups, replace_allow(allow_groups, restrict_groups))
         app_log.info(f"Complete add perm: {time.time() - start_time}")
 
 
-def add_perm(items: dict, perms: [list, None], allow: bool):
-    """ Add new perms for user """
-    if items['data']:
-        # Get existed user/group permissions
-        exited = items.get('existed', [])
-        perm_data = items.pop('data')
-        # Upper data id when type == 'users'
-        items_data = [item.upper() for item in perm_data if item is not None] if items['type'] == 'users' else perm_data
-        # Remove Updating Restrict users/groups
-        if exited and len(exited) > 0:
-            # Return users/groups that would be removed permissions
-            items['existed'] = list(set(exited) - set(items_data))
-            for item_data in items['existed']:
-                if items['type'] == 'users':
-                    update_user_perm(item_data, perms, items, allow, exited)
-                else:
-                    update_group_perm(item_data, perms, items, allow, exited)
-        # Looping data update
-        if len(perm_data) > 0:
-            for item_data in perm_data:
-                if items['type'] == 'users':
-                    update_user_perm(item_data, perms, items, allow, exited)
-                else:
-                    update_group_perm(item_data, perms, items, allow, exited)
-
-
-def update_user_perm(item_data, perms, items, allow, exited):
-    # Try to get User
-    is_phone, phone_number = phone_validate(item_data)
-    if is_phone:
-        try:
-            phone = PhoneNumber.objects.get(phone_number=phone_number)
-            user = phone.user
-        except models.ObjectDoesNotExist:
-            field = 'allow' if allow else 'restrict'
-            raise serializers.ValidationError({'message': f'Field error at "{field}_{items["type"]}"'})
-    else:
-        try:
-            user = User.objects.get(id=item_data.upper())
-        # Return errors with fields error
-        except models.ObjectDoesNotExist:
-            field = 'allow' if allow else 'restrict'
-            raise serializers.ValidationError(
-                {'message': f'Field error at "{field}_{items["type"]}" - some items not exists'})
-    hide_users = items.get('hide', None)
-    read_only = items.get('read_only', None)
-    print(f"Read only: {read_only} | Hide: {hide_users}")
-    # Looping handle with permissions
-    for perm in perms:
-        if read_only:
-            if user.id in read_only or user.id.lower() in read_only:
-                if perm.split('_')[0] == perm_actions['view']:
-                    app_log.info(f"|__ Add READ ONLY permissions for user '{user.id}' - '{perm}'")
-                    user.perm_user.add(perm, through_defaults={'allow': allow})
-        if hide_users:
-            if user.id in hide_users or user.id.lower() in hide_users:
-                if perm.split('_')[0] == perm_actions['view']:
-                    continue
-
-        is_perm = user.is_perm(perm)
-        # Remove when permission is existed and User not in Updated list
-        if exited is not None and is_perm and user.id in items['existed']:
-            app_log.info(f"|__ Remove permissions user '{user.id}' - '{perm}'")
-            user.perm_user.remove(perm)
-        elif is_perm:
-            app_log.info(f"|__ Continue user '{user.id}' - '{perm}'")
-            continue
-        # Adding permissions to user
-        else:
-            app_log.info(f"|__ Add permissions for user '{user.id}' - '{perm}'")
-            user.perm_user.add(perm, through_defaults={'allow': allow})
-
-
-def update_group_perm(item_data, perms, items, allow, exited):
-    # Try to get Group
-    try:
-        group = GroupPerm.objects.get(name=item_data)
-    # Return errors with fields error
-    except models.ObjectDoesNotExist:
-        field = 'allow' if allow else 'restrict'
-        raise serializers.ValidationError({'message': f'Field error at "{field}_{items["type"]}"'})
-    hide_group = items.get('hide', None)
-    read_only = items.get('read_only', None)
-    if group is None:
-        return
-    print(f"Read only: {read_only} | Hide: {hide_group}")
-    # Looping handle with permissions
-    for perm in perms:
-        if read_only:
-            if group.name in read_only or group.name.lower() in read_only:
-                if perm.split('_')[0] == perm_actions['view']:
-                    app_log.info(f"|__ Add READ ONLY permissions for user '{group.name}' - '{perm}'")
-                    group.perm.add(perm, through_defaults={'allow': allow})
-        if hide_group:
-            if group.name in hide_group:
-                if perm.split('_')[0] == perm_actions['view']:
-                    continue
-        group_perm = group.perm.filter(name=perm)
-        is_perm = group_perm.exists() and group.perm_group.filter(perm_id=perm, allow=allow).exists()
-        # Remove when permission is existed and Group not in Updated list
-        if exited is not None and is_perm and group.name in items['existed']:
-            app_log.info(f"|__ Remove permissions group '{group.name}' - '{perm}'")
-            group.perm.remove(perm)
-        elif is_perm:
-            app_log.info(f"|__ Continue group '{group.name}' - '{perm}'")
-            continue
-        # Adding permissions to group
+def grant_object_perms(perms: list, users=None, groups=None, replace=True):
+    """
+    Allow users/groups on perms of an object.
+    replace=True removes allowed users/groups which are not in the given (non empty) list.
+    """
+    user_ids = resolve_users(users, 'allow')
+    group_names = resolve_groups(groups, 'allow')
+    apply_user_perms(perms, desired_perm_rows(user_ids, perms, True), replace_allow(replace and user_ids, None))
+    apply_group_perms(perms, desired_perm_rows(group_names, perms, True), replace_allow(replace and group_names, None))
+
+
+def replace_allow(allow_items, restrict_items):
+    allow = set()
+    if allow_items:
+        allow.add(True)
+    if restrict_items:
+        allow.add(False)
+    return allow
+
+
+def desired_perm_rows(owners, perms, allow, read_only=None, hide=None):
+    """ {(owner, perm): allow}, read only owners get view perms only, hidden owners get no view perms """
+    read_only = {item.upper() for item in read_only or []} | set(read_only or [])
+    hide = {item.upper() for item in hide or []} | set(hide or [])
+    view_perms = [perm for perm in perms if perm.split('_')[0] == perm_actions['view']]
+    rows = dict()
+    for owner in owners:
+        owner_perms = perms
+        if owner in read_only or owner.upper() in read_only:
+            owner_perms = view_perms
+        if owner in hide or owner.upper() in hide:
+            owner_perms = [perm for perm in owner_perms if perm not in view_perms]
+        for perm in owner_perms:
+            rows[(owner, perm)] = allow
+    return rows
+
+
+def resolve_users(items, field):
+    """ Get user ids from list of user id or phone number with one query each """
+    items = [item for item in items or [] if item is not None]
+    phones = dict()
+    user_ids = set()
+    for item in items:
+        is_phone, phone_number = phone_validate(item)
+        if is_phone:
+            phones[phone_number] = item
         else:
-            app_log.info(f"|__ Add permissions for group '{group.name}' - '{perm}'")
-            group.perm.add(perm, through_defaults={'allow': allow})
-
-
-def list_user_has_perm(perms: list, allow: bool):
-    user_perms = UserPerm.objects.filter(
-        Q(perm__name__in=perms,
-          user__is_superuser=False,
-          allow=allow)
-    ).distinct('user')
-    # Create user_id list in which user has perm
-    existed_user = []
-    for user in user_perms:
-        existed_user.append(user.user.id)
-    return existed_user
-
-
-def list_group_has_perm(perms: list, allow: bool):
-    # Get groups has perm
-    group_perms = GroupPerm.objects.filter(Q(perm__name__in=perms, allow=allow)).exclude(name=admin_role).distinct()
-    # Create group name list in which group has perm
-    existed_group = []
-    for group in group_perms:
-        existed_group.append(group.name)
-    return existed_group
+            user_ids.add(item.upper())
+
+    phone_users = dict(PhoneNumber.objects.filter(phone_number__in=list(phones)).values_list('phone_number', 'user_id'))
+    if len(phone_users) < len(phones):
+        raise serializers.ValidationError({'message': f'Field error at "{field}_users"'})
+    existed_ids = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    if len(existed_ids) < len(user_ids):
+        raise serializers.ValidationError({'message': f'Field error at "{field}_users" - some items not exists'})
+    return existed_ids | set(phone_users.values())
+
+
+def resolve_groups(items, field):
+    names = set(item for item in items or [] if item is not None)
+    existed = set(GroupPerm.objects.filter(name__in=names).values_list('name', flat=True))
+    if len(existed) < len(names):
+        raise serializers.ValidationError({'message': f'Field error at "{field}_group"'})
+    return existed
 
 
 def create_full_perm(model, _id=None, user_actions=None):
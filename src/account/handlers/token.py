@@ -1,6 +1,7 @@
 from rest_framework_simplejwt.exceptions import TokenError
 
 from account.models import RefreshToken
+from account.token_cache import invalidate_refresh_token
 from rest_framework_simplejwt.tokens import RefreshToken as RestRefreshToken, AccessToken
 
 from app.logs import app_log
@@ -14,6 +15,7 @@ def deactivate_user_token(user):
         token_obj.save()
         _token = RestRefreshToken(token_obj.refresh_token)
         _token.blacklist()
+        invalidate_refresh_token(_token['jti'])
 
 
 def deactivate_user_phone_token(user, phone):
@@ -25,6 +27,7 @@ def deactivate_user_phone_token(user, phone):
             token_obj.save()
             _token = RestRefreshToken(token_obj.refresh_token)
             _token.blacklist()
+            invalidate_refresh_token(_token['jti'])
         except TokenError:
             app_log.warning(f"deactive user phone token error: {phone}")
             pass
@@ -6,6 +6,7 @@ from rest_framework import permissions
 
 from account.handlers.perms import get_perm_name, get_action, get_required_permission, DataFKModel
 from account.models import UserPerm
+from account.perm_cache import get_perm_snapshot
 from app.logs import app_log
 from utils.constants import perm_actions
 from utils.perms.check import perm_exist
@@ -81,11 +82,13 @@ class ValidatePermRest(permissions.BasePermission):
         if object_pk is not None:
             return True
         action = get_action(view, request.method)
+        # Resolved perms of user, checking below not query database
+        snapshot = get_perm_snapshot(user)
 
         perm_name = get_perm_name(self.model)
         # Check all perm
         all_perm = perm_actions['all'] + f"_{perm_name}"
-        if user.is_group_has_perm(all_perm) or user.is_perm(all_perm):
+        if snapshot.is_group_has_perm(all_perm) or snapshot.is_perm(all_perm):
             print(f"user has all perm: {all_perm}")
             return True
 
@@ -108,19 +111,19 @@ class ValidatePermRest(permissions.BasePermission):
             self.message['errors'] = {message['field']: message['value']}
 
         # Set valid if user is allowed
-        user_has_perm = user.is_perm(required_permission)
+        user_has_perm = snapshot.is_perm(required_permission)
 
-        is_valid = user.is_group_allow(required_permission)
+        is_valid = snapshot.is_group_allow(required_permission)
         app_log.info(f"Check permission time: {time.time() - start_time}")
         # Create message errors
         if not result:
             message = f"bạn không đủ quyền để thực hiện {action} {perm_name}"
             self.message['message'] = message
         # Validate priority user perm
-        print(f"User is allow: {user.is_allow(required_permission)}")
+        print(f"User is allow: {snapshot.is_allow(required_permission)}")
         print(f"Check user {user} has perm: {user_has_perm}")
         if user_has_perm:
-            if user.is_allow(required_permission) and result:
+            if snapshot.is_allow(required_permission) and result:
                 print(f"User user.is_allow")
                 return True
             else:
@@ -141,10 +144,11 @@ class ValidatePermRest(permissions.BasePermission):
         action = get_action(view, request.method)
 
         # app_log.info(f"--- Test Permission Obj ---")
+        snapshot = get_perm_snapshot(user)
         perm_name = get_perm_name(self.model)
 
         all_perm = perm_actions['all'] + f"_{perm_name}"
-        if user.is_group_has_perm(all_perm) or user.is_perm(all_perm):
+        if snapshot.is_group_has_perm(all_perm) or snapshot.is_perm(all_perm):
             return True
 
         # Add PK to string perm
@@ -155,14 +159,14 @@ class ValidatePermRest(permissions.BasePermission):
 
         # If perm PK exist, handling validate perm user
         if perm is not None:
-            user_has_perm = user.is_perm(required_permission)
+            user_has_perm = snapshot.is_perm(required_permission)
             if user_has_perm:
-                if user.is_allow(required_permission):
+                if snapshot.is_allow(required_permission):
                     return True
                 else:
                     return False
             # Get user groups has permission
-            is_valid = user.is_group_allow(required_permission)
+            is_valid = snapshot.is_group_allow(required_permission)
             print(f"Test valid: {is_valid}")
             app_log.info(f"Check permission time: {time.time() - start_time}")
             if not is_valid:
@@ -178,6 +182,7 @@ class ValidatePermRest(permissions.BasePermission):
         """ Check relation of model with ForeignKey and its perms"""
         start_time = time.time()
         print(f"Check FK user: {user.id}")
+        snapshot = get_perm_snapshot(user)
         # Get list of ForeignKey fields
         fk_model = DataFKModel(self.model)
         list_fk = fk_model.get_fk_fields_models()
@@ -213,12 +218,12 @@ class ValidatePermRest(permissions.BasePermission):
                 continue
 
             # Validate user has perm
-            if user.is_allow(required_permission):
+            if snapshot.is_allow(required_permission):
                 print(f"User has perm {required_permission}")
                 # If user has perm, set perm to True
                 perm_pk[field_name]['is_perm'] = True
             # Validate user group has perm
-            elif user.is_group_allow(required_permission):
+            elif snapshot.is_group_allow(required_permission):
                 print(f"User group has perm {required_permission}")
                 # If user group has perm, set perm to True
                 perm_pk[field_name]['is_perm'] = True
@@ -238,21 +243,22 @@ class ValidatePermRest(permissions.BasePermission):
 
 
 def check_perm(user, permission: str, perm_name: str):
+    snapshot = get_perm_snapshot(user)
     all_perm = perm_actions['all'] + f"_{perm_name}"
     print(f"Check perm: {all_perm}")
-    if user.is_group_has_perm(all_perm) or user.is_perm(all_perm):
+    if snapshot.is_group_has_perm(all_perm) or snapshot.is_perm(all_perm):
         return True
 
     is_perm = perm_exist(permission)
     if not is_perm:
         return True
     print(f"Checking perm: {permission}")
-    user_has_perm = user.is_perm(permission)
+    user_has_perm = snapshot.is_perm(permission)
     if user_has_perm:
-        if not user.is_allow(permission):
+        if not snapshot.is_allow(permission):
             print(f"False here")
             return False
         return True
     # Get user groups has permission
-    is_valid = user.is_group_allow(permission)
+    is_valid = snapshot.is_group_allow(permission)
     return is_valid
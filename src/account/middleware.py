@@ -1,12 +1,12 @@
 from rest_framework import status
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError, AuthenticationFailed
 from django.http import JsonResponse
 from datetime import datetime
 from utils.constants import status as user_status
 from account.models import TokenMapping
+from account.token_cache import get_token_valid, set_token_valid
 
 
 def is_access_token_valid(access_token_jti):
@@ -45,15 +45,21 @@ class CheckBlacklistMiddleware:
 
         if user and token:
             try:
-                access_token = AccessToken(str(token))
-                access_token_jti = access_token['jti']
+                # Token is validated by authenticate, not decode again
+                access_token_jti = token['jti']
                 if user.status == user_status[1]:
                     return JsonResponse({'detail': 'User is inactive'}, status=401)
-                if not is_access_token_valid(access_token_jti):
+                is_valid = get_token_valid(access_token_jti)
+                if is_valid is None:
+                    is_valid = is_access_token_valid(access_token_jti)
+                    set_token_valid(access_token_jti, is_valid, token.get('exp'))
+                if not is_valid:
                     return JsonResponse({'detail': 'Access token\'s related refresh token has been blacklisted',
                                          'code': 'token_not_valid'}, status=401)
-            except TokenError as e:
+            except (TokenError, KeyError) as e:
                 return JsonResponse({'detail': f'Token error: {e}', 'code': 'token_not_valid'}, status=401)
+            # Pass authenticated result to view authentication
+            request.jwt_auth = (user, token)
 
         response = self.get_response(request)
         return response
@@ -0,0 +1,52 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_visibility(apps, schema_editor):
+    ObjectVisibility = apps.get_model('account', 'ObjectVisibility')
+    UserPerm = apps.get_model('account', 'UserPerm')
+    GroupPermPerms = apps.get_model('account', 'GroupPermPerms')
+
+    fields = ('perm_id', 'perm__content_type_id', 'perm__object_id')
+    rows = list()
+    user_perms = UserPerm.objects.filter(allow=True, perm__content_type__isnull=False).exclude(perm__object_id='')
+    for perm_id, content_type_id, object_id, user_id in user_perms.values_list(*fields, 'user_id').iterator():
+        rows.append(ObjectVisibility(perm_id=perm_id, user_id=user_id, content_type_id=content_type_id,
+                                     object_id=object_id, action=perm_id.split('_', 1)[0]))
+    group_perms = GroupPermPerms.objects.filter(allow=True, perm__content_type__isnull=False).exclude(perm__object_id='')
+    for perm_id, content_type_id, object_id, group_id in group_perms.values_list(*fields, 'group_id').iterator():
+        rows.append(ObjectVisibility(perm_id=perm_id, group_id=group_id, content_type_id=content_type_id,
+                                     object_id=object_id, action=perm_id.split('_', 1)[0]))
+    ObjectVisibility.objects.bulk_create(rows, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_user_note'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectVisibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.CharField(max_length=255)),
+                ('action', models.CharField(max_length=24)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('group', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='account.groupperm')),
+                ('perm', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibility', to='account.perm')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='account.user')),
+            ],
+            options={
+                'db_table': 'users_object_visibility',
+                'indexes': [
+                    models.Index(fields=['content_type', 'action', 'object_id'], name='visibility_object_idx'),
+                    models.Index(fields=['user', 'content_type', 'action'], name='visibility_user_idx'),
+                    models.Index(fields=['group', 'content_type', 'action'], name='visibility_group_idx'),
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_visibility, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+
+# Action is the first part of perm name, object id is the rest after '{action}_{app_label}_{model}_'
+BACKFILL_ACTION = """
+    UPDATE users_perm SET action = split_part(name, '_', 1)
+    WHERE action IS NULL AND split_part(name, '_', 1) IN ('all', 'view', 'create', 'update', 'destroy')
+"""
+BACKFILL_OBJECT_ID = """
+    UPDATE users_perm p
+    SET object_id = substr(p.name, length(p.action || '_' || ct.app_label || '_' || ct.model || '_') + 1)
+    FROM django_content_type ct
+    WHERE p.content_type_id = ct.id AND p.object_id = '' AND p.action IS NOT NULL
+      AND left(p.name, length(p.action || '_' || ct.app_label || '_' || ct.model || '_'))
+          = p.action || '_' || ct.app_label || '_' || ct.model || '_'
+"""
+# Rebuild visibility with object perms found by the object_id backfill
+REBUILD_VISIBILITY = """
+    DELETE FROM users_object_visibility;
+    INSERT INTO users_object_visibility (perm_id, user_id, group_id, content_type_id, object_id, action)
+    SELECT p.name, up.user_id, NULL, p.content_type_id, p.object_id, p.action
+    FROM users_user_perm up JOIN users_perm p ON p.name = up.perm_id
+    WHERE up.allow = TRUE AND p.content_type_id IS NOT NULL AND p.object_id <> '' AND p.action IS NOT NULL
+    UNION ALL
+    SELECT p.name, NULL, gpp.group_id, p.content_type_id, p.object_id, p.action
+    FROM users_groupperm_perm gpp JOIN users_perm p ON p.name = gpp.perm_id
+    WHERE gpp.allow = TRUE AND p.content_type_id IS NOT NULL AND p.object_id <> '' AND p.action IS NOT NULL
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0005_objectvisibility'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perm',
+            name='action',
+            field=models.CharField(blank=True, max_length=24, null=True),
+        ),
+        migrations.RunSQL(BACKFILL_ACTION, migrations.RunSQL.noop),
+        migrations.RunSQL(BACKFILL_OBJECT_ID, migrations.RunSQL.noop),
+        migrations.RunSQL(REBUILD_VISIBILITY, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='perm',
+            index=models.Index(fields=['content_type', 'object_id', 'action'], name='perm_object_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perm',
+            index=models.Index(fields=['content_type', 'action'], name='perm_model_action_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+# Keep the oldest row of each duplicated pair before adding unique constraints
+DEDUPE_USER_PERM = """
+    DELETE FROM users_user_perm a USING users_user_perm b
+    WHERE a.user_id = b.user_id AND a.perm_id = b.perm_id AND a.id > b.id
+"""
+DEDUPE_GROUP_PERM = """
+    DELETE FROM users_groupperm_perm a USING users_groupperm_perm b
+    WHERE a.group_id = b.group_id AND a.perm_id = b.perm_id AND a.id > b.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0006_perm_action'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DEDUPE_USER_PERM, migrations.RunSQL.noop),
+        migrations.RunSQL(DEDUPE_GROUP_PERM, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='userperm',
+            constraint=models.UniqueConstraint(fields=('user', 'perm'), name='unique_user_perm'),
+        ),
+        migrations.AddConstraint(
+            model_name='grouppermperms',
+            constraint=models.UniqueConstraint(fields=('group', 'perm'), name='unique_group_perm_perm'),
+        ),
+    ]
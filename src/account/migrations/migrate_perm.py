@@ -1,15 +1,14 @@
-from django.contrib.contenttypes.models import ContentType
 from django.db import migrations
 
-from account.models import Perm, GroupPerm
 from app.logs import app_log
 from app.settings import MY_APPS
 from utils.constants import perm_actions, admin_role
 
 
 def create_initial_permission(apps, schema_editor):
-    # ContentType = apps.get_model('contenttypes', 'ContentType')
-    # Perm = apps.get_model('account', 'Perm')
+    # Historical models: columns added by later migrations (Perm.action) don't exist yet, 0006 backfills them
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Perm = apps.get_model('account', 'Perm')
     content_types = ContentType.objects.all()
 
     for i, content_type in enumerate(content_types):
@@ -25,6 +24,8 @@ def create_initial_permission(apps, schema_editor):
 
 
 def create_admin_perm(apps, schema_editor):
+    Perm = apps.get_model('account', 'Perm')
+    GroupPerm = apps.get_model('account', 'GroupPerm')
     matching_perms = Perm.objects.filter(name__icontains='all')
     list_perms = list(matching_perms)
     group_perm, _ = GroupPerm.objects.get_or_create(name=admin_role)
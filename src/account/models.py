@@ -12,10 +12,13 @@ from django.utils import timezone
 from pyodbc import IntegrityError
 from rest_framework.exceptions import ValidationError
 
-from account.queries import get_all_user_perms_sql
+from account.delegation import apply_grant_access, propagate_grant_access, refresh_all_grant_access
+from account.perm_cache import invalidate_user_perms
+from account.token_cache import invalidate_access_tokens
+from account.visibility import sync_visibility
 from app.logs import app_log
-from utils.constants import maNhomND, admin_role
-from utils.helpers import self_id
+from utils.constants import maNhomND, admin_role, perm_actions
+from utils.helpers import insert_with_new_id
 
 
 # Custom command create_user or create_super user
@@ -85,7 +88,28 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     def save(self, *args, **kwargs):
         self.id = self.id.upper()
-        if not self.id or self.id == '':
+        new_id = not self.id or self.id == ''
+        # Username and password from id are set again when insert is retried with other id
+        use_id_username = not self.username or self.username == ''
+        use_id_password = self.password is None or self.password == ''
+
+        def set_id_fields():
+            if use_id_username:
+                self.username = self.id
+            if use_id_password:
+                self.password = make_password(self.id.lower())
+
+        if not new_id:
+            set_id_fields()
+        if self.email == '':
+            self.email = None
+        if self.email not in ['', None] and User.objects.filter(email=self.email).exclude(id=self.id).exists():
+            raise ValidationError(f"email {self.email} already existed")
+
+        self.status_user(self.status)
+
+        self.clean()
+        if new_id:
             match self.user_type:
                 case 'employee':
                     char = 'NV'
@@ -95,22 +119,12 @@ class User(AbstractBaseUser, PermissionsMixin):
                     char = 'ND'
                 case _:
                     char = 'KH'
-            self.id = self_id(char, User, 4)
-        self.username = self.username if self.username and self.username != '' else self.id
-        if self.password is None or self.password == '':
-            self.password = self.id.lower()
-            self.password = make_password(self.password)
-
-        if self.email == '':
-            self.email = None
-        if self.email not in ['', None] and User.objects.filter(email=self.email).exclude(id=self.id).exists():
-            raise ValidationError(f"email {self.email} already existed")
-
-        self.status_user(self.status)
-
-        self.clean()
-        super().save(*args, **kwargs)
+            insert_with_new_id(self, super().save, (char, 4), *args, prepare=set_id_fields, **kwargs)
+        else:
+            super().save(*args, **kwargs)
         self.create_profile()
+        # status_user use bulk_update which not send signals
+        invalidate_user_perms(self.id)
 
     def create_profile(self):
         match self.user_type:
@@ -165,6 +179,9 @@ class User(AbstractBaseUser, PermissionsMixin):
 
         UserGroupPerm.objects.bulk_update(groups, ['allow'])
         UserPerm.objects.bulk_update(perms, ['allow'])
+        # bulk_update không gọi signal
+        invalidate_user_perms(self.id)
+        sync_visibility(user_ids=[self.id])
 
     def is_perm(self, permission):
         return self.userperm_set.filter(perm=permission).exists()
@@ -264,7 +281,10 @@ class TokenMapping(models.Model):
     def save(self, *args, **kwargs):
         refresh_id = TokenMapping.objects.filter(refresh_jti=self.refresh_jti)
         if refresh_id.exists():
-            refresh_id.exclude(access_jti=self.access_jti).delete()
+            old_access = refresh_id.exclude(access_jti=self.access_jti)
+            # Older access tokens of this refresh token are no longer valid
+            invalidate_access_tokens(list(old_access.values_list('access_jti', flat=True)))
+            old_access.delete()
         super().save(*args, **kwargs)
 
 
@@ -313,9 +333,31 @@ class Perm(models.Model):
     content_type = models.ForeignKey(ContentType, null=True, blank=True, on_delete=models.CASCADE)
     object_id = models.CharField(max_length=255)
     content_object = GenericForeignKey('content_type', 'object_id')
+    # Name is '{action}_{app_label}_{model}[_{object_id}]', action is kept for indexed lookup
+    action = models.CharField(max_length=24, null=True, blank=True)
 
     class Meta:
         db_table = 'users_perm'
+        indexes = [
+            models.Index(fields=['content_type', 'object_id', 'action'], name='perm_object_idx'),
+            models.Index(fields=['content_type', 'action'], name='perm_model_action_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.set_structured_fields()
+        super().save(*args, **kwargs)
+
+    def set_structured_fields(self):
+        """ Fill action and object_id from name when they are not given """
+        if not self.action:
+            action = self.name.split('_', 1)[0]
+            if action in perm_actions['fall']:
+                self.action = action
+        if self.action and self.content_type_id and not self.object_id:
+            content_type = ContentType.objects.get_for_id(self.content_type_id)
+            prefix = f'{self.action}_{content_type.app_label}_{content_type.model}_'
+            if self.name.startswith(prefix):
+                self.object_id = self.name[len(prefix):]
 
 
 # GroupPerm as a Permissions Group or Roles User
@@ -357,6 +399,9 @@ class UserPerm(models.Model):
 
     class Meta:
         db_table = 'users_user_perm'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'perm'], name='unique_user_perm')
+        ]
 
     def __str__(self):
         return f"{self.user} - {self.perm}"
@@ -386,6 +431,9 @@ class GroupPermPerms(models.Model):
 
     class Meta:
         db_table = 'users_groupperm_perm'
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'perm'], name='unique_group_perm_perm')
+        ]
 
     def save(self, *args, **kwargs):
         if GroupPermPerms.objects.filter(perm=self.perm, group=self.group).exists():
@@ -393,6 +441,27 @@ class GroupPermPerms(models.Model):
         super().save(*args, **kwargs)
 
 
+class ObjectVisibility(models.Model):
+    """
+    Allowed object perms of users/groups with action and object split out of perm name,
+    kept in sync from UserPerm/GroupPermPerms by account.visibility, used by perm_queryset.
+    """
+    perm = models.ForeignKey(Perm, on_delete=models.CASCADE, related_name='visibility')
+    user = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
+    group = models.ForeignKey(GroupPerm, null=True, on_delete=models.CASCADE)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+    action = models.CharField(max_length=24)
+
+    class Meta:
+        db_table = 'users_object_visibility'
+        indexes = [
+            models.Index(fields=['content_type', 'action', 'object_id'], name='visibility_object_idx'),
+            models.Index(fields=['user', 'content_type', 'action'], name='visibility_user_idx'),
+            models.Index(fields=['group', 'content_type', 'action'], name='visibility_group_idx'),
+        ]
+
+
 class GrantAccess(models.Model):
     manager = models.ForeignKey(User, related_name='managed_grants', on_delete=models.CASCADE)
     grant_user = models.ForeignKey(User, related_name='granted_access', on_delete=models.CASCADE)
@@ -412,43 +481,16 @@ class GrantAccess(models.Model):
     def save(self, *args, **kwargs):
         if self.active and not self.allow:
             self.active = self.allow
-        grant_accesses = GrantAccess.objects.filter(manager=self.manager, active=True).exclude(id=self.id)
-        if grant_accesses.exists():
-            for grant_access in grant_accesses:
-                grant_access.active = False
-                grant_access.save()
-        # self.active = self.allow
-        super().save(*args, **kwargs)
         with transaction.atomic():
-            if self.allow and self.active:
-                self.grant_perm_manager()
-            else:
-                print(f"Remove perms")
-                self.remove_grant_perm()
-
-    def grant_perm_manager(self):
-        before_manage_perm = get_all_user_perms_sql(self.manager.id)
-        user_perms = get_all_user_perms_sql(self.grant_user.id)
-
-        adding_perm = list(set(user_perms) - set(before_manage_perm))
-        # print(f"Check adding perm: {adding_perm}")
-        for perm in adding_perm:
-            app_log.info(f"TEST PERMNAME: {perm}")
-            allow = True
-            perm_obj = self.grant_user.userperm_set.filter(perm=perm).first()
-            if perm_obj:
-                allow = perm_obj.allow
-            groupperm_obj = get_highest_level_group_for_permission(self.grant_user, perm)
-            if groupperm_obj:
-                allow = groupperm_obj.allow
-            self.grant_perms.add(perm)
-            self.manager.perm_user.add(perm, through_defaults={'allow': allow})
-
-    def remove_grant_perm(self):
-        grant_perm = self.grant_perms.all()
-        for perm in grant_perm:
-            self.manager.perm_user.remove(perm)
-        self.grant_perms.clear()
+            # Manager has only one active grant
+            other_ids = []
+            if self.active:
+                other_ids = list(GrantAccess.objects.filter(manager=self.manager, active=True)
+                                 .exclude(id=self.id).values_list('id', flat=True))
+                GrantAccess.objects.filter(id__in=other_ids).update(active=False)
+            super().save(*args, **kwargs)
+            diff = apply_grant_access(GrantAccess.objects.filter(id__in=other_ids + [self.id]))
+            propagate_grant_access(diff.managers)
 
 
 def get_user_group_permissions(user):
@@ -482,15 +524,9 @@ def get_highest_level_group_for_permission(user, permission) -> GroupPermPerms:
     return highest_level_group_perm_perm
 
 
-def refresh_access():
-    grant_accesses = GrantAccess.objects.filter(allow=True)
-    grant_accesses_now = list(grant_accesses)
-    for grant_access in grant_accesses:
-        grant_access.allow = False
-        grant_access.save()
-    for grant_access in grant_accesses_now:
-        grant_access.allow = True
-        grant_access.save()
+def refresh_access(dry_run=False):
+    """ Recompute delegated perms of all grants, dry_run returns diff without writing """
+    return refresh_all_grant_access(dry_run)
 
 
 """
@@ -0,0 +1,118 @@
+import json
+
+import redis
+from django.apps import apps
+from django.db import transaction
+
+from app.logs import app_log
+from app.redis_db import redis_db, perm_snapshot_key, perm_snapshot_version_key
+
+# Snapshot is rebuilt at least this often even without invalidation
+SNAPSHOT_TTL = 60 * 30
+
+
+class PermSnapshot:
+    """
+    Resolved permission set of one user.
+    Same checks as User.is_perm / is_allow / is_group_has_perm / is_group_allow but answered from memory.
+    """
+
+    def __init__(self, direct: dict, group: dict):
+        # {perm_name: UserPerm.allow}
+        self.direct = direct
+        # {perm_name: UserGroupPerm.allow of the highest level group has perm}
+        self.group = group
+
+    def is_perm(self, permission):
+        return permission in self.direct
+
+    def is_allow(self, permission):
+        return self.direct.get(permission, False)
+
+    def is_group_has_perm(self, permission):
+        return permission in self.group
+
+    def is_group_allow(self, permission):
+        return self.group.get(permission, False)
+
+    def to_json(self, version):
+        return json.dumps({'v': version, 'direct': self.direct, 'group': self.group})
+
+
+def build_perm_snapshot(user_id) -> PermSnapshot:
+    UserPerm = apps.get_model('account', 'UserPerm')
+    UserGroupPerm = apps.get_model('account', 'UserGroupPerm')
+
+    direct = dict(UserPerm.objects.filter(user_id=user_id).values_list('perm_id', 'allow'))
+
+    group = dict()
+    levels = dict()
+    group_rows = UserGroupPerm.objects.filter(user_id=user_id).values_list(
+        'group__perm_group__perm_id', 'group__level', 'allow')
+    for perm_name, level, allow in group_rows:
+        if perm_name is None:
+            continue
+        # Highest level group decides, same as User.is_group_allow
+        if perm_name not in levels or level > levels[perm_name]:
+            levels[perm_name] = level
+            group[perm_name] = allow
+    return PermSnapshot(direct, group)
+
+
+def get_perm_snapshot(user) -> PermSnapshot:
+    """ Get snapshot from request user, then Redis, build from database when missing or outdated """
+    snapshot = getattr(user, '_perm_snapshot', None)
+    if snapshot is not None:
+        return snapshot
+
+    key = perm_snapshot_key(user.id)
+    version = None
+    try:
+        version, data = redis_db.mget(perm_snapshot_version_key(), key)
+        version = version or '0'
+        if data:
+            data = json.loads(data)
+            if data.get('v') == version:
+                snapshot = PermSnapshot(data['direct'], data['group'])
+    except redis.RedisError as e:
+        app_log.error(f"Error get perm snapshot {user.id}: {e}")
+
+    if snapshot is None:
+        snapshot = build_perm_snapshot(user.id)
+        if version is not None:
+            try:
+                redis_db.setex(key, SNAPSHOT_TTL, snapshot.to_json(version))
+            except redis.RedisError as e:
+                app_log.error(f"Error set perm snapshot {user.id}: {e}")
+
+    user._perm_snapshot = snapshot
+    return snapshot
+
+
+def _delete_snapshots(user_ids):
+    try:
+        redis_db.delete(*[perm_snapshot_key(user_id) for user_id in user_ids])
+    except redis.RedisError as e:
+        app_log.error(f"Error invalidate perm snapshot {user_ids}: {e}")
+
+
+def _bump_version():
+    try:
+        redis_db.incr(perm_snapshot_version_key())
+    except redis.RedisError as e:
+        app_log.error(f"Error invalidate all perm snapshot: {e}")
+
+
+def invalidate_user_perms(*user_ids):
+    """ Drop snapshot of users now and again after commit, so a concurrent rebuild can't keep old data """
+    user_ids = [user_id for user_id in user_ids if user_id]
+    if not user_ids:
+        return
+    _delete_snapshots(user_ids)
+    transaction.on_commit(lambda: _delete_snapshots(user_ids))
+
+
+def invalidate_all_perms():
+    """ Outdate every snapshot, used when group perms change """
+    _bump_version()
+    transaction.on_commit(_bump_version)
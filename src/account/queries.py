@@ -1,8 +1,15 @@
+from typing import NamedTuple
+
 from django.apps import apps
+from django.db import connection, transaction
+
 
-from utils.env import PGS_DB, PGS_PASSWORD, PGS_USER, PGS_HOST, PGS_PORT
-import psycopg2
-from psycopg2.extras import RealDictCursor
+class PermResolution(NamedTuple):
+    # UserPerm.allow, None when user not has perm directly
+    allow: bool | None
+    # GroupPermPerms.allow of highest level group, None when no group has perm
+    group_allow: bool | None
+    group_level: int | None
 
 
 def get_all_user_perms(user):
@@ -24,14 +31,7 @@ def get_all_user_perms(user):
 def get_all_user_perms_sql(user_id, exact=True):
     Perm, User, UserGroupPerm, GroupPerm, UserPerm, GroupPermPerms = get_user_model()
 
-    conn = psycopg2.connect(
-        dbname=PGS_DB,
-        user=PGS_USER,
-        password=PGS_PASSWORD,
-        host=PGS_HOST,
-        port=PGS_PORT
-    )
-    cur = conn.cursor()
+    cur = connection.cursor()
 
     perm_table = Perm._meta.db_table
     user_perm_table = UserPerm._meta.db_table
@@ -84,100 +84,128 @@ def get_all_user_perms_sql(user_id, exact=True):
     group_perms = cur.fetchall()
 
     cur.close()
-    conn.close()
 
     perm_names = [perm[0] for perm in direct_perms + group_perms]
     perm_objs = Perm.objects.filter(name__in=perm_names).distinct()
     return list(perm_objs)
 
 
-def get_user_by_permname_sql(perm_name, exact=True):
+def user_perms_union_query(user_filter):
+    """ Direct perms and perms from allowed groups of user, in one UNION query """
     Perm, User, UserGroupPerm, GroupPerm, UserPerm, GroupPermPerms = get_user_model()
+    return f"""
+        SELECT up.user_id, up.perm_id, up.allow, NULL AS group_allow, NULL AS group_level
+        FROM {UserPerm._meta.db_table} up
+        WHERE up.user_id {user_filter}
+        UNION ALL
+        SELECT ugp.user_id, gpp.perm_id, NULL AS allow, gpp.allow AS group_allow, gp.level AS group_level
+        FROM {GroupPermPerms._meta.db_table} gpp
+        JOIN {GroupPerm._meta.db_table} gp ON gpp.group_id = gp.name
+        JOIN {UserGroupPerm._meta.db_table} ugp ON gp.name = ugp.group_id
+        WHERE ugp.user_id {user_filter} AND ugp.allow = TRUE
+    """
 
-    conn = psycopg2.connect(
-        dbname=PGS_DB,
-        user=PGS_USER,
-        password=PGS_PASSWORD,
-        host=PGS_HOST,
-        port=PGS_PORT
-    )
-    cur = conn.cursor()
 
-    user_table = User._meta.db_table
-    user_group_perm_table = UserGroupPerm._meta.db_table
-    group_perm_table = GroupPerm._meta.db_table
-    user_perm_table = UserPerm._meta.db_table
-    perm_table = Perm._meta.db_table
-    groupperm_perm_table = GroupPermPerms._meta.db_table
+def resolve_perm_rows(rows) -> dict:
+    """ Merge union rows to {user_id: {perm_name: PermResolution}} """
+    result = dict()
+    for user_id, perm_name, allow, group_allow, group_level in rows:
+        user_perms = result.setdefault(user_id, dict())
+        current = user_perms.get(perm_name, PermResolution(None, None, None))
+        if allow is not None:
+            current = current._replace(allow=allow)
+        if group_level is not None and (current.group_level is None or group_level > current.group_level):
+            current = current._replace(group_allow=group_allow, group_level=group_level)
+        user_perms[perm_name] = current
+    return result
+
 
+def get_user_perm_names(user_id) -> frozenset:
+    """ Effective perm names of user (same set as get_all_user_perms_sql) in one query """
+    Perm, User, UserGroupPerm, GroupPerm, UserPerm, GroupPermPerms = get_user_model()
     query = f"""
-        SELECT DISTINCT u.id
-        FROM {user_table} u
-        LEFT JOIN {user_group_perm_table} ugp ON u.id = ugp.user_id
-        LEFT JOIN {group_perm_table} gp ON ugp.group_id = gp.name
-        LEFT JOIN {groupperm_perm_table} gpp ON gp.name = gpp.group_id
-        LEFT JOIN {perm_table} p1 ON gpp.perm_id = p1.name
-        LEFT JOIN {user_perm_table} up ON u.id = up.user_id
-        LEFT JOIN {perm_table} p2 ON up.perm_id = p2.name
-        """
-    if exact:
-        query += f"""
-            WHERE (gpp.allow = TRUE AND p1.name = %s)
-            OR (up.allow = TRUE AND p2.name = %s)
-        """
-    else:
-        perm_name = f"%{perm_name}%"
-        query += f"""
-                    WHERE (gpp.allow = TRUE AND p1.name LIKE %s)
-                       OR (up.allow = TRUE AND p2.name LIKE %s)
-                """
-    cur.execute(query, (perm_name, perm_name))
-    user_ids = cur.fetchall()
+        SELECT up.perm_id
+        FROM {UserPerm._meta.db_table} up
+        WHERE up.user_id = %s
+        UNION
+        SELECT gpp.perm_id
+        FROM {GroupPermPerms._meta.db_table} gpp
+        JOIN {UserGroupPerm._meta.db_table} ugp ON gpp.group_id = ugp.group_id
+        WHERE ugp.user_id = %s AND ugp.allow = TRUE
+    """
+    with connection.cursor() as cur:
+        cur.execute(query, (user_id, user_id))
+        return frozenset(row[0] for row in cur.fetchall())
 
-    cur.close()
-    conn.close()
 
-    return [user_id[0] for user_id in user_ids]
+def get_user_perm_details(user_id) -> dict:
+    """ {perm_name: PermResolution} of user, include allow flag and winning group level """
+    with connection.cursor() as cur:
+        cur.execute(user_perms_union_query('= %s'), (user_id, user_id))
+        return resolve_perm_rows(cur.fetchall()).get(user_id, dict())
+
+
+def get_users_perm_names(user_ids) -> dict:
+    """ Bulk version of get_user_perm_names: {user_id: frozenset(perm_name)} """
+    return {user_id: frozenset(perms) for user_id, perms in get_users_perm_details(user_ids).items()}
 
 
-def get_user_like_permname_sql(perm_name):
+def get_users_perm_details(user_ids) -> dict:
+    """ Bulk version of get_user_perm_details: {user_id: {perm_name: PermResolution}} """
+    user_ids = list(user_ids)
+    result = {user_id: dict() for user_id in user_ids}
+    if not user_ids:
+        return result
+    with connection.cursor() as cur:
+        cur.execute(user_perms_union_query('= ANY(%s)'), (user_ids, user_ids))
+        result.update(resolve_perm_rows(cur.fetchall()))
+    return result
+
+
+def get_users_group_perm_names(user_ids) -> dict:
+    """ {user_id: set(perm_name)} of perms users get from their allowed groups, one query """
+    Perm, User, UserGroupPerm, GroupPerm, UserPerm, GroupPermPerms = get_user_model()
+    user_ids = list(user_ids)
+    result = {user_id: set() for user_id in user_ids}
+    if not user_ids:
+        return result
+    query = f"""
+        SELECT DISTINCT ugp.user_id, gpp.perm_id
+        FROM {GroupPermPerms._meta.db_table} gpp
+        JOIN {UserGroupPerm._meta.db_table} ugp ON gpp.group_id = ugp.group_id
+        WHERE ugp.user_id = ANY(%s) AND ugp.allow = TRUE
+    """
+    with connection.cursor() as cur:
+        cur.execute(query, (user_ids,))
+        for user_id, perm_name in cur.fetchall():
+            result[user_id].add(perm_name)
+    return result
+
+
+def get_user_by_permname_sql(perm_name):
+    """ Users allowed perm directly or by an allowed group perm, exact name match use primary key """
     Perm, User, UserGroupPerm, GroupPerm, UserPerm, GroupPermPerms = get_user_model()
 
-    conn = psycopg2.connect(
-        dbname=PGS_DB,
-        user=PGS_USER,
-        password=PGS_PASSWORD,
-        host=PGS_HOST,
-        port=PGS_PORT
-    )
-    cur = conn.cursor()
+    cur = connection.cursor()
 
-    user_table = User._meta.db_table
     user_group_perm_table = UserGroupPerm._meta.db_table
-    group_perm_table = GroupPerm._meta.db_table
     user_perm_table = UserPerm._meta.db_table
-    perm_table = Perm._meta.db_table
     groupperm_perm_table = GroupPermPerms._meta.db_table
 
     query = f"""
-        SELECT DISTINCT u.id
-        FROM {user_table} u
-        LEFT JOIN {user_group_perm_table} ugp ON u.id = ugp.user_id
-        LEFT JOIN {group_perm_table} gp ON ugp.group_id = gp.name
-        LEFT JOIN {groupperm_perm_table} gpp ON gp.name = gpp.group_id
-        LEFT JOIN {perm_table} p1 ON gpp.perm_id = p1.name
-        LEFT JOIN {user_perm_table} up ON u.id = up.user_id
-        LEFT JOIN {perm_table} p2 ON up.perm_id = p2.name
-        WHERE (gpp.allow = TRUE AND p1.name LIKE %s)
-           OR (up.allow = TRUE AND p2.name LIKE %s)
+        SELECT up.user_id
+        FROM {user_perm_table} up
+        WHERE up.perm_id = %s AND up.allow = TRUE
+        UNION
+        SELECT ugp.user_id
+        FROM {groupperm_perm_table} gpp
+        JOIN {user_group_perm_table} ugp ON ugp.group_id = gpp.group_id
+        WHERE gpp.perm_id = %s AND gpp.allow = TRUE
         """
-
-    perm_name_pattern = f"%{perm_name}%"
-    cur.execute(query, (perm_name_pattern, perm_name_pattern))
+    cur.execute(query, (perm_name, perm_name))
     user_ids = cur.fetchall()
 
     cur.close()
-    conn.close()
 
     return [user_id[0] for user_id in user_ids]
 
@@ -185,30 +213,54 @@ def get_user_like_permname_sql(perm_name):
 def project_db_execute(query, params):
     """
     Executes a PostgreSQL query and returns the result.
+    Use Django connection of current thread (persistent by CONN_MAX_AGE), not open new connection each call.
+    Runs in a savepoint of the caller's transaction, so it sees rows the caller has not committed yet.
     :param query: The SQL query to be executed.
     :param params: A tuple of parameters to be used in the query.
     :return: The result of the query as a list of dictionaries.
     """
-    conn = psycopg2.connect(
-        dbname=PGS_DB,
-        user=PGS_USER,
-        password=PGS_PASSWORD,
-        host=PGS_HOST,
-        port=PGS_PORT
-    )
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+    with transaction.atomic():
+        with connection.cursor() as cursor:
             cursor.execute(query, params)
-            result = cursor.fetchall()
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+            result = dictfetchall(cursor)
     return result
 
 
+def delete_rows_by_ids(model, ids):
+    """
+    Delete rows of model by primary keys in one statement.
+    Skip Django collector and per row signals, caller handles side effects.
+    """
+    if not ids:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {model._meta.db_table} WHERE {model._meta.pk.column} = ANY(%s)", (list(ids),))
+        return cursor.rowcount
+
+
+def project_db_iterate(query, params, chunk_size=2000):
+    """
+    Executes a PostgreSQL query with server-side cursor, yield each row as dictionary.
+    Use for large result which should not be loaded into memory at once.
+    Named cursor lives in a transaction, consume the generator before the caller transaction ends.
+    """
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(query, params)
+        # Server-side cursor has description after first fetch
+        rows = cursor.fetchmany(chunk_size)
+        columns = [col[0] for col in cursor.description] if rows else []
+        while rows:
+            for row in rows:
+                yield dict(zip(columns, row))
+            rows = cursor.fetchmany(chunk_size)
+
+
+def dictfetchall(cursor):
+    """ Return all rows from a cursor as a list of dictionaries, same as RealDictCursor """
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
 def get_user_model():
     Perm = apps.get_model('account', 'Perm')
     User = apps.get_model('account', 'User')
@@ -1,11 +1,14 @@
 from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
-from django.db.models.signals import post_save, m2m_changed, pre_delete
+from django.db.models.signals import post_save, m2m_changed, pre_delete, post_delete
 from django.dispatch import receiver
 
-from account.handlers.perms import get_perm_name
-from account.models import User, UserGroupPerm, GroupPerm, UserPerm, GrantAccess, Perm
-from account.queries import get_all_user_perms_sql
+from account.models import User, UserGroupPerm, GroupPerm, UserPerm, GrantAccess, Perm, GroupPermPerms, \
+    ObjectVisibility
+from account.delegation import propagate_grant_access, propagate_group_grant_access
+from account.perm_cache import invalidate_user_perms, invalidate_all_perms
+from account.visibility import sync_visibility
 from app.logs import app_log
 from utils.insert_db.default_roles_perms import set_user_perm
 
@@ -55,56 +58,110 @@ def create_user_permissions(sender, instance, created, **kwargs):
 
 
 @receiver(m2m_changed, sender=User.perm_user.through)
+@receiver(m2m_changed, sender=User.group_user.through)
 def handle_user_perm_change(sender, instance, action, reverse, model, pk_set, **kwargs):
-    update_grant_access(instance)
-
-
-def update_grant_access(user):
-    access_users = GrantAccess.objects.filter(grant_user=user, active=True)
-    if access_users.exists():
-        print(f"__ Updating new perm for manager - {user.id}")
-        handle_grant_perm(access_users.first())
-
-
-def handle_grant_perm(grant_user_obj: GrantAccess):
-    # Get current grant_user perms
-    user_current_perms = get_all_user_perms_sql(grant_user_obj.grant_user.id)
-    # Get newest grant_user perms
-    # user_perms = grant_user_obj.grant_user.perm_user.all()
-    user_perms = grant_user_obj.grant_user.get_all_user_perms()
-    # user_group_perms = grant_user_obj.grant_user.usergroupperm_set.all()
-    # Get grant perms of manager
-    rent_perm = grant_user_obj.grant_perms.all()
-    # Get current manager perms
-    current_perm = get_all_user_perms_sql(grant_user_obj.manager.id)
-    # Get origin manager perms
-    before_manage_perm = list(set(current_perm) - set(rent_perm))
-    # Get new perm for adding
-    new_perm = set(user_perms) - set(user_current_perms)
-    # Get difference perm for removing
-    remove_perm = set(user_current_perms) - set(user_perms) - set(before_manage_perm)
-    # Looping to add perms
-    for perm in new_perm:
-        # print(f"Adding: {perm} for manager {grant_user_obj.manager}")
-        grant_user_obj.grant_perms.add(perm)
-        perm_obj = grant_user_obj.grant_user.userperm_set.get(perm=perm)
-        grant_user_obj.manager.perm_user.add(perm, through_defaults={'allow': perm_obj.allow})
-    for perm in remove_perm:
-        # print(f"Adding: {perm} for manager {grant_user_obj.manager}")
-        grant_user_obj.grant_perms.remove(perm)
-        # Error when use 'perm_user.remove(perm)'
-        UserPerm.objects.filter(perm=perm, user=grant_user_obj.manager).delete()
-        # grant_user_obj.manager.perm_user.remove(perm)
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        propagate_grant_access([instance.pk])
+    elif pk_set:
+        propagate_grant_access(pk_set)
+    elif sender is User.group_user.through:
+        propagate_group_grant_access([instance.pk])
+    else:
+        propagate_grant_access(GrantAccess.objects.filter(active=True).values_list('grant_user_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=UserPerm)
+@receiver([post_save, post_delete], sender=UserGroupPerm)
+def handle_user_rela_grant_access(sender, instance, **kwargs):
+    propagate_grant_access([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=GroupPermPerms)
+def handle_group_perm_grant_access(sender, instance, **kwargs):
+    propagate_group_grant_access([instance.group_id])
+
+
+@receiver(m2m_changed, sender=GroupPerm.perm.through)
+def handle_group_perm_m2m_grant_access(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        propagate_group_grant_access([instance.pk])
+    elif pk_set:
+        propagate_group_grant_access(pk_set)
+
+
+@receiver([post_save, post_delete], sender=UserPerm)
+@receiver([post_save, post_delete], sender=UserGroupPerm)
+def invalidate_snapshot_on_user_rela_change(sender, instance, **kwargs):
+    invalidate_user_perms(instance.user_id)
+
+
+@receiver(m2m_changed, sender=User.perm_user.through)
+@receiver(m2m_changed, sender=User.group_user.through)
+def invalidate_snapshot_on_user_m2m_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_user_perms(instance.pk)
+    elif pk_set:
+        # Perm/GroupPerm side changed, pk_set is user ids
+        invalidate_user_perms(*pk_set)
+    else:
+        invalidate_all_perms()
+
+
+@receiver([post_save, post_delete], sender=GroupPermPerms)
+@receiver([post_save, post_delete], sender=GroupPerm)
+def invalidate_snapshot_on_group_change(sender, instance, **kwargs):
+    # Group perm change affects every user in group
+    invalidate_all_perms()
+
+
+@receiver(m2m_changed, sender=GroupPerm.perm.through)
+def invalidate_snapshot_on_group_perm_m2m_change(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate_all_perms()
+
+
+@receiver([post_save, post_delete], sender=UserPerm)
+def sync_visibility_on_user_perm_change(sender, instance, **kwargs):
+    sync_visibility(perm_names=[instance.perm_id], user_ids=[instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=GroupPermPerms)
+def sync_visibility_on_group_perm_change(sender, instance, **kwargs):
+    sync_visibility(perm_names=[instance.perm_id], group_ids=[instance.group_id])
+
+
+@receiver(m2m_changed, sender=User.perm_user.through)
+def sync_visibility_on_user_perm_m2m_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if reverse:
+        # instance is Perm, pk_set is user ids (None when clear)
+        sync_visibility(perm_names=[instance.pk], user_ids=pk_set)
+    else:
+        sync_visibility(perm_names=pk_set, user_ids=[instance.pk])
+
+
+@receiver(m2m_changed, sender=GroupPerm.perm.through)
+def sync_visibility_on_group_perm_m2m_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if reverse:
+        sync_visibility(perm_names=[instance.pk], group_ids=pk_set)
+    else:
+        sync_visibility(perm_names=pk_set, group_ids=[instance.pk])
 
 
 def handle_pre_delete(sender, instance, **kwargs):
+    """ Delete object perms of deleted instance by indexed (content_type, object_id) """
     try:
-        perm_name = get_perm_name(instance)
-        perm_name_id = f"{perm_name}_{instance.pk}"
-        perms = Perm.objects.filter(name__endswith=perm_name_id)
-        for perm in perms:
-            print(f"handle_pre_delete: {perm.pk}")
-        perms.delete()
+        content_type = ContentType.objects.get_for_model(instance)
+        Perm.objects.filter(content_type=content_type, object_id=str(instance.pk)).delete()
     except Exception as e:
         app_log.error(f"Error signal pre_delete: {instance.pk}\n{e}")
 
@@ -113,4 +170,7 @@ all_models = apps.get_models()
 
 # Đăng ký signal cho mọi model
 for model in all_models:
+    # Perm tables never have object perms, keep them fast delete
+    if model in (ObjectVisibility, Perm, UserPerm, GroupPermPerms, UserGroupPerm):
+        continue
     pre_delete.connect(handle_pre_delete, sender=model)
@@ -0,0 +1,10 @@
+from celery import shared_task
+
+from account.delegation import refresh_all_grant_access
+
+
+@shared_task
+def refresh_access_task(dry_run=False):
+    diff = refresh_all_grant_access(dry_run)
+    return {'grants': diff.grants, 'added': diff.added, 'updated': diff.updated, 'removed': diff.removed,
+            'size': diff.size}
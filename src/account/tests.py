@@ -1,3 +1,216 @@
+from functools import partial
+from types import SimpleNamespace
+
+from django.contrib.auth.models import AnonymousUser
 from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from account.handlers.bulk_perms import diff_perm_rows
+from account.handlers.bulk_users import bulk_create_users
+from account.handlers.restrict_serializer import create_full_perm, grant_object_perms
+from account.handlers.validate_perm import ValidatePermRest
+from account.models import User, Perm, UserPerm, GroupPerm, UserGroupPerm, GroupPermPerms, GrantAccess
+from account.perm_cache import invalidate_user_perms, get_perm_snapshot
+from account.queries import project_db_iterate
+from utils.constants import perm_actions, admin_role
+from utils.helpers import id_prefix_of
+
+VIEW_PERM = 'view_account_user'
+CREATE_PERM = 'create_account_user'
+ALL_PERM = 'all_account_user'
+
+
+def create_users(*user_ids):
+    """ Users without profile and default groups, snapshots left in Redis by earlier runs are dropped """
+    users = User.objects.bulk_create([User(id=user_id, username=user_id, password='!', user_type='employee',
+                                           status='active') for user_id in user_ids])
+    invalidate_user_perms(*user_ids)
+    return users
+
 
 # Create your tests here.
+class ValidatePermRestTest(TestCase):
+    def setUp(self):
+        self.user, = create_users('TESTPERM01')
+        for name in [VIEW_PERM, CREATE_PERM, ALL_PERM]:
+            Perm.objects.create(name=name)
+        self.group = GroupPerm.objects.create(name='test_group', level=1)
+
+    def has_permission(self, method='post', user=None, allow_view=True, **kwargs):
+        request = Request(getattr(APIRequestFactory(), method)('/api/', {}, format='json'))
+        # Fresh user object, snapshot is read from Redis or built again
+        request.user = user or User.objects.get(id=self.user.id)
+        permission = partial(ValidatePermRest, model=User, allow_view=allow_view)()
+        return permission.has_permission(request, SimpleNamespace(kwargs=kwargs))
+
+    def test_anonymous_is_denied(self):
+        self.assertFalse(self.has_permission(user=AnonymousUser()))
+
+    def test_user_without_perm_is_denied(self):
+        self.assertFalse(self.has_permission())
+
+    def test_direct_perm(self):
+        UserPerm.objects.create(user=self.user, perm_id=CREATE_PERM, allow=True)
+        self.assertTrue(self.has_permission())
+
+    def test_group_perm(self):
+        UserGroupPerm.objects.create(user=self.user, group=self.group, allow=True)
+        GroupPermPerms.objects.create(group=self.group, perm_id=CREATE_PERM, allow=True)
+        self.assertTrue(self.has_permission())
+
+    def test_denied_direct_perm_has_priority_over_group(self):
+        UserGroupPerm.objects.create(user=self.user, group=self.group, allow=True)
+        GroupPermPerms.objects.create(group=self.group, perm_id=CREATE_PERM, allow=True)
+        UserPerm.objects.create(user=self.user, perm_id=CREATE_PERM, allow=False)
+        self.assertFalse(self.has_permission())
+
+    def test_all_perm(self):
+        UserPerm.objects.create(user=self.user, perm_id=ALL_PERM, allow=True)
+        self.assertTrue(self.has_permission(method='delete'))
+
+    def test_view(self):
+        self.assertTrue(self.has_permission(method='get'))
+        self.assertFalse(self.has_permission(method='get', allow_view=False))
+        UserPerm.objects.create(user=self.user, perm_id=VIEW_PERM, allow=True)
+        self.assertTrue(self.has_permission(method='get', allow_view=False))
+
+    def test_snapshot_is_invalidated_by_perm_change(self):
+        self.assertFalse(self.has_permission())
+        user_perm = UserPerm.objects.create(user=self.user, perm_id=CREATE_PERM, allow=True)
+        self.assertTrue(self.has_permission())
+        user_perm.delete()
+        self.assertFalse(self.has_permission())
+
+    def test_snapshot_is_kept_on_request_user(self):
+        user = User.objects.get(id=self.user.id)
+        self.assertFalse(self.has_permission(user=user))
+        UserPerm.objects.create(user=self.user, perm_id=CREATE_PERM, allow=True)
+        # Same request, same answer
+        self.assertFalse(self.has_permission(user=user))
+
+
+class GrantAccessTest(TestCase):
+    def setUp(self):
+        self.manager, self.grant_user = create_users('TESTMNG01', 'TESTGRT01')
+        for name in [VIEW_PERM, CREATE_PERM]:
+            Perm.objects.create(name=name)
+
+    def manager_perms(self):
+        return dict(UserPerm.objects.filter(user=self.manager).values_list('perm_id', 'allow'))
+
+    def test_grant_delegates_perms_of_grant_user(self):
+        UserPerm.objects.create(user=self.grant_user, perm_id=CREATE_PERM, allow=True)
+        grant = GrantAccess.objects.create(manager=self.manager, grant_user=self.grant_user, active=True, allow=True)
+        self.assertEqual(self.manager_perms(), {CREATE_PERM: True})
+        self.assertEqual(set(grant.grant_perms.values_list('name', flat=True)), {CREATE_PERM})
+
+        grant.active = False
+        grant.save()
+        self.assertEqual(self.manager_perms(), {})
+        self.assertFalse(grant.grant_perms.exists())
+
+    def test_perm_change_of_grant_user_in_same_transaction(self):
+        GrantAccess.objects.create(manager=self.manager, grant_user=self.grant_user, active=True, allow=True)
+        user_perm = UserPerm.objects.create(user=self.grant_user, perm_id=VIEW_PERM, allow=True)
+        self.assertEqual(self.manager_perms(), {VIEW_PERM: True})
+        user_perm.delete()
+        self.assertEqual(self.manager_perms(), {})
+
+    def test_perms_manager_owns_are_not_delegated(self):
+        group = GroupPerm.objects.create(name='test_group', level=1)
+        UserGroupPerm.objects.create(user=self.manager, group=group, allow=True)
+        GroupPermPerms.objects.create(group=group, perm_id=VIEW_PERM, allow=True)
+        UserPerm.objects.create(user=self.manager, perm_id=CREATE_PERM, allow=True)
+        UserPerm.objects.create(user=self.grant_user, perm_id=VIEW_PERM, allow=True)
+        UserPerm.objects.create(user=self.grant_user, perm_id=CREATE_PERM, allow=True)
+
+        grant = GrantAccess.objects.create(manager=self.manager, grant_user=self.grant_user, active=True, allow=True)
+        self.assertFalse(grant.grant_perms.exists())
+        grant.active = False
+        grant.save()
+        # Own direct perm is kept when grant is closed
+        self.assertEqual(self.manager_perms(), {CREATE_PERM: True})
+
+
+class GrantObjectPermsTest(TestCase):
+    def setUp(self):
+        self.first, self.second = create_users('TESTOBJ01', 'TESTOBJ02')
+        self.perms = create_full_perm(User, 'TESTOBJ', perm_actions['full'])
+
+    def user_perms(self):
+        return sorted(UserPerm.objects.filter(perm_id__in=self.perms).values_list('user_id', 'perm_id', 'allow'))
+
+    def test_grant_and_replace(self):
+        grant_object_perms(self.perms, users=['testobj01', 'TESTOBJ02'])
+        self.assertEqual(self.user_perms(), sorted((user.id, perm, True) for user in [self.first, self.second]
+                                                   for perm in self.perms))
+        self.assertTrue(get_perm_snapshot(User.objects.get(id=self.first.id)).is_allow(self.perms[0]))
+
+        grant_object_perms(self.perms, users=[self.second.id])
+        self.assertEqual(self.user_perms(), sorted((self.second.id, perm, True) for perm in self.perms))
+        self.assertFalse(get_perm_snapshot(User.objects.get(id=self.first.id)).is_allow(self.perms[0]))
+
+    def test_grant_without_replace_keeps_other_users(self):
+        grant_object_perms(self.perms, users=[self.first.id])
+        grant_object_perms(self.perms, users=[self.second.id], replace=False)
+        self.assertEqual({user_id for user_id, _, _ in self.user_perms()}, {self.first.id, self.second.id})
+
+    def test_denied_row_is_updated(self):
+        UserPerm.objects.create(user=self.first, perm_id=self.perms[0], allow=False)
+        grant_object_perms(self.perms[:1], users=[self.first.id])
+        self.assertEqual(self.user_perms(), [(self.first.id, self.perms[0], True)])
+
+    def test_superuser_and_admin_rows_are_kept(self):
+        User.objects.filter(id=self.second.id).update(is_superuser=True)
+        UserPerm.objects.create(user=self.second, perm_id=self.perms[0], allow=True)
+        admin_group = GroupPerm.objects.create(name=admin_role)
+        GroupPermPerms.objects.create(group=admin_group, perm_id=self.perms[0], allow=True)
+        group = GroupPerm.objects.create(name='test_group')
+
+        grant_object_perms(self.perms[:1], users=[self.first.id], groups=[group.name])
+        self.assertEqual(self.user_perms(), [(self.first.id, self.perms[0], True),
+                                             (self.second.id, self.perms[0], True)])
+        self.assertEqual(set(GroupPermPerms.objects.filter(perm_id=self.perms[0]).values_list('group_id', flat=True)),
+                         {admin_role, group.name})
+
+    def test_diff_removes_duplicated_rows(self):
+        existing = [(1, 'A', 'perm', True), (2, 'A', 'perm', True), (3, 'B', 'perm', False)]
+        to_create, to_update, to_delete = diff_perm_rows(existing, {('A', 'perm'): True, ('C', 'perm'): True},
+                                                         {True, False})
+        self.assertEqual((to_create, to_update, to_delete), ([('C', 'perm', True)], {True: [], False: []}, [2, 3]))
+
+
+class UserIdTest(TestCase):
+    def setUp(self):
+        for name in ['employee', 'client']:
+            GroupPerm.objects.create(name=name)
+
+    def test_taken_id_is_not_overwritten(self):
+        first = User(user_type='employee', status='active')
+        first.save()
+        prefix, number = first.id[:-4], int(first.id[-4:])
+        # Written with explicit id ahead of the sequence
+        taken, = create_users(f'{prefix}{number + 1:04d}')
+        second = User(user_type='employee', status='active')
+        second.save()
+        self.assertEqual(second.id, f'{prefix}{number + 2:04d}')
+        self.assertEqual(second.username, second.id)
+        self.assertTrue(second.check_password(second.id.lower()))
+        self.assertEqual(User.objects.get(id=taken.id).username, taken.username)
+
+    def test_bulk_create_moves_sequence_past_file_ids(self):
+        explicit_id = f"{id_prefix_of('KH')}9000"
+        success, errors = bulk_create_users([{'id': explicit_id}, {}])
+        self.assertEqual(errors, [])
+        self.assertEqual(success[1]['message'], f"new user_id: {id_prefix_of('KH')}9001")
+        user = User(user_type='client', status='active')
+        user.save()
+        self.assertEqual(user.id, f"{id_prefix_of('KH')}9002")
+
+
+class ProjectDbIterateTest(TestCase):
+    def test_rows_are_streamed_as_dicts(self):
+        rows = project_db_iterate("SELECT g AS number FROM generate_series(1, %s) g", (25,), chunk_size=10)
+        self.assertEqual(list(rows), [{'number': number} for number in range(1, 26)])
+        self.assertEqual(list(project_db_iterate("SELECT 1 WHERE FALSE", ())), [])
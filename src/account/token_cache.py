@@ -0,0 +1,52 @@
+import time
+
+import redis
+from django.apps import apps
+from django.conf import settings
+
+from app.logs import app_log
+from app.redis_db import redis_db, token_valid_key
+
+# Valid entry is re-checked with database at least this often
+TOKEN_VALID_TTL = 60 * 5
+
+
+def get_token_valid(access_jti):
+    """ Return True/False when cached, None when need to check database """
+    try:
+        value = redis_db.get(token_valid_key(access_jti))
+    except redis.RedisError as e:
+        app_log.error(f"Error get token valid {access_jti}: {e}")
+        return None
+    if value is None:
+        return None
+    return value == '1'
+
+
+def set_token_valid(access_jti, valid: bool, exp=None):
+    """ Cache result of access token, never longer than token 'exp' """
+    ttl = access_token_lifetime() if exp is None else int(exp - time.time())
+    if valid:
+        ttl = min(ttl, TOKEN_VALID_TTL)
+    if ttl <= 0:
+        return
+    try:
+        redis_db.setex(token_valid_key(access_jti), ttl, '1' if valid else '0')
+    except redis.RedisError as e:
+        app_log.error(f"Error set token valid {access_jti}: {e}")
+
+
+def invalidate_access_tokens(access_jtis):
+    for access_jti in access_jtis:
+        set_token_valid(access_jti, False)
+
+
+def invalidate_refresh_token(refresh_jti):
+    """ Write negative entry for every access token created from refresh token """
+    TokenMapping = apps.get_model('account', 'TokenMapping')
+    access_jtis = TokenMapping.objects.filter(refresh_jti=refresh_jti).values_list('access_jti', flat=True)
+    invalidate_access_tokens(access_jtis)
+
+
+def access_token_lifetime():
+    return int(settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds())
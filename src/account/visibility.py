@@ -0,0 +1,50 @@
+from django.apps import apps
+
+BATCH_SIZE = 2000
+
+
+def sync_visibility(perm_names=None, user_ids=None, group_ids=None):
+    """
+    Rebuild ObjectVisibility rows from allowed UserPerm/GroupPermPerms of object perms.
+    Filter by perm names, users or groups, rebuild whole table when nothing is given.
+    """
+    ObjectVisibility = apps.get_model('account', 'ObjectVisibility')
+    UserPerm = apps.get_model('account', 'UserPerm')
+    GroupPermPerms = apps.get_model('account', 'GroupPermPerms')
+
+    visibility = ObjectVisibility.objects.all()
+    object_perm = dict(perm__content_type__isnull=False, perm__action__isnull=False)
+    user_perms = UserPerm.objects.filter(allow=True, **object_perm).exclude(perm__object_id='')
+    group_perms = GroupPermPerms.objects.filter(allow=True, **object_perm).exclude(perm__object_id='')
+    if perm_names is not None:
+        perm_names = list(perm_names)
+        visibility = visibility.filter(perm_id__in=perm_names)
+        user_perms = user_perms.filter(perm_id__in=perm_names)
+        group_perms = group_perms.filter(perm_id__in=perm_names)
+    if user_ids is not None:
+        visibility = visibility.filter(user_id__in=list(user_ids))
+        user_perms = user_perms.filter(user_id__in=list(user_ids))
+        group_perms = group_perms.none()
+    if group_ids is not None:
+        visibility = visibility.filter(group_id__in=list(group_ids))
+        group_perms = group_perms.filter(group_id__in=list(group_ids))
+        user_perms = user_perms.none()
+
+    visibility.delete()
+
+    rows = list()
+    fields = ('perm_id', 'perm__content_type_id', 'perm__object_id', 'perm__action')
+    for perm_id, content_type_id, object_id, action, user_id in user_perms.values_list(*fields, 'user_id'):
+        rows.append(ObjectVisibility(perm_id=perm_id, user_id=user_id, content_type_id=content_type_id,
+                                     object_id=object_id, action=action))
+    for perm_id, content_type_id, object_id, action, group_id in group_perms.values_list(*fields, 'group_id'):
+        rows.append(ObjectVisibility(perm_id=perm_id, group_id=group_id, content_type_id=content_type_id,
+                                     object_id=object_id, action=action))
+    ObjectVisibility.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def sync_object_visibility(content_type, object_id):
+    """ Rebuild visibility of every perm of one object """
+    Perm = apps.get_model('account', 'Perm')
+    perm_names = Perm.objects.filter(content_type=content_type, object_id=str(object_id)).values_list('name', flat=True)
+    sync_visibility(perm_names=perm_names)
@@ -14,6 +14,7 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenBlacklistVi
 
 from account.api.serializers import UserSerializer, PhoneNumberSerializer
 from account.models import User, Verify, PhoneNumber, RefreshToken, TokenMapping
+from account.token_cache import invalidate_refresh_token
 from app.logs import app_log
 from utils.constants import status
 from utils.env import TOKEN_LT
@@ -65,6 +66,7 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
                     deactive_token.save()
                     deactivate_token = RestRefreshToken(deactive_token.refresh_token)
                     deactivate_token.blacklist()
+                    invalidate_refresh_token(deactivate_token['jti'])
                 except TokenError:
                     app_log.info("Token error")
             access_token['phone_number'] = phone.phone_number
@@ -143,6 +145,8 @@ class CustomTokenBlacklistView(TokenBlacklistView):
     def post(self, request, *args, **kwargs):
         response = super().post(request, *args, **kwargs)
 
+        refresh_token = RestRefreshToken(request.data.get('refresh'), verify=False)
+        invalidate_refresh_token(refresh_token['jti'])
         app_log.info("Token has been blacklisted")
         return response
 
@@ -7,3 +7,55 @@ redis_db = redis.Redis.from_url(REDIS_URL, decode_responses=True)
 
 def verify_deactivate_key(user_id: str):
     return f"otp_deactivate:{user_id}"
+
+
+def perm_snapshot_key(user_id: str):
+    return f"perm_snapshot:{user_id}"
+
+
+def perm_snapshot_version_key():
+    return "perm_snapshot:version"
+
+
+def token_valid_key(access_jti: str):
+    return f"token_valid:{access_jti}"
+
+
+def order_stats_dirty_key():
+    return "order_stats:dirty"
+
+
+def order_stats_scheduled_key():
+    return "order_stats:scheduled"
+
+
+def catalog_key(kind: str, catalog_id, version):
+    return f"catalog:{kind}:{catalog_id}:{version}"
+
+
+def catalog_version_key(kind: str, catalog_id):
+    return f"catalog_version:{kind}:{catalog_id}"
+
+
+def catalog_stats_key():
+    return "catalog:stats"
+
+
+def order_import_key(job_id: str):
+    return f"order_import:{job_id}"
+
+
+def order_import_result_key(job_id: str):
+    return f"order_import_result:{job_id}"
+
+
+def report_job_key(job_id: str):
+    return f"report_job:{job_id}"
+
+
+def report_artifact_key(report_hash: str):
+    return f"report_artifact:{report_hash}"
+
+
+def report_version_key(table: str):
+    return f"report_version:{table}"
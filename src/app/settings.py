@@ -31,6 +31,11 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': crontab(hour="4", minute="30"),
         'args': (),
     },
+    'clean-report-files-task': {
+        'task': 'system_func.tasks.clean_report_files_task',
+        'schedule': crontab(hour="3", minute="00"),
+        'args': (),
+    },
 }
 
 # Email service
@@ -263,7 +268,7 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'account.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -321,6 +326,9 @@ POSTGRESQL = {
     'PORT': PGS_PORT,
     'USER': PGS_USER,
     'PASSWORD': PGS_PASSWORD,
+    # Keep connection open between requests, raw SQL in account.queries also use it
+    'CONN_MAX_AGE': 600,
+    'CONN_HEALTH_CHECKS': True,
     'OPTIONS': {
         'sslmode': PGS_SSL,
     },
@@ -7,7 +7,7 @@ from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework import serializers
 
-from account.handlers.perms import get_perm_name, get_full_permname
+from account.handlers.perms import get_full_permname, has_object_perms
 from account.handlers.restrict_serializer import BaseRestrictSerializer
 from account.models import User, PhoneNumber, Perm, GroupPerm
 from account.queries import get_user_by_permname_sql
@@ -139,9 +139,7 @@ class LiveStreamSerializer(BaseRestrictSerializer):
                 # Handle restrictions (if any)
                 self.handle_restrict_import_users_id(import_users, perm_data, user_actions)
                 restrict = perm_data.get('restrict')
-                perm_name = get_perm_name(self.Meta.model)
-                perm_name = perm_name + f"_{instance.id}"
-                if restrict or Perm.objects.filter(name__endswith=perm_name).exists():
+                if restrict or has_object_perms(self.Meta.model, instance.id):
                     self.handle_restrict(perm_data, instance.id, self.Meta.model)
 
                 return instance
@@ -10,7 +10,7 @@ from rest_framework import mixins, viewsets, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 
 from account.handlers.perms import perm_queryset, export_users_has_perm
 from account.handlers.validate_perm import ValidatePermRest
@@ -20,6 +20,7 @@ from marketing.livestream.api.serializers import LiveStreamSerializer, LiveStrea
     LiveStatistic, LiveTracking, LiveStreamDetailCommentSerializer, PeekViewSerializer, LiveOfferRegisterSerializer
 from marketing.livestream.models import LiveStream, LiveStreamComment, LiveStreamTracking, LiveStreamStatistic, \
     LiveStreamPeekView, LiveStreamOfferRegister
+from system_func.api.views import report_job_response
 from utils.model_filter_paginate import filter_data
 
 
@@ -209,128 +210,129 @@ class CheckLiveStreamRegistrationView(APIView):
 class ExportLiveReport(APIView):
     def get(self, request, *args, **kwargs):
         pk = kwargs.get('pk')
-        livestream = LiveStream.objects.filter(id=pk).first()
-        if not livestream:
+        if not LiveStream.objects.filter(id=pk).exists():
             return Response({'message': f'not found live stream {pk}'})
-
-        # Tạo workbook và các sheet
-        workbook = openpyxl.Workbook()
-        general_sheet = workbook.active
-        general_sheet.title = "Tổng quát"
-        viewer_sheet = workbook.create_sheet("Người xem")
-        order_sheet = workbook.create_sheet("Khách đặt hàng")
-        comment_sheet = workbook.create_sheet("Bình luận")
-
-        # Định dạng tiêu đề
-        title_font = Font(bold=True, size=14)
-        center_aligned_text = Alignment(horizontal='center')
-
-        # Tên cột và kích thước cho sheet "Tổng quát"
-        columns_general = ['Tên sự kiện', 'Thời gian diễn ra', 'Link video', 'Tổng lượt xem', 'Tổng số bình luận',
-                           'Tổng số đặt hàng']
-        column_widths_general = [30, 18, 12, 16, 18.5, 18]
-
-        general_sheet.append(columns_general)
-        for i, column in enumerate(columns_general, 1):
-            cell = general_sheet.cell(row=1, column=i)
-            cell.font = title_font
-            cell.alignment = center_aligned_text
-            general_sheet.column_dimensions[get_column_letter(i)].width = column_widths_general[i - 1]
-
-        # Dữ liệu cho sheet "Tổng quát"
-        statistics = LiveStreamStatistic.objects.filter(live_stream=livestream).first()
-        general_sheet.append([
-            livestream.title,
-            f"{livestream.date_released.strftime('%Y-%m-%d')} {livestream.time_start.strftime('%H:%M')}",
-            livestream.live_url,
-            statistics.viewers if statistics else 0,
-            statistics.comments if statistics else 0,
-            statistics.order_times if statistics else 0
+        return report_job_response(request, 'live_report', {'pk': pk})
+
+
+def export_live_report_file(params, output):
+    pk = params['pk']
+    livestream = LiveStream.objects.get(id=pk)
+
+    # Tạo workbook và các sheet
+    workbook = openpyxl.Workbook()
+    general_sheet = workbook.active
+    general_sheet.title = "Tổng quát"
+    viewer_sheet = workbook.create_sheet("Người xem")
+    order_sheet = workbook.create_sheet("Khách đặt hàng")
+    comment_sheet = workbook.create_sheet("Bình luận")
+
+    # Định dạng tiêu đề
+    title_font = Font(bold=True, size=14)
+    center_aligned_text = Alignment(horizontal='center')
+
+    # Tên cột và kích thước cho sheet "Tổng quát"
+    columns_general = ['Tên sự kiện', 'Thời gian diễn ra', 'Link video', 'Tổng lượt xem', 'Tổng số bình luận',
+                       'Tổng số đặt hàng']
+    column_widths_general = [30, 18, 12, 16, 18.5, 18]
+
+    general_sheet.append(columns_general)
+    for i, column in enumerate(columns_general, 1):
+        cell = general_sheet.cell(row=1, column=i)
+        cell.font = title_font
+        cell.alignment = center_aligned_text
+        general_sheet.column_dimensions[get_column_letter(i)].width = column_widths_general[i - 1]
+
+    # Dữ liệu cho sheet "Tổng quát"
+    statistics = LiveStreamStatistic.objects.filter(live_stream=livestream).first()
+    general_sheet.append([
+        livestream.title,
+        f"{livestream.date_released.strftime('%Y-%m-%d')} {livestream.time_start.strftime('%H:%M')}",
+        livestream.live_url,
+        statistics.viewers if statistics else 0,
+        statistics.comments if statistics else 0,
+        statistics.order_times if statistics else 0
+    ])
+
+    # Cột và kích thước cho sheet "Khách đặt hàng"
+    columns_order = ['SĐT', 'Mã KH', 'Tên KH']
+    column_widths_order = [12, 10, 26]
+
+    order_sheet.append(columns_order)
+    for i, column in enumerate(columns_order, 1):
+        cell = order_sheet.cell(row=1, column=i)
+        cell.font = title_font
+        cell.alignment = center_aligned_text
+        order_sheet.column_dimensions[get_column_letter(i)].width = column_widths_order[i - 1]
+
+    # Dữ liệu cho sheet "Khách đặt hàng"
+    for register in LiveStreamOfferRegister.objects.filter(live_stream=livestream).select_related('phone',
+                                                                                                  'phone__user'):
+        user = register.phone.user
+        user_name = user.clientprofile.register_name if hasattr(user, 'clientprofile') else ""
+        order_sheet.append([
+            register.phone.phone_number,
+            user.id,
+            user_name
         ])
 
-        # Cột và kích thước cho sheet "Khách đặt hàng"
-        columns_order = ['SĐT', 'Mã KH', 'Tên KH']
-        column_widths_order = [12, 10, 26]
-
-        order_sheet.append(columns_order)
-        for i, column in enumerate(columns_order, 1):
-            cell = order_sheet.cell(row=1, column=i)
-            cell.font = title_font
-            cell.alignment = center_aligned_text
-            order_sheet.column_dimensions[get_column_letter(i)].width = column_widths_order[i - 1]
-
-        # Dữ liệu cho sheet "Khách đặt hàng"
-        for register in LiveStreamOfferRegister.objects.filter(live_stream=livestream).select_related('phone',
-                                                                                                      'phone__user'):
-            user = register.phone.user
-            user_name = user.clientprofile.register_name if hasattr(user, 'clientprofile') else ""
-            order_sheet.append([
-                register.phone.phone_number,
-                user.id,
-                user_name
-            ])
-
-        # Cột và kích thước cho sheet "Người xem"
-        columns_viewer = ['Người xem', 'Mã user', 'Tên user', 'Tổng thời gian theo dõi']
-        column_widths_viewer = [14, 18, 24, 25]
-
-        viewer_sheet.append(columns_viewer)
-        for i, column in enumerate(columns_viewer, 1):
-            cell = viewer_sheet.cell(row=1, column=i)
-            cell.font = title_font
-            cell.alignment = center_aligned_text
-            viewer_sheet.column_dimensions[get_column_letter(i)].width = column_widths_viewer[i - 1]
-
-        # Dữ liệu cho sheet "Người xem"
-        phone_times = LiveStreamTracking.objects.filter(live_stream=livestream).values(
-            'phone__phone_number', 'phone__user__id').annotate(total_time=Sum('time_watch')).order_by('phone__phone_number')
-        for phone_time in phone_times:
-            user = User.objects.filter(id=phone_time['phone__user__id']).first()
-            if user:
-                if hasattr(user, 'clientprofile') and user.clientprofile:
-                    user_name = user.clientprofile.register_name
-                elif hasattr(user, 'employeeprofile') and user.employeeprofile:
-                    user_name = user.employeeprofile.register_name
-                else:
-                    user_name = ""
+    # Cột và kích thước cho sheet "Người xem"
+    columns_viewer = ['Người xem', 'Mã user', 'Tên user', 'Tổng thời gian theo dõi']
+    column_widths_viewer = [14, 18, 24, 25]
+
+    viewer_sheet.append(columns_viewer)
+    for i, column in enumerate(columns_viewer, 1):
+        cell = viewer_sheet.cell(row=1, column=i)
+        cell.font = title_font
+        cell.alignment = center_aligned_text
+        viewer_sheet.column_dimensions[get_column_letter(i)].width = column_widths_viewer[i - 1]
+
+    # Dữ liệu cho sheet "Người xem"
+    phone_times = LiveStreamTracking.objects.filter(live_stream=livestream).values(
+        'phone__phone_number', 'phone__user__id').annotate(total_time=Sum('time_watch')).order_by('phone__phone_number')
+    for phone_time in phone_times:
+        user = User.objects.filter(id=phone_time['phone__user__id']).first()
+        if user:
+            if hasattr(user, 'clientprofile') and user.clientprofile:
+                user_name = user.clientprofile.register_name
+            elif hasattr(user, 'employeeprofile') and user.employeeprofile:
+                user_name = user.employeeprofile.register_name
             else:
                 user_name = ""
-            viewer_sheet.append(
-                [phone_time['phone__phone_number'],
-                 phone_time['phone__user__id'],
-                 user_name,
-                 str(phone_time['total_time'])
-                 ])
-
-        columns_comment = ['SĐT', 'Người dùng', 'Bình luận', 'Thời gian bình luận']
-        column_widths_comment = [15, 15, 50, 20]  # Kích thước cột tùy chỉnh
-
-        comment_sheet.append(columns_comment)
-        for i, column in enumerate(columns_comment, 1):
-            cell = comment_sheet.cell(row=1, column=i)
-            cell.font = title_font
-            cell.alignment = center_aligned_text
-            comment_sheet.column_dimensions[get_column_letter(i)].width = column_widths_comment[i - 1]
-
-        comments = LiveStreamComment.objects.filter(live_stream=livestream).select_related('user', 'phone').order_by('-created_at')
-        for comment in comments:
-            phone_number = comment.phone.phone_number if comment.phone else ""
-            user_id = comment.user.id if comment.user else ""
-            comment_text = comment.comment
-            comment_time = comment.created_at.strftime('%Y-%m-%d %H:%M:%S')
-            comment_sheet.append([phone_number, user_id, comment_text, comment_time])
-
-        apply_data_font(general_sheet, 2, general_sheet.max_row, general_sheet.max_column)
-        apply_data_font(order_sheet, 2, order_sheet.max_row, order_sheet.max_column)
-        apply_data_font(viewer_sheet, 2, viewer_sheet.max_row, viewer_sheet.max_column)
-        apply_data_font(comment_sheet, 2, comment_sheet.max_row, comment_sheet.max_column)
-
-        # Lưu và trả về file
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="livestream_{pk}_report.xlsx"'
-        workbook.save(response)
-
-        return response
+        else:
+            user_name = ""
+        viewer_sheet.append(
+            [phone_time['phone__phone_number'],
+             phone_time['phone__user__id'],
+             user_name,
+             str(phone_time['total_time'])
+             ])
+
+    columns_comment = ['SĐT', 'Người dùng', 'Bình luận', 'Thời gian bình luận']
+    column_widths_comment = [15, 15, 50, 20]  # Kích thước cột tùy chỉnh
+
+    comment_sheet.append(columns_comment)
+    for i, column in enumerate(columns_comment, 1):
+        cell = comment_sheet.cell(row=1, column=i)
+        cell.font = title_font
+        cell.alignment = center_aligned_text
+        comment_sheet.column_dimensions[get_column_letter(i)].width = column_widths_comment[i - 1]
+
+    comments = LiveStreamComment.objects.filter(live_stream=livestream).select_related('user', 'phone').order_by('-created_at')
+    for comment in comments:
+        phone_number = comment.phone.phone_number if comment.phone else ""
+        user_id = comment.user.id if comment.user else ""
+        comment_text = comment.comment
+        comment_time = comment.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        comment_sheet.append([phone_number, user_id, comment_text, comment_time])
+
+    apply_data_font(general_sheet, 2, general_sheet.max_row, general_sheet.max_column)
+    apply_data_font(order_sheet, 2, order_sheet.max_row, order_sheet.max_column)
+    apply_data_font(viewer_sheet, 2, viewer_sheet.max_row, viewer_sheet.max_column)
+    apply_data_font(comment_sheet, 2, comment_sheet.max_row, comment_sheet.max_column)
+
+    workbook.save(output)
+    return f"livestream_{pk}_report.xlsx"
 
 
 def apply_data_font(sheet, row_start, row_end, column_end):
@@ -2,7 +2,7 @@ from django.db.models import Q
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.response import Response
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 
 from app.logs import app_log
 from marketing.medias.api.banner.serializers import BannerSerializer, BannerItemSerializer
@@ -6,8 +6,7 @@ from django.db import transaction
 from django.utils import timezone
 from rest_framework import serializers
 
-from account.handlers.restrict_serializer import create_full_perm, list_user_has_perm, \
-    list_group_has_perm, add_perm
+from account.handlers.restrict_serializer import create_full_perm, grant_object_perms
 from account.models import Perm, User, GroupPerm, PhoneNumber
 from app.logs import app_log
 from marketing.medias.models import Notification, NotificationUser, NotificationFile
@@ -71,12 +70,8 @@ class NotificationSerializer(serializers.ModelSerializer):
                 # Create specific permission
                 list_perm = create_full_perm(Notification, notify.id, perm_actions['view'])
 
-                # Get user has perm
-                existed_user_allow = list_user_has_perm(list_perm, True)
-                existed_group_allow = list_group_has_perm(list_perm, True)
                 # Processing add perm
-                add_perm({'type': 'users', 'data': users, 'existed': existed_user_allow}, list_perm, True)
-                add_perm({'type': 'group', 'data': groups, 'existed': existed_group_allow}, list_perm, True)
+                grant_object_perms(list_perm, users=users, groups=groups)
 
                 # Get user from file except of choosing
                 if import_users:
@@ -147,12 +142,7 @@ class NotificationSerializer(serializers.ModelSerializer):
 
                 # Update permissions
                 list_perm = create_full_perm(Notification, instance.id, perm_actions['view'])
-                existed_user_allow = list_user_has_perm(list_perm, True)
-                existed_group_allow = list_group_has_perm(list_perm, True)
-
-                # Update permissions
-                add_perm({'type': 'users', 'data': users, 'existed': existed_user_allow}, list_perm, True)
-                add_perm({'type': 'group', 'data': groups, 'existed': existed_group_allow}, list_perm, True)
+                grant_object_perms(list_perm, users=users, groups=groups)
 
                 # Xử lý người dùng từ tệp nếu có
                 if import_users:
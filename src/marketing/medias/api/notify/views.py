@@ -4,7 +4,7 @@ from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 
 from app.logs import app_log
 from marketing.medias.api.notify.serializers import NotificationSerializer, NotificationUserSerializer
@@ -7,7 +7,7 @@ from rest_framework.exceptions import ValidationError
 from account.models import User
 from app.logs import app_log
 from system.file_upload.models import FileUpload
-from utils.helpers import self_id
+from utils.helpers import insert_with_new_id
 
 
 class Notification(models.Model):
@@ -86,12 +86,12 @@ class Banner(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
-        # Create id for banner if not exist
-        if not self.id:
-            self.id = self_id('BANNER', self.__class__, 4)
         # Constraint Banner can be 1 type and display type for 1 object
         if Banner.objects.filter(type=self.type, display_type=self.display_type).exists():
             raise ValidationError({'error': 'banner with this ype and display type already existed'})
+        # Create id for banner if not exist
+        if not self.id:
+            return insert_with_new_id(self, super().save, ('BANNER', 4), *args, **kwargs)
         super().save(*args, **kwargs)
 
     class Meta:
@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 
 from marketing.order.api.views import GenericApiOrder, ProductStatisticsView, OrderReportView, \
     ExportReport, TotalStatisticsView, ApiSeasonalStatistic, ApiSeasonalStatisticUser, OrderSOCount, ApiImportOrder, \
-    ApiNvttGetOrderDaily
+    ApiNvttGetOrderDaily, ApiImportOrderErrors
 from utils.constants import actions_views, actions_detail
 
 app_name = "api_order"
@@ -32,6 +32,8 @@ urlpatterns = [
     path('report/export/', ExportReport.as_view()),
 
     path('import-excel/', ApiImportOrder.as_view()),
+    path('import-excel/<job_id>', ApiImportOrder.as_view()),
+    path('import-excel/<job_id>/errors', ApiImportOrderErrors.as_view()),
 
     path('season-stats-users/', stats_users_views, name='api_stats_users_views'),
     path('season-stats-users/<pk>', stats_users_details, name='api_stats_users_details'),
@@ -15,13 +15,16 @@ from app.logs import app_log
 from app.settings import TIME_ZONE
 from marketing.livestream.models import LiveStreamOfferRegister
 from marketing.order.models import Order, OrderDetail, SeasonalStatistic, SeasonalStatisticUser, \
-    update_season_stats_users, create_or_get_sale_stats_user
-from marketing.pick_number.models import UserJoinEvent
-from marketing.price_list.models import ProductPrice, SpecialOfferProduct, SpecialOffer
+    update_season_stats_users
+from marketing.order.rollup import mark_rollup_dirty
+from marketing.order.stats import mark_stats_dirty
+from marketing.order.totals import order_detail_totals, deferred_totals, TOTAL_FIELDS
+from marketing.price_list.catalog import get_special_offer_prices, get_price_list_prices
+from marketing.price_list.models import SpecialOffer
 from marketing.product.models import Product
+from marketing.sale_statistic.ledger import record_order_turnover, get_month_stats
 from marketing.sale_statistic.models import SaleTarget, SaleStatistic, UserSaleStatistic
 from system.file_upload.api.serializers import FileShortViewSerializer
-from system_func.models import PeriodSeason, PointOfSeason
 from user_system.client_profile.models import ClientProfile
 from user_system.employee_profile.models import EmployeeProfile
 from utils.constants import so_type
@@ -105,23 +108,12 @@ class OrderSerializer(BaseRestrictSerializer):
                 # Calculate total price and point
                 details = calculate_total_price_and_point(order, order_details_data)
                 if details:
+                    # bulk_create inserts every line or raises, no need to count created rows (empty order is the
+                    # else branch below)
                     OrderDetail.objects.bulk_create(details)
-                    # Check if order details were created
-                    created_details_count = OrderDetail.objects.filter(order_id=order).count()
-                    if created_details_count == 0:
-                        order.delete()
-                        raise ValidationError(
-                            {'message': 'toa yêu cầu chi tiết danh sách sản phẩm, số lượng sản phẩm'}
-                        )
-
-                    # Get total point and price from query
-                    total_price = OrderDetail.objects.filter(order_id=order).aggregate(
-                        total_price=Sum('product_price'))['total_price']
-                    total_point = OrderDetail.objects.filter(order_id=order).aggregate(
-                        total_point=Sum('point_get'))['total_point']
-                    # Add to order
-                    order.order_point = total_point
-                    order.order_price = total_price
+                    # Totals from computed lines, same values as stored rows
+                    for field, value in order_detail_totals(details).items():
+                        setattr(order, field, value)
                     order.save()
 
                     # Deactivate when user used
@@ -132,11 +124,9 @@ class OrderSerializer(BaseRestrictSerializer):
 
                     app_log.info(f"Testing user sale statistic: {user_sale_statistic}")
 
-                    update_point(order.client_id)
-                    update_season_stats_user(order.client_id, order.date_get)
-                    order_month = order.date_get.replace(day=1)
-                    user_stats = create_or_get_sale_stats_user(order.client_id, order_month)
-                    print(f"Test user STATS: {user_stats}")
+                    mark_stats_dirty(order.client_id_id, order.date_get)
+                    mark_rollup_dirty([(order.client_id_id, order.date_get)])
+                    record_order_turnover([order.id])
                     update_user_turnover(order.client_id, order, order.is_so)
                     # Create perms
                     restrict = perm_data.get('restrict')
@@ -159,7 +149,6 @@ class OrderSerializer(BaseRestrictSerializer):
                 # Implement any custom logic before deletion here
                 user = instance.client_id
                 date_get = instance.date_get
-                month = instance.date_get.replace(day=1)
                 order = instance
                 old_order_data = OrderSerializer(instance).data
                 order.status = 'deactivate'
@@ -173,11 +162,15 @@ class OrderSerializer(BaseRestrictSerializer):
                 # Delete related order details
                 # Delete the order instance
                 update_user_turnover(user, order, order.is_so, old_order_data)
-                OrderDetail.objects.filter(order_id=instance).delete()
-                instance.delete()
-                update_point(user)
-                update_season_stats_user(user, date_get)
-                user_stats = create_or_get_sale_stats_user(user, month)
+                order_id = instance.id
+                # OrderDetail signals would refresh totals of deleted order once per line
+                with deferred_totals():
+                    OrderDetail.objects.filter(order_id=instance).delete()
+                    instance.delete()
+                mark_stats_dirty(user.id if user else None, date_get)
+                mark_rollup_dirty([(user.id if user else None, date_get)])
+                # Reverse ledger entries of deleted order
+                record_order_turnover([order_id], reason='order_delete')
         except Exception as e:
             app_log.error(f"Error when deleting order: {e}")
             # raise serializers.ValidationError({'message': 'unexpected error during deletion'})
@@ -191,9 +184,7 @@ class OrderSerializer(BaseRestrictSerializer):
         # Get current SaleStatistic of user
         get_date = data.get('date_get')
         first_day_of_month = get_date.replace(day=1)
-        user_sale_statistic = create_or_get_sale_stats_user(user=user, month=first_day_of_month)
-        if user_sale_statistic is None:
-            user_sale_statistic, _ = SaleStatistic.objects.get_or_create(user=user, month=first_day_of_month)
+        user_sale_statistic = get_month_stats(user, first_day_of_month)
         month_target = SaleTarget.objects.filter(month=first_day_of_month).first()
 
         user_sale_stats = UserSaleStatistic.objects.filter(user=user).first()
@@ -227,6 +218,8 @@ class OrderSerializer(BaseRestrictSerializer):
                 raise serializers.ValidationError({'message': 'ưu đãi đã hết hạn'})
 
             buy_target = special_offer.target if special_offer.target >= 0 else month_target.month_target
+            # All products of special offer from catalog cache, {product_id: CatalogPrice}
+            special_offer_products = get_special_offer_prices(special_offer.id)
 
             # Calculate max box can buy
             if special_offer.type_list == so_type.consider_user:
@@ -237,9 +230,7 @@ class OrderSerializer(BaseRestrictSerializer):
                 # Validate if all products in order are belonged to SO consider
                 order_product_ids = {str(detail_data.get('product_id').id) for detail_data in order_details_data}
                 # Get list of product_id from SpecialOfferProduct
-                special_offer_product_ids = set(
-                    SpecialOfferProduct.objects.filter(special_offer=special_offer).values_list('product',
-                                                                                                flat=True))
+                special_offer_product_ids = set(special_offer_products.keys())
                 if order_product_ids != special_offer_product_ids:
                     raise serializers.ValidationError(
                         {'message': 'sản phẩm trong toa không khớp với sản phẩm trong xét duyệt ưu đãi'})
@@ -269,13 +260,12 @@ class OrderSerializer(BaseRestrictSerializer):
                 order_box = detail_data.get('order_box')
 
                 # Check if product is in SpecialOfferProduct
-                if not SpecialOfferProduct.objects.filter(special_offer=special_offer, product_id=product_id).exists():
+                special_offer_product = special_offer_products.get(getattr(product_id, 'pk', product_id))
+                if special_offer_product is None:
                     raise serializers.ValidationError(
                         {'message': f'product {product_id} không tồn tại trong SpecialOfferProduct'})
 
                 # Check if order_box is less than max_order_box
-                special_offer_product = SpecialOfferProduct.objects.get(special_offer=special_offer,
-                                                                        product_id=product_id)
                 if special_offer.type_list == so_type.consider_user:
                     if special_offer_product.max_order_box and order_box != special_offer_product.max_order_box:
                         raise serializers.ValidationError({
@@ -289,18 +279,24 @@ class OrderSerializer(BaseRestrictSerializer):
         return user_sale_statistic, False, is_consider
 
 
-def calculate_price_and_point(order, product_id, quantity):
-    try:
-        if order.new_special_offer:
-            product_price = SpecialOfferProduct.objects.get(special_offer=order.new_special_offer,
-                                                            product=product_id)
-            app_log.info(f"_ Case so: {product_price}")
-        else:
-            product_price = ProductPrice.objects.get(price_list=order.price_list_id, product=product_id)
-            app_log.info(f"_ Case normal: {product_price}")
-        prices, point, box = calculate_box_point(product_price, quantity)
-    except (ProductPrice.DoesNotExist, SpecialOfferProduct.DoesNotExist):
+def load_product_prices(order, product_ids) -> dict:
+    """
+    Price rows of products in order from catalog cache: {product_id: CatalogPrice}
+    Special offer prices when order use special offer, else prices of price list.
+    """
+    product_ids = {getattr(product_id, 'pk', product_id) for product_id in product_ids}
+    if order.new_special_offer_id:
+        prices = get_special_offer_prices(order.new_special_offer_id)
+    else:
+        prices = get_price_list_prices(order.price_list_id_id)
+    return {product_id: prices[product_id] for product_id in product_ids if product_id in prices}
+
+
+def calculate_price_and_point(product_prices: dict, product_id, quantity):
+    product_price = product_prices.get(getattr(product_id, 'pk', product_id))
+    if product_price is None:
         raise serializers.ValidationError({'message': 'sản phẩm không thuộc ưu đãi hoặc bảng giá'})
+    prices, point, box = calculate_box_point(product_price, quantity)
     return prices, point, box
 
 
@@ -320,11 +316,12 @@ def calculate_box_point(product_price, quantity):
 
 def calculate_total_price_and_point(order, order_details_data):
     details = []
+    product_prices = load_product_prices(order, [detail_data.get('product_id') for detail_data in order_details_data])
     for detail_data in order_details_data:
         quantity = detail_data.get('order_quantity')
         product_id = detail_data.pop('product_id')
 
-        prices, point, box = calculate_price_and_point(order, product_id, quantity)
+        prices, point, box = calculate_price_and_point(product_prices, product_id, quantity)
 
         # Add result calculate to detail_data
         detail_data['product_price'] = prices
@@ -333,8 +330,9 @@ def calculate_total_price_and_point(order, order_details_data):
         app_log.info(f"Cashing: \n__Prices: {detail_data['product_price']}"
                      f"\n__Points: {detail_data['point_get']}"
                      f"\n__Boxes: {detail_data['order_box']}")
-        if order.is_so:
-            so_obj = SpecialOfferProduct.objects.get(special_offer=order.new_special_offer, product=product_id)
+        if order.is_so and order.new_special_offer:
+            # Special offer order is priced by SpecialOfferProduct, cashback is on same row
+            so_obj = product_prices[getattr(product_id, 'pk', product_id)]
             detail_data['price_so'] = so_obj.cashback
 
         # Prin logs
@@ -610,45 +608,10 @@ class SpecialOfferUsageSerializer(serializers.ModelSerializer):
         return [order.id for order in orders]
 
     def get_total_used_box(self, obj):
-        order_ids = Order.objects.filter(new_special_offer=obj).values_list('id', flat=True)
-        total_box = OrderDetail.objects.filter(order_id__in=order_ids).aggregate(
-            total_box=Sum('order_box'))['total_box'] or 0
+        total_box = Order.objects.filter(new_special_offer=obj).aggregate(total_box=Sum('total_box'))['total_box'] or 0
         return total_box
 
 
-def update_point(user):
-    period = PeriodSeason.objects.filter(type='point', period='current').first()
-    point, _ = PointOfSeason.objects.get_or_create(user=user, period=period)
-    point.auto_point()
-    point.save()
-
-
-def update_season_stats_user(user: User, date_get):
-    season_stats_users = SeasonalStatisticUser.objects.filter(
-        user=user,
-        season_stats__type='point',
-        season_stats__start_date__lte=date_get,
-        season_stats__end_date__gte=date_get
-    )
-
-    if season_stats_users.exists():
-        update_stats_users = []
-
-        for stats_user in season_stats_users:
-            updated_stats_user = update_season_stats_users(stats_user)
-            update_stats_users.append(updated_stats_user)
-
-            user_join_events = UserJoinEvent.objects.filter(user=user, event__table_point=stats_user.season_stats)
-            for user_join_event in user_join_events:
-                user_join_event.turn_per_point = updated_stats_user.turn_per_point
-                user_join_event.turn_pick = updated_stats_user.turn_pick
-                user_join_event.total_point = updated_stats_user.total_point
-                user_join_event.save()
-
-        SeasonalStatisticUser.objects.bulk_update(update_stats_users,
-                                                  ['turn_per_point', 'turn_pick', 'redundant_point', 'total_point'])
-
-
 def update_user_turnover(user: User, order: Order, is_so: bool, old_order=None, so_data=None):
     if old_order is None:
         old_order = {}
@@ -669,13 +632,9 @@ def update_user_turnover(user: User, order: Order, is_so: bool, old_order=None,
     if not user_sale_stats:
         user_sale_stats = UserSaleStatistic.objects.create(user=user)
 
-    totals = order.order_detail.filter().aggregate(
-        total_box=Sum('order_box'),
-        total_price=Sum('product_price')
-    )
-    total_box = totals['total_box'] if totals['total_box'] is not None else 0
+    total_box = order.total_box or 0
 
-    total_price = totals['total_price'] if totals['total_price'] is not None else 0
+    total_price = order.order_price or 0
 
     old_turnover = old_order.get('order_price', 0)
     old_status = old_order.get('status', 'active')
@@ -792,57 +751,52 @@ class OrderUpdateSerializer(BaseRestrictSerializer):
             # Update Order fields
             data.pop('client_id', None)
             data.pop('new_special_offer', None)
+            old_date_get = instance.date_get
             for attr, value in data.items():
                 setattr(instance, attr, value)
             instance.save()
 
             # Update OrderDetail
-            current_details_id = [detail.id for detail in instance.order_detail.all()]
             new_details_id = []
-            total_point = float(0)
-            total_price = float(0)
             old_order_data = OrderSerializer(instance).data
             # Update order details
             if order_details_data:
-                for detail_data in order_details_data:
-                    detail_id = detail_data.get('id')
-                    product_id = detail_data.get('product_id')
-                    quantity = detail_data.get('order_quantity')
-
-                    if detail_id:
-                        detail = OrderDetail.objects.get(id=detail_id, order_id=instance)
-                        for attr, value in detail_data.items():
-                            setattr(detail, attr, value)
-                        detail.save()
-                    else:
-                        prices, point, box = calculate_price_and_point(instance, product_id, quantity)
-                        detail_data['product_price'] = prices
-                        detail_data['point_get'] = point
-                        detail_data['order_box'] = float(box)
-                        detail = OrderDetail(order_id=instance, **detail_data)
-                        detail.save()
-                        detail_id = detail.id
-
-                    new_details_id.append(detail_id)
-                    total_point += detail.point_get
-                    total_price += detail.product_price
-
-                # Remove OrderDetails not included in the update
-                for detail_id in current_details_id:
-                    if detail_id not in new_details_id:
-                        OrderDetail.objects.filter(id=detail_id).delete()
-
-                # Update order point and price
-                instance.order_point = total_point
-                instance.order_price = total_price
-                instance.save()
+                product_prices = load_product_prices(instance, [detail_data.get('product_id') for detail_data in
+                                                                order_details_data if not detail_data.get('id')])
+                # OrderDetail signals refresh totals of order once, after all details are written
+                with deferred_totals():
+                    for detail_data in order_details_data:
+                        detail_id = detail_data.get('id')
+                        product_id = detail_data.get('product_id')
+                        quantity = detail_data.get('order_quantity')
+
+                        if detail_id:
+                            detail = OrderDetail.objects.get(id=detail_id, order_id=instance)
+                            for attr, value in detail_data.items():
+                                setattr(detail, attr, value)
+                            detail.save()
+                        else:
+                            prices, point, box = calculate_price_and_point(product_prices, product_id, quantity)
+                            detail_data['product_price'] = prices
+                            detail_data['point_get'] = point
+                            detail_data['order_box'] = float(box)
+                            detail = OrderDetail(order_id=instance, **detail_data)
+                            detail.save()
+                            detail_id = detail.id
+
+                        new_details_id.append(detail_id)
+
+                    # Remove OrderDetails not included in the update
+                    OrderDetail.objects.filter(order_id=instance).exclude(id__in=new_details_id).delete()
+
+                instance.refresh_from_db(fields=TOTAL_FIELDS)
             # app_log.info(f"Testing user sale statistic: {user_sale_statistic}")
-            update_point(instance.client_id)
-            update_season_stats_user(instance.client_id, instance.date_get)
-            order_month = instance.date_get.replace(day=1)
-            user_stats = create_or_get_sale_stats_user(instance.client_id, order_month)
+            mark_stats_dirty(instance.client_id_id, instance.date_get)
+            if old_date_get and instance.date_get and old_date_get.replace(day=1) != instance.date_get.replace(day=1):
+                mark_stats_dirty(instance.client_id_id, old_date_get)
+            mark_rollup_dirty([(instance.client_id_id, instance.date_get), (instance.client_id_id, old_date_get)])
+            record_order_turnover([instance.id], reason='order_update')
             update_user_turnover(instance.client_id, instance, instance.is_so, old_order_data)
-            print(user_stats)
             restrict = perm_data.get('restrict')
             if restrict:
                 self.handle_restrict(perm_data, instance.id, self.Meta.model)
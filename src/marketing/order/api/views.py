@@ -1,26 +1,21 @@
 import base64
-import json
 import os
 import time
 from dataclasses import fields
 from datetime import datetime, timedelta
 from functools import partial
 from io import BytesIO
-from itertools import groupby
+from types import SimpleNamespace
 
-import numpy as np
 import openpyxl
 import pandas as pd
 from django.conf import settings
 from django.core.exceptions import FieldError, ValidationError
 from django.core.mail import EmailMessage
 from django.core.paginator import Paginator
-from django.db import transaction
 from django.db.models import Prefetch, QuerySet
-from django.db.models import Sum, Q, Case, When, FloatField, F
-from django.db.models.functions import Coalesce
-from django.http import HttpResponse
-from django.http import StreamingHttpResponse
+from django.db.models import Sum, Q
+from django.http import FileResponse
 from django.utils import timezone
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter
@@ -29,22 +24,26 @@ from rest_framework.authentication import BasicAuthentication, SessionAuthentica
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 
 from account.handlers.perms import get_perm_name
 from account.handlers.validate_perm import ValidatePermRest
 from account.models import User
 from app.logs import app_log
 from marketing.order.api.serializers import OrderSerializer, ProductStatisticsSerializer, SeasonalStatisticSerializer, \
-    SeasonStatsUserPointSerializer, update_point, update_season_stats_user, update_user_turnover, OrderUpdateSerializer
+    SeasonStatsUserPointSerializer, OrderUpdateSerializer
+from marketing.order.export import stream_order_excel, order_excel_rows, order_excel_columns, \
+    order_excel_title, order_excel_note, DATE_COLUMNS, BOLD_COLUMN
+from marketing.order.import_orders import start_import_job, get_job_state
 from marketing.order.models import Order, OrderDetail, SeasonalStatistic, SeasonalStatisticUser
+from marketing.order.rollup import product_statistics
 from marketing.order.tasks import send_report_email
-from marketing.price_list.models import SpecialOffer, PriceList, ProductPrice, SpecialOfferProduct
-from marketing.product.models import Product
+from marketing.price_list.catalog import get_price_list_prices, get_special_offer_prices
+from marketing.price_list.models import SpecialOffer
+from system_func.api.views import report_job_response
 from user_system.client_profile.models import ClientProfile
 from user_system.employee_profile.models import EmployeeProfile
-from utils.constants import maNhomND, data_status, perm_actions
-from utils.datetime_handle import convert_date_format
+from utils.constants import maNhomND
 from utils.model_filter_paginate import filter_data, get_query_parameters, build_absolute_uri_with_params
 
 
@@ -186,58 +185,8 @@ class ProductStatisticsView(APIView):
         start_date_1, end_date_1, start_date_2, end_date_2 = self.convert_dates(input_date)
         app_log.info(f"Paginate test page: {page} | {limit}")
         app_log.info(f"Test datetime: {start_date_1} to {end_date_1} | {start_date_2} | to {end_date_2}")
-        orders_1 = Order.objects.filter(client_id=user, date_get__gte=start_date_1, date_get__lte=end_date_1)
-        orders_2 = Order.objects.filter(client_id=user, date_get__gte=start_date_2, date_get__lte=end_date_2)
-
-        if len(product_ids) > 0:
-            orders_1 = orders_1.filter(order_detail__product_id__in=product_ids).distinct()
-            orders_2 = orders_2.filter(order_detail__product_id__in=product_ids).distinct()
-
-        match type_statistic:
-            case 'special_offer':
-                orders_1 = orders_1.filter(Q(new_special_offer__isnull=False) | Q(is_so=True))
-                orders_2 = orders_2.filter(Q(new_special_offer__isnull=False) | Q(is_so=True))
-            case 'normal':
-                orders_1 = orders_1.filter(
-                    Q(new_special_offer__isnull=True) & Q(Q(is_so=False) | Q(is_so__isnull=True)))
-                orders_2 = orders_2.filter(
-                    Q(new_special_offer__isnull=True) & Q(Q(is_so=False) | Q(is_so__isnull=True)))
-
-        orders_1 = orders_1.order_by('-id')
-        orders_2 = orders_2.order_by('-id')
-
-        order_ids_1 = orders_1.values_list('id', flat=True)
-        order_ids_2 = orders_2.values_list('id', flat=True)
-
-        query_data_1 = Q(order_id__in=order_ids_1)
-        query_data_2 = Q(order_id__in=order_ids_2)
-
-        if len(product_ids) > 0:
-            query_data_1 &= Q(product_id__in=product_ids)
-            query_data_2 &= Q(product_id__in=product_ids)
-
-        details_1 = OrderDetail.objects.filter(query_data_1).values('product_id', 'product_id__name').annotate(
-            total_quantity=Sum('order_quantity'),
-            total_point=Sum('point_get'),
-            total_price=Sum('product_price'),
-            total_box=Sum('order_box'),
-            total_cashback=Sum(Case(
-                When(price_so__isnull=False, then=Coalesce(F('price_so'), 0.0) * F('order_box')),
-                default=0,
-                output_field=FloatField()
-            ))
-        )
-        details_2 = OrderDetail.objects.filter(query_data_2).values('product_id', 'product_id__name').annotate(
-            total_quantity=Sum('order_quantity'),
-            total_point=Sum('point_get'),
-            total_price=Sum('product_price'),
-            total_box=Sum('order_box'),
-            total_cashback=Sum(Case(
-                When(price_so__isnull=False, then=Coalesce(F('price_so'), 0.0) * F('order_box')),
-                default=0,
-                output_field=FloatField()
-            ))
-        )
+        details_1 = product_statistics(user, start_date_1.date(), end_date_1.date(), product_ids, type_statistic)
+        details_2 = product_statistics(user, start_date_2.date(), end_date_2.date(), product_ids, type_statistic)
 
         return details_1, details_2
 
@@ -263,7 +212,7 @@ class ProductStatisticsView(APIView):
 
         for detail in details_1:
             product_id = detail['product_id']
-            product_name = detail['product_id__name']
+            product_name = detail['product__name']
 
             combined_results[product_id] = {
                 "product_name": product_name,
@@ -279,7 +228,7 @@ class ProductStatisticsView(APIView):
 
         for detail in details_2:
             product_id = detail['product_id']
-            product_name = detail['product_id__name']
+            product_name = detail['product__name']
 
             if product_id not in combined_results:
                 combined_results[product_id] = {
@@ -305,28 +254,18 @@ class ExportReport(APIView):
     permission_classes = [partial(ValidatePermRest, model=Order)]
 
     def get(self, request):
-        start_time = time.time()
-        orders = handle_order(request)
-        orders = orders.order_by('-date_get', '-id')
-        total_items = orders.count()
-        end_item = total_items if total_items < 20000 else 20000
-        orders = orders[0:end_item]
-        start_time2 = time.time()
-        today = datetime.now().date()
+        # File is built by report worker, client polls status_url then downloads
+        return report_job_response(request, 'orders', request.query_params.dict())
 
-        workbook = generate_order_excel(orders, today)
-        output = BytesIO()
-        workbook.save(output)
-        output.seek(0)
-        print(f"Time generate file: {time.time() - start_time2}")
-        response = StreamingHttpResponse(
-            output,
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename=BangToa_{datetime.now().strftime("%d-%m-%Y")}.xlsx'
 
-        print(f"Time export to excel: {time.time() - start_time}")
-        return response
+def export_orders_file(params, output):
+    """ Report builder of ExportReport, rows are streamed into output while orders are read """
+    orders = handle_order(SimpleNamespace(query_params=params, data={}))
+    orders = orders.order_by('-date_get', '-id')
+    today = datetime.now().date()
+    for chunk in stream_order_excel(orders, today):
+        output.write(chunk)
+    return f'BangToa_{today.strftime("%d-%m-%Y")}.xlsx'
 
 
 class TotalStatisticsView(APIView):
@@ -426,48 +365,8 @@ class TotalStatisticsView(APIView):
         start_date_1, end_date_1, start_date_2, end_date_2 = self.convert_dates(start_date_1, end_date_1, start_date_2,
                                                                                 end_date_2)
 
-        orders_1 = Order.objects.filter(client_id=user, date_get__gte=start_date_1, date_get__lte=end_date_1)
-        orders_2 = Order.objects.filter(client_id=user, date_get__gte=start_date_2, date_get__lte=end_date_2)
-
-        if product_ids:
-            orders_1 = orders_1.filter(order_detail__product_id__in=product_ids).distinct()
-            orders_2 = orders_2.filter(order_detail__product_id__in=product_ids).distinct()
-
-        match type_statistic:
-            case 'special_offer':
-                orders_1 = orders_1.filter(Q(new_special_offer__isnull=False) | Q(is_so=True))
-                orders_2 = orders_2.filter(Q(new_special_offer__isnull=False) | Q(is_so=True))
-            case 'normal':
-                orders_1 = orders_1.filter(
-                    Q(new_special_offer__isnull=True) & Q(Q(is_so=False) | Q(is_so__isnull=True)))
-                orders_2 = orders_2.filter(
-                    Q(new_special_offer__isnull=True) & Q(Q(is_so=False) | Q(is_so__isnull=True)))
-
-        details_1 = orders_1.values('order_detail__product_id', 'order_detail__product_id__name').annotate(
-            total_quantity=Sum('order_detail__order_quantity'),
-            total_point=Sum('order_detail__point_get'),
-            total_price=Sum('order_detail__product_price'),
-            total_box=Sum('order_detail__order_box'),
-            total_cashback=Sum(Case(
-                When(order_detail__price_so__isnull=False,
-                     then=Coalesce('order_detail__price_so', 0.0) * F('order_detail__order_box')),
-                default=0,
-                output_field=FloatField()
-            ))
-        )
-
-        details_2 = orders_2.values('order_detail__product_id', 'order_detail__product_id__name').annotate(
-            total_quantity=Sum('order_detail__order_quantity'),
-            total_point=Sum('order_detail__point_get'),
-            total_price=Sum('order_detail__product_price'),
-            total_box=Sum('order_detail__order_box'),
-            total_cashback=Sum(Case(
-                When(order_detail__price_so__isnull=False,
-                     then=Coalesce('order_detail__price_so', 0.0) * F('order_detail__order_box')),
-                default=0,
-                output_field=FloatField()
-            ))
-        )
+        details_1 = product_statistics(user, start_date_1.date(), end_date_1.date(), product_ids, type_statistic)
+        details_2 = product_statistics(user, start_date_2.date(), end_date_2.date(), product_ids, type_statistic)
 
         return details_1, details_2
 
@@ -479,8 +378,8 @@ class TotalStatisticsView(APIView):
         total_box = 0
         total_products_type = list()
         for detail in details_1:
-            product_id = detail['order_detail__product_id']
-            product_name = detail['order_detail__product_id__name']
+            product_id = detail['product_id']
+            product_name = detail['product__name']
             total_products_type.append(product_id)
             combined_results[product_id] = {
                 "product_name": product_name,
@@ -504,8 +403,8 @@ class TotalStatisticsView(APIView):
         total_box_2 = 0
         total_products_type2 = list()
         for detail in details_2:
-            product_id = detail['order_detail__product_id']
-            product_name = detail['order_detail__product_id__name']
+            product_id = detail['product_id']
+            product_name = detail['product__name']
             total_products_type2.append(product_id)
             if product_id not in combined_results:
                 combined_results[product_id] = {
@@ -713,51 +612,49 @@ class ApiSeasonalStatistic(viewsets.GenericViewSet, mixins.ListModelMixin, mixin
 
     @action(detail=True, methods=['get'], url_path='export')
     def export(self, request, *args, pk=None):
-        try:
-            season_statistic = self.get_object()
-            users_stats = SeasonalStatisticUser.objects.filter(season_stats=season_statistic).values(
-                'user__id', 'user__clientprofile__client_lv1_id', 'user__clientprofile__nvtt_id',
-                'turn_per_point', 'turn_pick', 'redundant_point', 'total_point'
-            )
-            df = pd.DataFrame(list(users_stats))
-
-            client_ids = df['user__clientprofile__client_lv1_id']
-            nvtt_ids = df['user__clientprofile__nvtt_id']
-
-            client_lv1 = dict(
-                ClientProfile.objects.filter(client_id_id__in=client_ids).values_list('client_id', 'register_name'))
-            nvtt = dict(
-                EmployeeProfile.objects.filter(employee_id_id__in=nvtt_ids).values_list('employee_id', 'register_name'))
-
-            df.rename(columns={
-                'user__id': 'Mã Khách Hàng',
-                'user__clientprofile__client_lv1_id': 'NPP',
-                'user__clientprofile__nvtt_id': 'NVTT',
-                'turn_per_point': 'Điểm/Tem',
-                'turn_pick': 'Số tem',
-                'redundant_point': 'Điểm dư',
-                'total_point': 'Tổng điểm'
-            }, inplace=True)
-            df['NPP'] = df['NPP'].map(client_lv1)
-            df['NVTT'] = df['NVTT'].map(nvtt)
-
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', )
-            response['Content-Disposition'] = f'attachment; filename="{season_statistic.name}.xlsx"'
-            with pd.ExcelWriter(response, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Season Stats')
-                worksheet = writer.sheets['Season Stats']
-                # Set column widths (Excel column width units)
-                worksheet.column_dimensions['A'].width = 124 / 7  # Approximation to Excel units
-                worksheet.column_dimensions['B'].width = 140 / 7
-                worksheet.column_dimensions['C'].width = 140 / 7
-
-            return response
-        except Exception as e:
-            if settings.DEBUG:
-                raise e
-            else:
-                return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-
+        season_statistic = self.get_object()
+        return report_job_response(request, 'season_stats', {'pk': season_statistic.pk})
+
+
+def export_season_stats_file(params, output):
+    season_statistic = SeasonalStatistic.objects.get(pk=params['pk'])
+    users_stats = SeasonalStatisticUser.objects.filter(season_stats=season_statistic).values(
+        'user__id', 'user__clientprofile__client_lv1_id', 'user__clientprofile__nvtt_id',
+        'turn_per_point', 'turn_pick', 'redundant_point', 'total_point'
+    )
+    df = pd.DataFrame(list(users_stats), columns=[
+        'user__id', 'user__clientprofile__client_lv1_id', 'user__clientprofile__nvtt_id',
+        'turn_per_point', 'turn_pick', 'redundant_point', 'total_point'
+    ])
+
+    client_ids = df['user__clientprofile__client_lv1_id']
+    nvtt_ids = df['user__clientprofile__nvtt_id']
+
+    client_lv1 = dict(
+        ClientProfile.objects.filter(client_id_id__in=client_ids).values_list('client_id', 'register_name'))
+    nvtt = dict(
+        EmployeeProfile.objects.filter(employee_id_id__in=nvtt_ids).values_list('employee_id', 'register_name'))
+
+    df.rename(columns={
+        'user__id': 'Mã Khách Hàng',
+        'user__clientprofile__client_lv1_id': 'NPP',
+        'user__clientprofile__nvtt_id': 'NVTT',
+        'turn_per_point': 'Điểm/Tem',
+        'turn_pick': 'Số tem',
+        'redundant_point': 'Điểm dư',
+        'total_point': 'Tổng điểm'
+    }, inplace=True)
+    df['NPP'] = df['NPP'].map(client_lv1)
+    df['NVTT'] = df['NVTT'].map(nvtt)
+
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Season Stats')
+        worksheet = writer.sheets['Season Stats']
+        # Set column widths (Excel column width units)
+        worksheet.column_dimensions['A'].width = 124 / 7  # Approximation to Excel units
+        worksheet.column_dimensions['B'].width = 140 / 7
+        worksheet.column_dimensions['C'].width = 140 / 7
+    return f'{season_statistic.name}.xlsx'
 
 
 class OrderSOCount(APIView):
@@ -826,18 +723,19 @@ class OrderSOCount(APIView):
                 return Response({'message': f"unexpected error: {e}"}, status=status.HTTP_400_BAD_REQUEST)
 
     def serializer(self, so_objs, get_so_order):
+        # Orders and stored box totals of every special offer in one query
+        orders_used = dict()
+        total_boxes = dict()
+        for so_id, order_id, total_box in get_so_order.values_list('new_special_offer_id', 'id', 'total_box'):
+            orders_used.setdefault(so_id, list()).append(order_id)
+            total_boxes[so_id] = total_boxes.get(so_id, 0) + (total_box or 0)
         data = []
         for so in so_objs:
-            orders = get_so_order.filter(new_special_offer=so)
-            order_ids = orders.values_list('id', flat=True)
-            total_box = OrderDetail.objects.filter(order_id__in=order_ids).aggregate(
-                total_box=Sum('order_box'))['total_box'] or 0
-
             input_data = {
                 'so_id': so.id,
-                'time_used': orders.count(),
-                'total_used_box': total_box,
-                'orders_used': list(orders.values_list('id', flat=True)),
+                'time_used': len(orders_used.get(so.id, [])),
+                'total_used_box': total_boxes.get(so.id, 0),
+                'orders_used': orders_used.get(so.id, []),
             }
             data.append(input_data)
         return data
@@ -959,6 +857,7 @@ def handle_order(request) -> QuerySet[Order]:
 
 
 def generate_order_excel(orders, date_get, report=False):
+    """ Workbook kept in memory for mail attachments which add sheets, download uses stream_order_excel """
     workbook = openpyxl.Workbook()
     sheet = workbook.active
     sheet.title = "Danh sách toa"
@@ -976,214 +875,56 @@ def generate_order_excel(orders, date_get, report=False):
                                diagonal=border_style, diagonal_direction=0)
     sheet.merge_cells('A1:N1')
 
-    date_get = date_get.strftime('%d-%m-%Y')
-
     title_cell = sheet.cell(row=1, column=1)
-    title_cell.value = f'Báo cáo phiếu đặt hàng ngày {date_get}'
+    title_cell.value = order_excel_title(date_get)
     title_cell.font = title_font
     title_cell.alignment = center_alignment
 
-    total_price = OrderDetail.objects.filter(order_id__in=orders).aggregate(
-        total_price=Sum('product_price'))['total_price']
-    total_price = total_price or 0
-    total_price = "{:,.0f}".format(total_price)
     sheet.merge_cells('A2:N2')
     note_cell = sheet.cell(row=2, column=1)
-    note = f'Ngày thống kê: {datetime.now().strftime("%d/%m/%Y")}   ||   Tổng doanh thu: {total_price}   ||   Số lượng bản kê: {orders.count()}'
-
-    note_cell.value = note
+    note_cell.value = order_excel_note(orders)
     note_cell.font = note_font
     note_cell.alignment = center_alignment
 
-    column_widths = {
-        'Mã phiếu': 106,
-        'Loại phiếu': 80,
-        'Mã khách hàng': 98,
-        'Tên Khách hàng': 136,
-        'NPP': 140,
-        'NVTT': 144,
-        'Ngày nhận phiếu': 92,
-        'Người tạo phiếu': 86,
-        'Ngày nhận hàng': 98,
-        'Ngày gửi trễ': 84,
-        'Ghi chú': 72,
-        'Mã sản phẩm': 84,
-        'Tên sản phẩm': 196,
-        'Số lượng': 64,
-        'Số thùng': 68,
-        'Đơn giá': 80,
-        'Thành tiền': 82,
-    }
-
-    columns = list(column_widths.keys())
-
-    if report is False:
-        updated: list[dict] = [{'Đơn giá ưu đãi': 80}, {'Điểm đạt': 80}]
-        for value in updated:
-            columns.append(list(value.keys())[0])
-            column_widths[list(value.keys())[0]] = value[list(value.keys())[0]]
-
-    for col_num, column_title in enumerate(columns, 1):
+    column_widths = order_excel_columns(report)
+    for col_num, (column_title, width) in enumerate(column_widths.items(), 1):
         cell = sheet.cell(row=4, column=col_num)  # Thêm tiêu đề cột từ dòng 4
         cell.value = column_title
         cell.font = header_font
         cell.alignment = center_alignment
         cell.fill = header_fill
         cell.border = full_border_style
-        print(f"Test: {column_title}")
-        col_letter = get_column_letter(col_num)
-        if column_title in column_widths:
-            sheet.column_dimensions[col_letter].width = column_widths[column_title] / 7.2
-        else:
-            sheet.column_dimensions[col_letter].width = 120 / 7.2
-
-    row_num = 5
-
-    client_profiles = {cp.client_id_id: cp for cp in
-                       ClientProfile.objects.filter(client_id__in=[o.client_id_id for o in orders])}
-    # client_lv1_ids = [client_profiles[o.client_id_id].client_lv1_id for o in orders if
-    #                   o.client_id_id in client_profiles and client_profiles[o.client_id_id].client_lv1_id]
-    npp_ids = orders.values_list('npp_id', flat=True)
-    npp_ids = list(set(npp_ids))
-    npp_profiles = {cp.client_id_id: cp for cp in ClientProfile.objects.filter(client_id__in=npp_ids)}
-
-    nvtt_ids = set()
-    for o in orders:
-        if o.nvtt_id and o.nvtt_id not in nvtt_ids:
-            nvtt_ids.add(o.nvtt_id)
-        elif o.client_id_id in client_profiles and client_profiles[o.client_id_id].nvtt_id:
-            nvtt_ids.add(client_profiles[o.client_id_id].nvtt_id)
-
-    employee_profiles = {ep.employee_id_id: ep for ep in EmployeeProfile.objects.filter(employee_id__in=nvtt_ids)}
-    app_log.info(f"__ Count order: {orders.count()}")
-    for i, order in enumerate(orders):
-        # Get client data from query result
-        client_data = client_profiles.get(order.client_id_id)
-        # Handle change datetime format date_company_get
-        try:
-            date_obj_local = order.date_company_get.astimezone()
-            date_send = datetime.strftime(date_obj_local, "%d/%m/%Y")
-        except Exception as e:
-            date_send = ''
-
-        # Handle change date format date_get
-        try:
-            date_get = datetime.strftime(order.date_get, "%d/%m/%Y")
-        except TypeError:
-            date_get = ''
-
-        # Get type list
-        type_list = order.list_type if order.list_type and order.list_type != '' else 'cấp 2 gửi'
-        if order.is_so and report:
-            type_list = 'ưu đãi'
-
-        # Get client lv1/npp name
-        npp_name = ''
-        if order.npp_id not in [None, '']:
-            npp_name = npp_profiles[order.npp_id].register_name
-        # Get nvtt name
-        nvtt_name = ''
-        nvtt_id = order.nvtt_id if order.nvtt_id else (client_data.nvtt_id if client_data else None)
-        if nvtt_id and nvtt_id in employee_profiles:
-            nvtt_name = employee_profiles[nvtt_id].register_name
-        # Generate note as dict for json decode
-        note_dict = {}
-        if order.note != '':
-            try:
-                note_dict = json.loads(order.note)
-            except (json.JSONDecodeError, TypeError):
-                pass
-        # Trying get dict[key] from notes dict
-        noting = note_dict.get('notes', '')
-
-        # Create data for a row
-        data_list = [
-            order.id,
-            type_list,
-            client_data.client_id_id if client_data else '',  # Mã khách hàng
-            client_data.register_name if client_data else '',  # Tên Khách hàng
-            npp_name,  # Khách hàng cấp 1
-            nvtt_name,  # NVTT
-            date_send,
-            order.created_by,
-            date_get,
-            order.date_delay if order.date_delay else 0,
-            noting,
-        ]
-        if order.order_detail.all().count() > 0:
-            for detail in order.order_detail.all():
-                product_id = ''
-                product_name = ''
-                if detail.product_id:
-                    product_id = detail.product_id.id
-                    product_name = detail.product_id.name
-                total_price = detail.product_price or 0
-                price_so = detail.price_so if detail.price_so else ''
-
-                try:
-                    price = total_price / detail.order_quantity
-                except ZeroDivisionError:
-                    price = 0
-                formatted_price = "{:,.0f}".format(price)
-                formatted_total_price = "{:,.0f}".format(total_price)
-                details_data = [
-                    product_id,
-                    product_name,
-                    detail.order_quantity,
-                    detail.order_box,
-                    formatted_price,
-                    formatted_total_price,
-                ]
-                if report is False:
-                    details_data.append(price_so)
-                    details_data.append(detail.point_get)
-                export_data = data_list + details_data
-                sheet.append(export_data)
-
-                for col, value in enumerate(export_data, 1):
-                    cell = sheet.cell(row=row_num, column=col)
-                    cell.font = note_font
-                    if col in {7, 9}:
-                        cell.alignment = center_alignment
-                        cell.font = date_font
-                    if col == 18:  # 'Đơn giá KM' column
-                        cell = sheet.cell(row=row_num, column=col)
-                        cell.font = bold_font
-
-                row_num += 1
-        else:
-            details_data = [
-                '',
-                '',
-                0,
-                0,
-                order.order_price,
-                0,
-            ]
-            if report is False:
-                details_data.append(0)
-                details_data.append(0)
-            export_data = data_list + details_data
-            sheet.append(export_data)
+        sheet.column_dimensions[get_column_letter(col_num)].width = width / 7.2
+
+    for export_data in order_excel_rows(orders, report):
+        sheet.append(export_data)
+        for cell in sheet[sheet.max_row]:
+            if cell.column in DATE_COLUMNS:
+                cell.alignment = center_alignment
+                cell.font = date_font
+            elif cell.column == BOLD_COLUMN:
+                cell.font = bold_font
+            else:
+                cell.font = note_font
 
     return workbook
 
 
 def get_product_price(product_id, price_list_id):
-    product_price = ProductPrice.objects.filter(
-        product_id=product_id, price_list_id=price_list_id
-    ).first()
+    product_price = get_price_list_prices(price_list_id).get(product_id)
     return product_price.price if product_price else None
 
 
 def get_special_offer_price(product_id, special_offer_id):
-    special_offer_product = SpecialOfferProduct.objects.filter(
-        product_id=product_id, special_offer_id=special_offer_id
-    ).first()
+    special_offer_product = get_special_offer_prices(special_offer_id).get(product_id)
     return special_offer_product.price if special_offer_product else None
 
 
 class ApiImportOrder(APIView):
+    authentication_classes = [JWTAuthentication, BasicAuthentication, SessionAuthentication]
+    # Job state lists clients and orders of file, viewing it needs Order view perm too
+    permission_classes = [partial(ValidatePermRest, model=Order, allow_view=False)]
+
     def post(self, request):
         file = request.FILES.get('file_import', None)
         if not file:
@@ -1192,301 +933,29 @@ class ApiImportOrder(APIView):
 
         if file_extension not in ['.xlsx']:
             return Response({'message': 'File must be .xlsx'}, status=status.HTTP_400_BAD_REQUEST)
-        # data = get_excel_to_dict(file)
-        # print(data)
-        # return Response({'data': data})
-        try:
-            data = get_excel_to_dict(file)
-
-            success, error = create_order(data)
-            app_log.info(f"Import success: \n{success}")
-            app_log.info(f"Import error: \n{error}")
-            return Response({
-                'message': 'ok',
-                'success': success,
-                'errors': error
-            }, status=status.HTTP_200_OK)
-        except Exception as e:
-            if settings.DEBUG:
-                raise e
-            else:
-                return Response({'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Import chạy nền, client poll tiến độ theo job_id
+        job_id = start_import_job(file.read(), getattr(request.user, 'id', None))
+        return Response({'message': 'ok', 'job_id': job_id, 'status': 'pending'}, status=status.HTTP_202_ACCEPTED)
 
+    def get(self, request, job_id):
+        state = get_job_state(job_id)
+        if state is None:
+            return Response({'message': f'import job {job_id} not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(state, status=status.HTTP_200_OK)
 
-def create_order(data):
-    error_data = list()
-    update_list = list()
 
-    for orders_data in data:
-        data_lines = orders_data['lines_number']
-        try:
-            with transaction.atomic():
-                client_id = orders_data.get('client_id')
-                # Trying query get user by client id
-                client: User = User.objects.filter(id=client_id).first()
-                # When client not exist
-                if not client:
-                    # Print data to errors
-                    raise ValueError(f'user {orders_data.get("client_id")} không tồn tại')
-                # Handle date
-                min_date = orders_data.get('min_date_get')
-                max_date = orders_data.get('max_date_get')
-
-                # Get available price list
-                price_lists = PriceList.objects.filter(
-                    Q(date_start__lte=min_date, date_end__gte=min_date) |
-                    Q(date_start__lte=max_date, date_end__gte=max_date)
-                )
-                price_lists_id = price_lists.values_list('id', flat=True).distinct()
-
-                available_perm = [f'{perm_actions["create"]}_{get_perm_name(PriceList)}_{pl_id}' for pl_id in
-                                  price_lists_id]
-                all_client_perm = client.get_all_user_perms()
-                all_prl_perm = all_client_perm.filter(name__in=available_perm)
-                prl_ids = list()
-                if all_prl_perm.exists():
-                    prl_ids = all_prl_perm.values_list('object_id', flat=True).distinct()
-                pl = price_lists.filter(id__in=prl_ids)
-                app_log.info(f"PL of user {client_id}: {pl.count()} - {pl.first()}")
-                for order in orders_data.get('orders', []):
-                    # for key, value in order.items():
-                    #     print(f"Key: {key}, Value: {value}")
-                    # Split detail data
-                    details_data = order.pop('order_details')
-                    # Get client id
-                    nvtt = User.objects.filter(clientprofile__register_name__icontains=order['nvtt'],
-                                               group_user__name='nvtt')
-                    nvtt_id = ''
-                    if nvtt.exists():
-                        nvtt_id = nvtt.first().id
-                    # Create Order data
-                    order_data = Order(
-                        client_id=client,
-                        list_type=order['type_list'],
-                        date_get=order['date_get'],
-                        date_company_get=order['date_company_get'],
-                        date_delay=order['date_delay'],
-                        nvtt_id=nvtt_id,
-                        created_by=order['created_by'],
-                        status=data_status.active
-                    )
-                    noting = order['note']
-                    # Jsonify note
-                    note = json.dumps({'notes': noting})
-                    order_data.note = note
-
-                    # Call save() to create Order
-                    order_data.save()
-
-                    detail_order = list()
-                    turnover_minus = order.get('minus_turnover', None)
-                    count_so = order.get('count_so', None)
-                    count_turnover = False
-                    app_log.info(f"__ CHECKING count_so: {count_so} | {count_so not in ['', 'nan', None]}")
-                    if count_so not in ['', 'nan', None]:
-                        count_turnover = True
-                    app_log.info(f"__ CHECKING count_so 2: {count_so}")
-                    so_data = {
-                        'is_so': False,
-                        'minus': turnover_minus,
-                        'count': count_turnover
-                    }
-
-                    order_data.count_turnover = count_turnover
-                    order_data.minus_so_box = turnover_minus
-                    order_data.save(update_fields=['count_turnover', 'minus_so_box'])
-
-                    total_point = 0
-                    total_price = 0
-                    detail_error = False
-                    success_line = []
-                    # Loop to details_data
-                    for detail in details_data:
-                        if detail_error:
-                            break
-                        # Trying get product object
-                        product = Product.objects.filter(id=detail['product_id']).first()
-                        point = detail.get('point', None)
-                        # If product not found
-                        if not product:
-                            raise ValueError(f'quy cách {detail["product_id"]} không tồn tại')
-
-                        if point is None:
-                            if pl.count() > 1:
-                                raise ValueError(f'user có {pl.count()} bảng giá, không lấy được điểm cho sản phẩm')
-
-                            elif pl.count() == 1:
-                                product_price = ProductPrice.objects.filter(price_list=pl.first(), product=product)
-                                if product_price.exists():
-                                    product_price = product_price.first()
-                                    point = product_price.point
-                                    point = point if point else 0
-                                else:
-                                    point = 0
-                            else:
-                                point = 0
-
-                        note = {
-                            'id': product.id,
-                            'price': detail['price'],
-                            'point': point,
-                            'to_money': ''
-                        }
-                        note = json.dumps(note)
-                        points = point * detail['box']
-                        price = detail['total_price'] if detail['total_price'] else 0
-                        price_so = detail['price_so'] if detail['price_so'] not in ['', None, 'nan'] else None
-                        order_detail = OrderDetail(
-                            order_id=order_data,
-                            product_id=product,
-                            order_quantity=detail['quantity'],
-                            order_box=detail['box'],
-
-                            note=note,
-                            product_price=price,
-                            point_get=points,
-                            price_so=price_so
-                        )
-                        total_price += price
-                        total_point += points
-                        #     total_price += detail['price']
-                        detail_order.append(order_detail)
-                        if price_so and not so_data.get('is_so'):
-                            so_data['is_so'] = True
-                        success_line.append(detail.get('line_number'))
-                    if detail_error:
-                        order.delete()
-                        continue
-                    order_data.order_point = total_point
-                    order_data.order_price = total_price
-                    if so_data.get('is_so'):
-                        order_data.is_so = so_data.get('is_so')
-                    order_data.save()
-                    # if has_nvtt and all(product_prices):
-                    # handle_after_order(client, total_point, total_price)
-                    update_list.append(
-                        {
-                            'success_line': success_line,
-                            'group_order': order.get('group_order'),
-                            'client_id': orders_data.get('client_id'),
-                            'order_id': order_data.id,
-                        }
-                    )
-                    data_lines = [number for number in data_lines if number not in success_line]
-                    OrderDetail.objects.bulk_create(detail_order)
-                    update_point(client)
-                    update_season_stats_user(client, order_data.date_get)
-                    is_so = order_data.is_so if order_data.is_so in [False, True] else False
-                    app_log.info(f"TEST so_data from import: {so_data}")
-                    update_user_turnover(client, order_data, is_so, so_data=so_data)
-        except ValueError as e:
-            # print(f"Detail message: {detail_message}")
-            error_ = {
-                'line': data_lines,
-                'message': f"{e}"
-            }
-            error_data.append(error_)
-        except Exception as e:
-            if settings.DEBUG:
-                raise e
-            else:
-                data_error = {
-                    'error_lines': data_lines,
-                    'message': f'lỗi import: {e}'
-                }
-                error_data.append(data_error)
-
-    return update_list, error_data
-
-
-def get_excel_to_dict(file):
-    # Đọc dữ liệu từ file Excel
-    df = pd.read_excel(file, engine='openpyxl')
-
-    # Định nghĩa mapping giữa tên cột Excel và key trong dict
-    column_mapping = {
-        'Mã toa': 'group_order',
-        'Loại bảng kê': 'type_list',
-        'Mã khách hàng': 'client_id',
-        'Tên Khách hàng': 'client_name',
-        'Khách hàng cấp 1': 'client_lv1',
-        'NVTT': 'nvtt',
-        'Ngày nhận toa': 'date_company_get',
-        'Người tạo toa': 'created_by',
-        'Ngày nhận hàng': 'date_get',
-        'Ngày gửi trễ': 'date_delay',
-        'Ghi chú': 'note',
-        'Mã sản phẩm': 'product_id',
-        'Tên sản phẩm': 'product_name',
-        'Số lượng': 'quantity',
-        'Số thùng': 'box',
-        'Đơn giá': 'price',
-        'Thành tiền': 'total_price',
-        'Đơn giá KM': 'price_so',
-        'Điểm 1 thùng': 'point',
-        'Tính doanh số': 'count_so',
-        'Trừ doanh số': 'minus_turnover'
-    }
-
-    # Áp dụng việc đổi tên cột
-    df.rename(columns=column_mapping, inplace=True)
-    df['line_number'] = df.index + 1
-    # Xử lý các giá trị NaN, +inf, -inf
-    df.replace({np.inf: None, -np.inf: None, np.nan: None}, inplace=True)
-
-    df['date_company_get'] = df['date_company_get'].apply(convert_date_format)
-    df['date_get'] = df['date_get'].apply(convert_date_format)
-
-    # Tính toán ngày nhỏ nhất và lớn nhất cho mỗi client_id
-    client_dates = df.groupby('client_id')['date_get'].agg(min_date_get='min', max_date_get='max').reset_index()
-
-    # Gộp ngày vào df
-    df = df.merge(client_dates, on='client_id')
-
-    # Sắp xếp dữ liệu
-    df.sort_values(by=['client_id', 'date_get'], inplace=True)
-
-    grouped = df.groupby(['client_id', 'group_order'])
-    result = []
-    for (client_id, group_order), group in grouped:
-        order_data = {
-            'group_order': group_order,
-            'type_list': group['type_list'].iloc[0],
-            'date_company_get': group['date_company_get'].iloc[0],
-            'created_by': group['created_by'].iloc[0],
-            'date_get': group['date_get'].iloc[0],
-            'date_delay': group['date_delay'].iloc[0],
-            'client_lv1': group['client_lv1'],
-            'nvtt': group['nvtt'],
-            'note': group['note'].iloc[0],
-            'count_so': group['count_so'].iloc[0],
-            'minus_turnover': group['minus_turnover'].iloc[0],
-            'order_details': group[[
-                'product_id', 'product_name', 'quantity', 'box', 'price',
-                'total_price', 'price_so', 'point', 'line_number'
-            ]].to_dict(orient='records')
-        }
-        result.append((client_id, order_data))
-
-    # Re-group by client_id to nest orders within clients
-    final_result = []
-    result.sort(key=lambda x: x[0])  # Ensure data is sorted by client_id before regrouping
-    for key, group in groupby(result, key=lambda x: x[0]):
-        client_orders = [item[1] for item in group]
-        client_info = df[df['client_id'] == key].iloc[0]
-        lines_number = [ln for order in client_orders for ln in
-                        [detail['line_number'] for detail in order['order_details']]]
-        client_group = {
-            'client_id': key,
-            'client_name': client_info['client_name'],
-            'min_date_get': client_info['min_date_get'],
-            'max_date_get': client_info['max_date_get'],
-            'lines_number': lines_number,
-            'orders': client_orders
-        }
-        final_result.append(client_group)
-
-    return final_result
+class ApiImportOrderErrors(APIView):
+    authentication_classes = [JWTAuthentication, BasicAuthentication, SessionAuthentication]
+    permission_classes = [partial(ValidatePermRest, model=Order, allow_view=False)]
+
+    def get(self, request, job_id):
+        state = get_job_state(job_id)
+        if state is None or not state.get('report'):
+            return Response({'message': f'import job {job_id} has no error report'}, status=status.HTTP_404_NOT_FOUND)
+        path = os.path.join(settings.MEDIA_ROOT, state['report'])
+        if not os.path.exists(path):
+            return Response({'message': f'error report of {job_id} expired'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'import_errors_{job_id}.xlsx')
 
 
 class ApiNvttGetOrderDaily(APIView):
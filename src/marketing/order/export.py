@@ -0,0 +1,202 @@
+import json
+import time
+from datetime import datetime
+
+from django.db.models import Prefetch, Sum
+
+from app.logs import app_log
+from marketing.order.models import OrderDetail
+from user_system.client_profile.models import ClientProfile
+from user_system.employee_profile.models import EmployeeProfile
+from utils.xlsx_stream import XlsxStreamWriter, TITLE, NOTE, HEADER, BODY, DATE, BOLD
+
+# Orders loaded per query, details and profiles are fetched once per chunk
+CHUNK_SIZE = 2000
+
+# Column title: width in pixel
+ORDER_COLUMNS = {
+    'Mã phiếu': 106,
+    'Loại phiếu': 80,
+    'Mã khách hàng': 98,
+    'Tên Khách hàng': 136,
+    'NPP': 140,
+    'NVTT': 144,
+    'Ngày nhận phiếu': 92,
+    'Người tạo phiếu': 86,
+    'Ngày nhận hàng': 98,
+    'Ngày gửi trễ': 84,
+    'Ghi chú': 72,
+    'Mã sản phẩm': 84,
+    'Tên sản phẩm': 196,
+    'Số lượng': 64,
+    'Số thùng': 68,
+    'Đơn giá': 80,
+    'Thành tiền': 82,
+}
+ORDER_EXTRA_COLUMNS = {
+    'Đơn giá ưu đãi': 80,
+    'Điểm đạt': 80,
+}
+# Columns of date (center, small font) and 'Đơn giá ưu đãi' (bold)
+DATE_COLUMNS = {7, 9}
+BOLD_COLUMN = 18
+
+
+def order_excel_columns(report=False) -> dict:
+    if report:
+        return dict(ORDER_COLUMNS)
+    return {**ORDER_COLUMNS, **ORDER_EXTRA_COLUMNS}
+
+
+def order_excel_title(date_get):
+    return f'Báo cáo phiếu đặt hàng ngày {date_get.strftime("%d-%m-%Y")}'
+
+
+def order_excel_note(orders):
+    total_price = orders.aggregate(total_price=Sum('order_price'))['total_price'] or 0
+    total_price = "{:,.0f}".format(total_price)
+    return (f'Ngày thống kê: {datetime.now().strftime("%d/%m/%Y")}   ||   Tổng doanh thu: {total_price}   ||   '
+            f'Số lượng bản kê: {orders.count()}')
+
+
+def order_chunks(orders, chunk_size=CHUNK_SIZE):
+    """ Orders with client and details (and product) loaded, in lists of chunk_size """
+    orders = orders.select_related('client_id').prefetch_related(None).prefetch_related(
+        Prefetch('order_detail', queryset=OrderDetail.objects.select_related('product_id'))
+    )
+    chunk = []
+    for order in orders.iterator(chunk_size=chunk_size):
+        chunk.append(order)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def chunk_profiles(orders):
+    client_profiles = {cp.client_id_id: cp for cp in
+                       ClientProfile.objects.filter(client_id__in={o.client_id_id for o in orders if o.client_id_id})}
+    npp_ids = {o.npp_id for o in orders if o.npp_id}
+    npp_profiles = {cp.client_id_id: cp for cp in ClientProfile.objects.filter(client_id__in=npp_ids)}
+    nvtt_ids = set()
+    for o in orders:
+        client_data = client_profiles.get(o.client_id_id)
+        nvtt_id = o.nvtt_id if o.nvtt_id else (client_data.nvtt_id if client_data else None)
+        if nvtt_id:
+            nvtt_ids.add(nvtt_id)
+    employee_profiles = {ep.employee_id_id: ep for ep in EmployeeProfile.objects.filter(employee_id__in=nvtt_ids)}
+    return client_profiles, npp_profiles, employee_profiles
+
+
+def order_excel_rows(orders, report=False):
+    """ Values of each exported line, one line per order detail (one line for order without detail) """
+    for chunk in order_chunks(orders):
+        client_profiles, npp_profiles, employee_profiles = chunk_profiles(chunk)
+        for order in chunk:
+            # Get client data from query result
+            client_data = client_profiles.get(order.client_id_id)
+            # Handle change datetime format date_company_get
+            try:
+                date_obj_local = order.date_company_get.astimezone()
+                date_send = datetime.strftime(date_obj_local, "%d/%m/%Y")
+            except Exception:
+                date_send = ''
+
+            # Handle change date format date_get
+            try:
+                date_get = datetime.strftime(order.date_get, "%d/%m/%Y")
+            except TypeError:
+                date_get = ''
+
+            # Get type list
+            type_list = order.list_type if order.list_type and order.list_type != '' else 'cấp 2 gửi'
+            if order.is_so and report:
+                type_list = 'ưu đãi'
+
+            # Get client lv1/npp name
+            npp = npp_profiles.get(order.npp_id) if order.npp_id else None
+            npp_name = npp.register_name if npp else ''
+            # Get nvtt name
+            nvtt_name = ''
+            nvtt_id = order.nvtt_id if order.nvtt_id else (client_data.nvtt_id if client_data else None)
+            if nvtt_id and nvtt_id in employee_profiles:
+                nvtt_name = employee_profiles[nvtt_id].register_name
+            # Generate note as dict for json decode
+            note_dict = {}
+            if order.note != '':
+                try:
+                    note_dict = json.loads(order.note)
+                except (json.JSONDecodeError, TypeError):
+                    pass
+            # Trying get dict[key] from notes dict
+            noting = note_dict.get('notes', '') if isinstance(note_dict, dict) else ''
+
+            data_list = [
+                order.id,
+                type_list,
+                client_data.client_id_id if client_data else '',  # Mã khách hàng
+                client_data.register_name if client_data else '',  # Tên Khách hàng
+                npp_name,  # Khách hàng cấp 1
+                nvtt_name,  # NVTT
+                date_send,
+                order.created_by,
+                date_get,
+                order.date_delay if order.date_delay else 0,
+                noting,
+            ]
+            details = order.order_detail.all()
+            if not details:
+                details_data = ['', '', 0, 0, order.order_price, 0]
+                if report is False:
+                    details_data += [0, 0]
+                yield data_list + details_data
+                continue
+            for detail in details:
+                product_id = ''
+                product_name = ''
+                if detail.product_id:
+                    product_id = detail.product_id.id
+                    product_name = detail.product_id.name
+                total_price = detail.product_price or 0
+                price_so = detail.price_so if detail.price_so else ''
+
+                try:
+                    price = total_price / detail.order_quantity
+                except ZeroDivisionError:
+                    price = 0
+                details_data = [
+                    product_id,
+                    product_name,
+                    detail.order_quantity,
+                    detail.order_box,
+                    "{:,.0f}".format(price),
+                    "{:,.0f}".format(total_price),
+                ]
+                if report is False:
+                    details_data.append(price_so)
+                    details_data.append(detail.point_get)
+                yield data_list + details_data
+
+
+def stream_order_excel(orders, date_get, report=False):
+    """ Same sheet as generate_order_excel, produced as xlsx bytes while orders are read """
+    start_time = time.time()
+    columns = order_excel_columns(report)
+    row_styles = tuple(DATE if col in DATE_COLUMNS else
+                       BOLD if col == BOLD_COLUMN else BODY
+                       for col in range(1, len(columns) + 1))
+
+    def rows():
+        yield [order_excel_title(date_get)], TITLE
+        yield [order_excel_note(orders)], NOTE
+        yield None, None
+        yield list(columns.keys()), HEADER
+        lines = 0
+        for values in order_excel_rows(orders, report):
+            lines += 1
+            yield values, row_styles
+        app_log.info(f"Stream order excel: {lines} lines in {time.time() - start_time:.2f}s")
+
+    writer = XlsxStreamWriter("Danh sách toa", [width / 7.2 for width in columns.values()], ['A1:N1', 'A2:N2'])
+    return writer.stream(rows())
@@ -0,0 +1,421 @@
+"""
+Staged import of order Excel file (ApiImportOrder).
+Parse whole file into typed columns, resolve every reference with bulk lookups, then bulk create orders
+and details per chunk of clients, a failing chunk is saved again client by client.
+Runs as background job, progress and result are kept in Redis.
+"""
+import base64
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from account.handlers.perms import get_perm_name
+from account.models import User, UserPerm, UserGroupPerm, GroupPermPerms
+from app.logs import app_log
+from app.redis_db import redis_db, order_import_key, order_import_result_key
+from marketing.order.models import Order, OrderDetail
+from marketing.order.rollup import mark_rollup_dirty
+from marketing.order.stats import mark_stats_dirty
+from marketing.order.tasks import import_orders_task
+from marketing.order.totals import order_detail_totals
+from marketing.price_list.catalog import get_price_list_prices
+from marketing.price_list.models import PriceList
+from marketing.product.models import Product
+from marketing.sale_statistic.ledger import record_order_turnover, month_targets
+from marketing.sale_statistic.models import UserSaleStatistic
+from user_system.client_profile.models import ClientProfile
+from utils.constants import data_status, perm_actions
+from utils.datetime_handle import convert_date_format
+
+BATCH_SIZE = 2000
+# Clients committed in one transaction, progress is updated after each chunk
+CLIENT_CHUNK = 200
+JOB_TTL = 60 * 60 * 24
+REPORT_DIR = 'order_import'
+
+IMPORT_COLUMNS = {
+    'Mã toa': 'group_order',
+    'Loại bảng kê': 'type_list',
+    'Mã khách hàng': 'client_id',
+    'Tên Khách hàng': 'client_name',
+    'Khách hàng cấp 1': 'client_lv1',
+    'NVTT': 'nvtt',
+    'Ngày nhận toa': 'date_company_get',
+    'Người tạo toa': 'created_by',
+    'Ngày nhận hàng': 'date_get',
+    'Ngày gửi trễ': 'date_delay',
+    'Ghi chú': 'note',
+    'Mã sản phẩm': 'product_id',
+    'Tên sản phẩm': 'product_name',
+    'Số lượng': 'quantity',
+    'Số thùng': 'box',
+    'Đơn giá': 'price',
+    'Thành tiền': 'total_price',
+    'Đơn giá KM': 'price_so',
+    'Điểm 1 thùng': 'point',
+    'Tính doanh số': 'count_so',
+    'Trừ doanh số': 'minus_turnover'
+}
+REQUIRED_COLUMNS = ['group_order', 'client_id', 'product_id', 'date_get', 'quantity', 'box']
+NUMBER_COLUMNS = ['quantity', 'box', 'price', 'total_price', 'price_so', 'point', 'date_delay']
+TEXT_COLUMNS = ['group_order', 'client_id', 'product_id', 'nvtt', 'type_list', 'created_by']
+
+
+class OrderImportError(ValueError):
+    pass
+
+
+def _text(value):
+    """ Excel cell to id string, number 123.0 -> '123' """
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def parse_import_file(content: bytes) -> list[dict]:
+    """ Read file into typed rows, ordered by client, date_get, line like old import """
+    df = pd.read_excel(BytesIO(content), engine='openpyxl')
+    df.rename(columns=IMPORT_COLUMNS, inplace=True)
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise OrderImportError(f"file thiếu cột {', '.join(missing)}")
+    for column in IMPORT_COLUMNS.values():
+        if column not in df.columns:
+            df[column] = None
+
+    df['line_number'] = df.index + 1
+    for column in NUMBER_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    df['date_get'] = df['date_get'].map(convert_date_format)
+    df['date_company_get'] = df['date_company_get'].map(convert_date_format)
+    df = df.replace([np.inf, -np.inf], np.nan)
+    df = df.astype(object).where(pd.notnull(df), None)
+    for column in TEXT_COLUMNS:
+        df[column] = df[column].map(_text)
+
+    rows = df.to_dict(orient='records')
+    rows.sort(key=lambda row: (row['client_id'] or '', row['date_get'] or datetime.min.date(), row['line_number']))
+    return rows
+
+
+def group_rows(rows) -> dict:
+    """ {client_id: {group_order: [rows]}} keeping file order """
+    clients = dict()
+    for row in rows:
+        clients.setdefault(row['client_id'], dict()).setdefault(row['group_order'], list()).append(row)
+    return clients
+
+
+class ImportReferences:
+    """ Every user, nvtt, product, price list and perm referenced by file, loaded with one query each """
+
+    def __init__(self, rows):
+        client_ids = {row['client_id'] for row in rows if row['client_id']}
+        product_ids = {row['product_id'] for row in rows if row['product_id']}
+        dates = [row['date_get'] for row in rows if row['date_get']]
+
+        self.clients = User.objects.in_bulk(list(client_ids))
+        self.profiles = {row[0]: row[1:] for row in ClientProfile.objects.filter(
+            client_id_id__in=list(client_ids)).values_list('client_id_id', 'nvtt_id', 'client_lv1_id')}
+        self.products = set(Product.objects.filter(id__in=list(product_ids)).values_list('id', flat=True))
+        self.nvtt_names = list(User.objects.filter(group_user__name='nvtt', clientprofile__isnull=False)
+                               .order_by('id').values_list('id', 'clientprofile__register_name').distinct())
+        self._nvtt_cache = dict()
+
+        self.price_lists = list()
+        self.client_price_lists = defaultdict(set)
+        if dates and client_ids:
+            self.price_lists = list(PriceList.objects.filter(date_start__lte=max(dates), date_end__gte=min(dates))
+                                    .values_list('id', 'date_start', 'date_end'))
+            self.load_price_list_perms(client_ids)
+
+    def load_price_list_perms(self, client_ids):
+        """ Price lists clients can create order, same as get_all_user_perms filter in old import """
+        perm_name = get_perm_name(PriceList)
+        perm_names = {f'{perm_actions["create"]}_{perm_name}_{pl_id}': pl_id for pl_id, _, _ in self.price_lists}
+        if not perm_names:
+            return
+        for user_id, perm_id in UserPerm.objects.filter(user_id__in=list(client_ids), allow=True,
+                                                        perm_id__in=list(perm_names)).values_list('user_id', 'perm_id'):
+            self.client_price_lists[user_id].add(perm_names[perm_id])
+        memberships = defaultdict(set)
+        for user_id, group_id in UserGroupPerm.objects.filter(user_id__in=list(client_ids)).values_list('user_id',
+                                                                                                       'group_id'):
+            memberships[group_id].add(user_id)
+        for group_id, perm_id in GroupPermPerms.objects.filter(group_id__in=list(memberships), allow=True,
+                                                               perm_id__in=list(perm_names)).values_list('group_id',
+                                                                                                         'perm_id'):
+            for user_id in memberships[group_id]:
+                self.client_price_lists[user_id].add(perm_names[perm_id])
+
+    def price_lists_of(self, client_id, min_date, max_date):
+        """ Allowed price lists which contain first or last date_get of client """
+        allowed = self.client_price_lists.get(client_id, set())
+        return [pl_id for pl_id, date_start, date_end in self.price_lists if pl_id in allowed and (
+                date_start <= min_date <= date_end or date_start <= max_date <= date_end)]
+
+    def nvtt_id(self, name):
+        """ First nvtt (by id) whose register name contains name, same as old icontains lookup """
+        if not name:
+            return ''
+        key = name.lower()
+        if key not in self._nvtt_cache:
+            self._nvtt_cache[key] = next((user_id for user_id, register_name in self.nvtt_names
+                                          if register_name and key in register_name.lower()), '')
+        return self._nvtt_cache[key]
+
+
+def build_client_orders(client_id, groups: dict, refs: ImportReferences):
+    """
+    Validate and price every order of one client in memory.
+    Raise OrderImportError with message for whole client, same as old per client transaction.
+    """
+    client = refs.clients.get(client_id)
+    if client is None:
+        raise OrderImportError(f'user {client_id} không tồn tại')
+    client_rows = [row for rows in groups.values() for row in rows]
+    for row in client_rows:
+        if row['date_get'] is None:
+            raise OrderImportError(f'ngày nhận hàng dòng {row["line_number"]} không hợp lệ')
+        if row['quantity'] is None or row['box'] is None:
+            raise OrderImportError(f'số lượng, số thùng dòng {row["line_number"]} không hợp lệ')
+    dates = [row['date_get'] for row in client_rows]
+    price_lists = refs.price_lists_of(client_id, min(dates), max(dates))
+    nvtt_id, npp_id = refs.profiles.get(client_id, (None, None))
+
+    orders = list()
+    for group_order, rows in groups.items():
+        first = rows[0]
+        count_turnover = first['count_so'] not in ['', 'nan', None]
+        minus = first['minus_turnover']
+        order = Order(
+            client_id=client,
+            list_type=first['type_list'],
+            date_get=first['date_get'],
+            date_company_get=first['date_company_get'],
+            date_delay=int(first['date_delay'] or 0),
+            nvtt_id=refs.nvtt_id(next((row['nvtt'] for row in rows if row['nvtt']), None)) or nvtt_id,
+            npp_id=npp_id,
+            created_by=first['created_by'],
+            status=data_status.active,
+            note=json.dumps({'notes': first['note']}),
+            count_turnover=count_turnover,
+            minus_so_box=minus if isinstance(minus, (int, float)) else None,
+            is_so=False,
+        )
+        details = list()
+        for row in rows:
+            product_id = row['product_id']
+            if product_id not in refs.products:
+                raise OrderImportError(f'quy cách {product_id} không tồn tại')
+            point = row['point']
+            if point is None:
+                if len(price_lists) > 1:
+                    raise OrderImportError(f'user có {len(price_lists)} bảng giá, không lấy được điểm cho sản phẩm')
+                point = 0
+                if price_lists:
+                    product_price = get_price_list_prices(price_lists[0]).get(product_id)
+                    point = (product_price.point or 0) if product_price else 0
+            price_so = row['price_so']
+            details.append(OrderDetail(
+                order_id=order,
+                product_id_id=product_id,
+                order_quantity=int(row['quantity']),
+                # bulk_create skips OrderDetail.save, rounded here like it does
+                order_box=round(row['box'], 5),
+                note=json.dumps({'id': product_id, 'price': row['price'], 'point': point, 'to_money': ''}),
+                # Excel amount can have decimals, column is BigInteger
+                product_price=round(row['total_price'] or 0),
+                point_get=round(point * row['box'], 5),
+                price_so=price_so,
+            ))
+            if price_so:
+                order.is_so = True
+        for field, value in order_detail_totals(details).items():
+            setattr(order, field, value)
+        so_data = {'is_so': order.is_so, 'minus': minus, 'count': count_turnover}
+        orders.append((group_order, order, details, so_data, [row['line_number'] for row in rows]))
+    return orders
+
+
+def import_turnover(order: Order, details, so_data, month_target, today):
+    """ UserSaleStatistic.turnover change of one new order, same rules as update_user_turnover """
+    if not order.nvtt_id:
+        return 0
+    if order.date_get.replace(day=1) != today.replace(day=1):
+        return 0
+    total_box = sum(detail.order_box for detail in details)
+    total_price = sum(round(detail.product_price) for detail in details)
+    if so_data['is_so']:
+        minus = so_data['minus']
+        target = minus if isinstance(minus, (int, float)) else month_target
+        fix_price = target * total_box
+        return total_price - fix_price if so_data['count'] else -fix_price
+    return total_price if so_data['count'] else 0
+
+
+def apply_import_turnover(deltas: dict):
+    """ {user_id: turnover delta}, one update per user """
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    existed = set(UserSaleStatistic.objects.filter(user_id__in=list(deltas)).values_list('user_id', flat=True))
+    UserSaleStatistic.objects.bulk_create([UserSaleStatistic(user_id=user_id) for user_id in deltas.keys() - existed])
+    for user_id, delta in deltas.items():
+        UserSaleStatistic.objects.filter(user_id=user_id).update(turnover=F('turnover') + delta)
+
+
+def save_client_orders(client_orders: list):
+    """ Allocate ids in one block and bulk create orders, details and derived stats of a chunk of clients """
+    orders = [order for _, items in client_orders for _, order, _, _, _ in items]
+    with transaction.atomic():
+        for order, order_id in zip(orders, Order.generate_pks(len(orders))):
+            order.id = order_id
+        # Ids of a rolled back try are not kept when chunk is saved again client by client
+        for _, items in client_orders:
+            for _, order, details, _, _ in items:
+                for detail in details:
+                    detail.pk = None
+                    detail.order_id = order
+        Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+        OrderDetail.objects.bulk_create([detail for _, items in client_orders for _, _, details, _, _ in items
+                                         for detail in details], batch_size=BATCH_SIZE)
+
+        today = datetime.now().date()
+        month_target = month_targets([today.replace(day=1)])[today.replace(day=1)]
+        deltas = defaultdict(int)
+        for client_id, items in client_orders:
+            for _, order, details, so_data, _ in items:
+                deltas[client_id] += import_turnover(order, details, so_data, month_target, today)
+        apply_import_turnover(deltas)
+        record_order_turnover([order.id for order in orders], reason='import')
+        # Point and season stats once per user and month
+        for user_id, date_get in {(order.client_id_id, order.date_get.replace(day=1)) for order in orders}:
+            mark_stats_dirty(user_id, date_get)
+        mark_rollup_dirty([(order.client_id_id, order.date_get) for order in orders])
+
+
+def import_orders(rows, progress=None):
+    """ Return (success, errors, error_rows) with same success/error format as old create_order """
+    start_time = time.time()
+    refs = ImportReferences(rows)
+    success = list()
+    errors = list()
+    error_rows = list()
+    processed = 0
+
+    def _fail(client_rows, message):
+        errors.append({'line': [row['line_number'] for row in client_rows], 'message': message})
+        error_rows.extend((row, message) for row in client_rows)
+
+    clients = list(group_rows(rows).items())
+    for i in range(0, len(clients), CLIENT_CHUNK):
+        chunk_clients = dict(clients[i:i + CLIENT_CHUNK])
+        chunk = list()
+        for client_id, groups in chunk_clients.items():
+            try:
+                chunk.append((client_id, build_client_orders(client_id, groups, refs)))
+            except OrderImportError as e:
+                _fail([row for group in groups.values() for row in group], f"{e}")
+        try:
+            save_client_orders(chunk)
+            saved = chunk
+        except Exception as e:
+            # Error of one client rolls back whole chunk: save clients one by one, only failing clients are errors
+            app_log.error(f"Error import orders chunk {i}, retry by client: {e}")
+            saved = list()
+            for client_id, items in chunk:
+                try:
+                    save_client_orders([(client_id, items)])
+                    saved.append((client_id, items))
+                except Exception as e:
+                    _fail([row for group in chunk_clients[client_id].values() for row in group], f'lỗi import: {e}')
+        for client_id, items in saved:
+            for group_order, order, _, _, lines in items:
+                success.append({'success_line': lines, 'group_order': group_order, 'client_id': client_id,
+                                'order_id': order.id})
+        processed += sum(len(group) for groups in chunk_clients.values() for group in groups.values())
+        if progress:
+            progress(processed, len(success), len(error_rows))
+
+    app_log.info(f"Import {len(rows)} lines: {len(success)} orders, {len(error_rows)} error lines "
+                 f"in {time.time() - start_time}")
+    error_rows.sort(key=lambda item: item[0]['line_number'])
+    return success, errors, error_rows
+
+
+def write_error_report(job_id, error_rows) -> str:
+    """ Excel of error lines with message, return path relative to MEDIA_ROOT """
+    relative_path = os.path.join(REPORT_DIR, f"{job_id}.xlsx")
+    path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Lỗi')
+    sheet.append(['Dòng', 'Mã toa', 'Mã khách hàng', 'Mã sản phẩm', 'Lỗi'])
+    for row, message in error_rows:
+        sheet.append([row['line_number'], row['group_order'], row['client_id'], row['product_id'], message])
+    workbook.save(path)
+    return relative_path
+
+
+def set_job_state(job_id, **state):
+    key = order_import_key(job_id)
+    redis_db.hset(key, mapping={name: '' if value is None else value for name, value in state.items()})
+    redis_db.expire(key, JOB_TTL)
+
+
+def get_job_state(job_id):
+    state = redis_db.hgetall(order_import_key(job_id))
+    if not state:
+        return None
+    if state.get('status') == 'done':
+        result = redis_db.get(order_import_result_key(job_id))
+        state['result'] = json.loads(result) if result else None
+    return state
+
+
+def start_import_job(content: bytes, user_id=None) -> str:
+    job_id = uuid.uuid4().hex
+    set_job_state(job_id, status='pending', created_by=user_id, created_at=datetime.now().isoformat(),
+                  total_lines=0, processed_lines=0, success_orders=0, error_lines=0)
+    import_orders_task.delay(job_id, base64.b64encode(content).decode('utf-8'))
+    return job_id
+
+
+def run_import_job(job_id, content: bytes):
+    """ Celery worker: parse, import and save result and error report of job """
+    try:
+        rows = parse_import_file(content)
+        set_job_state(job_id, status='running', total_lines=len(rows))
+
+        def progress(processed, success_orders, error_lines):
+            set_job_state(job_id, processed_lines=processed, success_orders=success_orders, error_lines=error_lines)
+
+        success, errors, error_rows = import_orders(rows, progress)
+        report = write_error_report(job_id, error_rows) if error_rows else None
+        redis_db.setex(order_import_result_key(job_id), JOB_TTL,
+                       json.dumps({'success': success, 'errors': errors}, default=str))
+        set_job_state(job_id, status='done', report=report, finished_at=datetime.now().isoformat())
+        return {'success': len(success), 'error_lines': len(error_rows)}
+    except Exception as e:
+        app_log.error(f"Error import orders job {job_id}: {e}")
+        try:
+            set_job_state(job_id, status='failed', message=f"{e}", finished_at=datetime.now().isoformat())
+        except redis.RedisError:
+            pass
+        raise e
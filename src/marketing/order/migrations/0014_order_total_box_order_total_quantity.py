@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+backfill_totals = """
+    UPDATE order_order o
+    SET order_point = totals.order_point,
+        order_price = totals.order_price,
+        total_box = totals.total_box,
+        total_quantity = totals.total_quantity
+    FROM (
+        SELECT o2.id,
+               COALESCE(ROUND(SUM(d.point_get)::numeric, 5), 0) AS order_point,
+               COALESCE(SUM(d.product_price), 0) AS order_price,
+               COALESCE(ROUND(SUM(d.order_box)::numeric, 5), 0) AS total_box,
+               COALESCE(SUM(d.order_quantity), 0) AS total_quantity
+        FROM order_order o2
+        LEFT JOIN order_orderdetail d ON d.order_id_id = o2.id
+        GROUP BY o2.id
+    ) totals
+    WHERE o.id = totals.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0013_orderdelete_orderdetaildelete_delete_orderbackup_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_box',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_quantity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(backfill_totals, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,53 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+backfill_rollup = """
+    INSERT INTO order_orderrollup (user_id, npp_id, nvtt_id, product_id, day, is_so, count_turnover,
+                                   quantity, box, price, point, cashback)
+    SELECT o.client_id_id, o.npp_id, o.nvtt_id, d.product_id_id, o.date_get,
+           COALESCE(o.is_so, FALSE) OR o.new_special_offer_id IS NOT NULL, o.count_turnover,
+           COALESCE(SUM(d.order_quantity), 0), COALESCE(SUM(d.order_box), 0), COALESCE(SUM(d.product_price), 0),
+           COALESCE(SUM(d.point_get), 0), COALESCE(SUM(d.price_so * d.order_box), 0)
+    FROM order_order o
+    JOIN order_orderdetail d ON d.order_id_id = o.id
+    WHERE o.client_id_id IS NOT NULL AND o.date_get IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0014_order_total_box_order_total_quantity'),
+        ('product', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('npp_id', models.CharField(max_length=64, null=True)),
+                ('nvtt_id', models.CharField(max_length=64, null=True)),
+                ('day', models.DateField()),
+                ('is_so', models.BooleanField(default=False)),
+                ('count_turnover', models.BooleanField(default=True)),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('box', models.FloatField(default=0)),
+                ('price', models.BigIntegerField(default=0)),
+                ('point', models.FloatField(default=0)),
+                ('cashback', models.FloatField(default=0)),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_rollups', to='product.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['user', 'day'], name='order_rollup_user_day_idx'),
+                    models.Index(fields=['day', 'product'], name='order_rollup_day_product_idx'),
+                ],
+            },
+        ),
+        migrations.RunSQL(backfill_rollup, migrations.RunSQL.noop),
+    ]
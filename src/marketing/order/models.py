@@ -16,7 +16,7 @@ from marketing.product.models import Product
 from marketing.sale_statistic.models import SaleStatistic, SaleTarget
 from system_func.models import PeriodSeason
 from utils.constants import so_type
-from utils.helpers import local_time
+from utils.helpers import local_time, self_id, self_ids, insert_with_new_id
 
 
 # Create your models here.
@@ -39,6 +39,9 @@ class Order(models.Model):
 
     order_point = models.FloatField(null=True)
     order_price = models.FloatField(null=True, default=0)  # Default value to ensure it's not None
+    # Totals of OrderDetail, maintained by marketing.order.totals when details change
+    total_box = models.FloatField(default=0)
+    total_quantity = models.IntegerField(default=0)
     nvtt_id = models.CharField(max_length=64, null=True)
     npp_id = models.CharField(max_length=64, null=True)
 
@@ -59,8 +62,7 @@ class Order(models.Model):
 
     def save(self, *args, **kwargs):
         self.clean()
-        if not self.pk:
-            self.id = self.generate_pk()
+        new_pk = not self.pk
         if not self.nvtt_id and self.client_id:
             try:
                 self.nvtt_id = self.client_id.clientprofile.nvtt_id
@@ -83,32 +85,35 @@ class Order(models.Model):
                 note = {'notes': self.note}
                 self.note = note
         if not self.order_point and not self.order_price:
-            self.calculate_totals()
+            if new_pk:
+                # No detail can belong to an order which is not inserted yet, related managers need the pk
+                self.order_point, self.order_price = 0, 0
+            else:
+                self.calculate_totals()
+        if new_pk:
+            return insert_with_new_id(self, super().save, ('MTN', 5, '%y%m'), *args, **kwargs)
         super().save(*args, **kwargs)
 
+
     def calculate_totals(self):
         order_details = self.order_detail.aggregate(
             total_point=Sum('point_get'),
-            total_price=Sum('product_price')
+            total_price=Sum('product_price'),
+            total_box=Sum('order_box'),
+            total_quantity=Sum('order_quantity')
         )
         self.order_point = round(order_details['total_point'] or 0, 5)
         self.order_price = round(order_details['total_price'] or 0, 5)
+        self.total_box = round(order_details['total_box'] or 0, 5)
+        self.total_quantity = order_details['total_quantity'] or 0
 
     def generate_pk(self):
-        start_char = 'MTN'
-        current_year = datetime.utcnow().year
-        two_digit_year = str(current_year)[-2:]
-        current_month = datetime.utcnow().month
-        two_digit_month = str(current_month).zfill(2)
-        prefix = f"{start_char}{two_digit_year}{two_digit_month}"
-        latest_order = Order.objects.filter(id__startswith=prefix).order_by('-id').first()
-        if latest_order:
-            latest_id = int(latest_order.id[-5:]) + 1
-        else:
-            latest_id = 1
-        if latest_id > 99999:
-            raise ValidationError({'id': 'Out of index'})
-        return f"{prefix}{str(latest_id).zfill(5)}"
+        return self_id('MTN', Order, 5, '%y%m')
+
+    @staticmethod
+    def generate_pks(amount: int):
+        """ Reserve block of order ids in one query, use for bulk create """
+        return self_ids('MTN', Order, 5, amount, '%y%m')
 
 
 class OrderDetail(models.Model):
@@ -139,6 +144,33 @@ class OrderDetail(models.Model):
         super().save(*args, **kwargs)
 
 
+class OrderRollup(models.Model):
+    """
+    Daily sums of OrderDetail per (user, npp, nvtt, product, is_so, count_turnover).
+    Rows of a (user, day) are rebuilt by marketing.order.rollup when an order of that day is written.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='order_rollups')
+    npp_id = models.CharField(max_length=64, null=True)
+    nvtt_id = models.CharField(max_length=64, null=True)
+    product = models.ForeignKey(Product, null=True, on_delete=models.SET_NULL, related_name='order_rollups')
+    day = models.DateField()
+    # is_so or new_special_offer of order
+    is_so = models.BooleanField(default=False)
+    count_turnover = models.BooleanField(default=True)
+
+    quantity = models.BigIntegerField(default=0)
+    box = models.FloatField(default=0)
+    price = models.BigIntegerField(default=0)
+    point = models.FloatField(default=0)
+    cashback = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'day'], name='order_rollup_user_day_idx'),
+            models.Index(fields=['day', 'product'], name='order_rollup_day_product_idx'),
+        ]
+
+
 class OrderDelete(models.Model):
     order_id = models.CharField(max_length=255)
     date_get = models.DateField(null=True)
@@ -214,9 +246,8 @@ def create_or_get_sale_stats_user(user: User, month, breaking=False) -> SaleStat
 
         total_used = 0
         sale_target, _ = SaleTarget.objects.get_or_create(month=month)
-        for order in orders_so:
-            result = OrderDetail.objects.filter(order_id=order).aggregate(total_order_box=Sum('order_box'))
-            total_order_box = result.get('total_order_box', 0) or 0
+        for order in orders_so.select_related('new_special_offer'):
+            total_order_box = order.total_box or 0
             if order.new_special_offer:
                 target = order.new_special_offer.target if order.new_special_offer.target > 0 else sale_target.month_target
             else:
@@ -224,8 +255,7 @@ def create_or_get_sale_stats_user(user: User, month, breaking=False) -> SaleStat
             total_used += total_order_box * target
         sale_statistic: QuerySet = SaleStatistic.objects.filter(user=user, month=month)
 
-        total_turnover = OrderDetail.objects.filter(order_id__in=orders_count).aggregate(total_price=Sum('product_price'))[
-                             'total_price'] or 0
+        total_turnover = orders_count.aggregate(total_price=Sum('order_price'))['total_price'] or 0
 
         if orders_count.exists() and sale_statistic.exists():
             print(f"Case 1")
@@ -325,13 +355,10 @@ def update_season_stats_users(season_stats_user: SeasonalStatisticUser):
     orders = (Order.objects.filter(
         client_id=user, date_get__gte=season_stats.start_date, date_get__lte=season_stats.end_date)
               .exclude(status='deactivate'))
-    # Calculate total price and points from orders
-    order_details = OrderDetail.objects.filter(order_id__in=orders)
-
-    # Tính tổng giá trị và điểm từ chi tiết đơn hàng
-    totals = order_details.aggregate(
-        total_price=Sum('product_price'),
-        total_points=Sum('point_get')
+    # Tính tổng giá trị và điểm từ tổng đã lưu của đơn hàng
+    totals = orders.aggregate(
+        total_price=Sum('order_price'),
+        total_points=Sum('order_point')
     )
 
     total_price = totals.get('total_price', 0) or 0
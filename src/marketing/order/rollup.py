@@ -0,0 +1,111 @@
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from marketing.order.models import Order, OrderDetail, OrderRollup
+
+ROLLUP_FIELDS = ['quantity', 'box', 'price', 'point', 'cashback']
+# Float sums are compared with this tolerance
+TOLERANCE = 0.01
+
+
+def _rollup_select(where):
+    return f"""
+        SELECT o.client_id_id, o.npp_id, o.nvtt_id, d.product_id_id, o.date_get,
+               COALESCE(o.is_so, FALSE) OR o.new_special_offer_id IS NOT NULL, o.count_turnover,
+               COALESCE(SUM(d.order_quantity), 0), COALESCE(SUM(d.order_box), 0),
+               COALESCE(SUM(d.product_price), 0), COALESCE(SUM(d.point_get), 0),
+               COALESCE(SUM(d.price_so * d.order_box), 0)
+        FROM {Order._meta.db_table} o
+        JOIN {OrderDetail._meta.db_table} d ON d.order_id_id = o.id
+        WHERE o.client_id_id IS NOT NULL AND o.date_get IS NOT NULL AND {where}
+        GROUP BY 1, 2, 3, 4, 5, 6, 7
+    """
+
+
+def _insert_rollup(cursor, where, params):
+    cursor.execute(f"""
+        INSERT INTO {OrderRollup._meta.db_table} (user_id, npp_id, nvtt_id, product_id, day, is_so, count_turnover,
+                                                  quantity, box, price, point, cashback)
+        {_rollup_select(where)}
+    """, params)
+    return cursor.rowcount
+
+
+def _keys_params(keys):
+    keys = sorted({(user_id, day) for user_id, day in keys if user_id and day})
+    return [key[0] for key in keys], [key[1] for key in keys]
+
+
+def refresh_rollup(keys):
+    """ Rebuild rollup rows of each (user_id, day) in keys from its orders """
+    user_ids, days = _keys_params(keys)
+    if not user_ids:
+        return 0
+    key_filter = "(%s, %s) IN (SELECT * FROM unnest(%%s::varchar[], %%s::date[]))"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {OrderRollup._meta.db_table} WHERE {key_filter % ('user_id', 'day')}",
+                       (user_ids, days))
+        return _insert_rollup(cursor, key_filter % ('o.client_id_id', 'o.date_get'), (user_ids, days))
+
+
+def mark_rollup_dirty(keys):
+    """ Refresh rollup of (user_id, day) keys after commit, one statement pair for all keys of the transaction """
+    keys = {(user_id, day) for user_id, day in keys if user_id and day}
+    if keys:
+        transaction.on_commit(lambda: refresh_rollup(keys))
+
+
+def rebuild_rollup(date_from=None, date_to=None):
+    """ Rebuild rollup of days in [date_from, date_to], all days when not given """
+    date_from = date_from or '-infinity'
+    date_to = date_to or 'infinity'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {OrderRollup._meta.db_table} WHERE day BETWEEN %s::date AND %s::date",
+                       (date_from, date_to))
+        return _insert_rollup(cursor, 'o.date_get BETWEEN %s::date AND %s::date', (date_from, date_to))
+
+
+def find_rollup_drift(limit=1000):
+    """ (user_id, day) whose rollup sums differ from order details: [{'user_id', 'day', 'rollup', 'details'}] """
+    columns = ', '.join(ROLLUP_FIELDS)
+    sums = ', '.join(f'SUM({field}) AS {field}' for field in ROLLUP_FIELDS)
+    query = f"""
+        WITH details(user_id, npp_id, nvtt_id, product_id, day, is_so, count_turnover, {columns}) AS (
+            {_rollup_select('TRUE')}
+        )
+        SELECT COALESCE(e.user_id, s.user_id), COALESCE(e.day, s.day),
+               {', '.join(f's.{field}' for field in ROLLUP_FIELDS)},
+               {', '.join(f'e.{field}' for field in ROLLUP_FIELDS)}
+        FROM (SELECT user_id, day, {sums} FROM details GROUP BY user_id, day) e
+        FULL JOIN (SELECT user_id, day, {sums} FROM {OrderRollup._meta.db_table} GROUP BY user_id, day) s
+               ON s.user_id = e.user_id AND s.day = e.day
+        WHERE {' OR '.join(f'ABS(COALESCE(s.{field}, 0) - COALESCE(e.{field}, 0)) > {TOLERANCE}'
+                           for field in ROLLUP_FIELDS)}
+        ORDER BY 2, 1
+        LIMIT {int(limit)}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        rows = cursor.fetchall()
+    size = len(ROLLUP_FIELDS)
+    return [{'user_id': row[0], 'day': row[1], 'rollup': dict(zip(ROLLUP_FIELDS, row[2:2 + size])),
+             'details': dict(zip(ROLLUP_FIELDS, row[2 + size:]))} for row in rows]
+
+
+def product_statistics(user, date_from, date_to, product_ids=None, type_statistic='all'):
+    """ Sums per product of user orders with date_get in [date_from, date_to] """
+    rollups = OrderRollup.objects.filter(user=user, day__gte=date_from, day__lte=date_to)
+    if product_ids:
+        rollups = rollups.filter(product_id__in=product_ids)
+    match type_statistic:
+        case 'special_offer':
+            rollups = rollups.filter(is_so=True)
+        case 'normal':
+            rollups = rollups.filter(is_so=False)
+    return rollups.values('product_id', 'product__name').annotate(
+        total_quantity=Sum('quantity'),
+        total_point=Sum('point'),
+        total_price=Sum('price'),
+        total_box=Sum('box'),
+        total_cashback=Sum('cashback')
+    ).order_by('product_id')
@@ -37,9 +37,10 @@ def handle_user_perm_change(sender, instance: SeasonalStatistic, action, reverse
     UserJoinEvent.objects.filter(event__table_point=instance).exclude(user_id__in=user_ids).delete()
 
 
-from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_delete, post_delete
 from django.dispatch import receiver
 from .models import Order, OrderDetail, OrderDelete, OrderDetailDelete
+from .totals import detail_changed
 
 
 @receiver(pre_delete, sender=Order)
@@ -91,6 +92,12 @@ def backup_orderdetail(sender, instance: OrderDetail, **kwargs):
         detail_backup.save()
     except Exception as e:
         app_log.error(f"Error when backup order detail: {e}")
+
+
+@receiver([post_save, post_delete], sender=OrderDetail)
+def update_order_totals(sender, instance: OrderDetail, **kwargs):
+    # bulk_create/bulk_update không gọi signal, caller gọi refresh_order_totals
+    detail_changed(instance.order_id_id)
 # Connect the signal
 # pre_delete.connect(backup_order, sender=Order)
 
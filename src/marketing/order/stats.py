@@ -0,0 +1,194 @@
+from datetime import date
+
+import redis
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import Sum
+
+from account.models import User
+from app.logs import app_log
+from app.redis_db import redis_db, order_stats_dirty_key, order_stats_scheduled_key
+from marketing.order.models import Order, SeasonalStatisticUser, update_season_stats_users
+from marketing.order.tasks import recompute_dirty_order_stats
+from marketing.pick_number.models import UserJoinEvent
+from system_func.models import PeriodSeason, PointOfSeason
+
+# Wait for more orders of same user before recompute
+STATS_DELAY = 5
+# Schedule flag expires when worker is lost, next event schedules again
+SCHEDULE_TTL = 300
+POP_SIZE = 1000
+
+
+def update_point(user):
+    period = PeriodSeason.objects.filter(type='point', period='current').first()
+    point, _ = PointOfSeason.objects.get_or_create(user=user, period=period)
+    point.auto_point()
+    point.save()
+
+
+def update_season_stats_user(user: User, date_from, date_to=None):
+    """ Recompute point SeasonalStatisticUser of user which have any date in [date_from, date_to] """
+    date_to = date_to or date_from
+    season_stats_users = SeasonalStatisticUser.objects.filter(
+        user=user,
+        season_stats__type='point',
+        season_stats__start_date__lte=date_to,
+        season_stats__end_date__gte=date_from
+    ).select_related('season_stats', 'user')
+
+    update_stats_users = []
+    for stats_user in season_stats_users:
+        updated_stats_user = update_season_stats_users(stats_user)
+        update_stats_users.append(updated_stats_user)
+        UserJoinEvent.objects.filter(user=user, event__table_point=stats_user.season_stats).update(
+            turn_per_point=updated_stats_user.turn_per_point,
+            turn_pick=updated_stats_user.turn_pick,
+            total_point=updated_stats_user.total_point,
+        )
+
+    if update_stats_users:
+        SeasonalStatisticUser.objects.bulk_update(update_stats_users,
+                                                  ['turn_per_point', 'turn_pick', 'redundant_point', 'total_point'])
+
+
+def dirty_member(user_id, date_get):
+    return f"{user_id}|{date_get.replace(day=1).isoformat()}"
+
+
+def parse_dirty_member(member):
+    user_id, month = member.rsplit('|', 1)
+    return user_id, date.fromisoformat(month)
+
+
+def mark_stats_dirty(user_id, date_get):
+    """
+    Point and season stats of user are outdated by an order of date_get.
+    Emitted after commit, a worker recomputes each (user, month) once however many orders changed.
+    """
+    if not user_id or not date_get:
+        return
+    member = dirty_member(user_id, date_get)
+    transaction.on_commit(lambda: push_dirty(member))
+
+
+def push_dirty(member):
+    try:
+        redis_db.sadd(order_stats_dirty_key(), member)
+        if redis_db.set(order_stats_scheduled_key(), 1, nx=True, ex=SCHEDULE_TTL):
+            recompute_dirty_order_stats.apply_async(countdown=STATS_DELAY)
+        return
+    except redis.RedisError as e:
+        app_log.error(f"Error mark order stats dirty {member}: {e}")
+    except Exception as e:
+        # Broker is not available, let next event schedule again
+        app_log.error(f"Error schedule order stats {member}: {e}")
+        try:
+            redis_db.delete(order_stats_scheduled_key())
+        except redis.RedisError:
+            pass
+    # Queue is not available, recompute now so stats are not lost
+    recompute_stats({parse_dirty_member(member)})
+
+
+def pop_dirty_stats() -> set:
+    members = set()
+    while True:
+        batch = redis_db.spop(order_stats_dirty_key(), POP_SIZE)
+        if not batch:
+            break
+        members.update(batch)
+    return members
+
+
+def process_dirty_stats():
+    """ Worker: take all dirty (user, month) and recompute, put back when failed """
+    # Remove flag first so events after this point schedule a new run
+    redis_db.delete(order_stats_scheduled_key())
+    members = pop_dirty_stats()
+    if not members:
+        return 0
+    try:
+        recompute_stats({parse_dirty_member(member) for member in members})
+    except Exception as e:
+        app_log.error(f"Error recompute order stats, put back {len(members)} items: {e}")
+        redis_db.sadd(order_stats_dirty_key(), *members)
+        raise e
+    return len(members)
+
+
+def recompute_stats(items: set):
+    """ items: {(user_id, month)}, season point once per user and season stats once per month """
+    user_ids = {user_id for user_id, _ in items}
+    update_points(user_ids)
+    users = User.objects.in_bulk(list(user_ids))
+    for user_id, month in sorted(items):
+        if user_id in users:
+            update_season_stats_user(users[user_id], month, month + relativedelta(months=1, days=-1))
+    app_log.info(f"Recompute order stats: {len(user_ids)} users, {len(items)} months")
+
+
+def period_points(period, user_ids=None) -> dict:
+    """ {user_id: total point of active orders in period} in one query, same as PointOfSeason.auto_point """
+    orders = Order.objects.filter(date_get__range=(period.from_date, period.to_date)).exclude(status='deactivate')
+    if user_ids is not None:
+        orders = orders.filter(client_id__in=list(user_ids))
+    rows = orders.values('client_id').annotate(total_point=Sum('order_point')).order_by()
+    return {row['client_id']: row['total_point'] or 0 for row in rows}
+
+
+def update_points(user_ids):
+    period = PeriodSeason.objects.filter(type='point', period='current').first()
+    if period is None or not user_ids:
+        return
+    points = period_points(period, user_ids)
+    existed = {point.user_id: point for point in PointOfSeason.objects.filter(period=period, user_id__in=user_ids)}
+    new_points = list()
+    for user_id in user_ids:
+        total_point = points.get(user_id, 0)
+        point = existed.get(user_id)
+        if point is None:
+            new_points.append(PointOfSeason(user_id=user_id, period=period, point=total_point, total_point=total_point))
+        else:
+            point.point = total_point
+            point.total_point = total_point
+    PointOfSeason.objects.bulk_update(list(existed.values()), ['point', 'total_point'])
+    PointOfSeason.objects.bulk_create(new_points)
+
+
+def find_stale_stats(tolerance=0.001):
+    """
+    Consistency check: users whose stored point or season total point differs from their orders.
+    Users still waiting in dirty queue are reported as pending, not stale.
+    """
+    try:
+        pending = {parse_dirty_member(member)[0] for member in redis_db.smembers(order_stats_dirty_key())}
+    except redis.RedisError as e:
+        app_log.error(f"Error read order stats queue: {e}")
+        pending = set()
+
+    stale_points = list()
+    period = PeriodSeason.objects.filter(type='point', period='current').first()
+    if period is not None:
+        points = period_points(period)
+        stored = dict(PointOfSeason.objects.filter(period=period, user_id__isnull=False)
+                      .values_list('user_id', 'point'))
+        for user_id in (points.keys() | stored.keys()) - pending:
+            if abs((points.get(user_id) or 0) - (stored.get(user_id) or 0)) > tolerance:
+                stale_points.append({'user': user_id, 'stored': stored.get(user_id), 'orders': points.get(user_id)})
+
+    stale_seasons = list()
+    stats_users = (SeasonalStatisticUser.objects.filter(season_stats__type='point').exclude(user_id__in=pending)
+                   .values_list('season_stats_id', 'season_stats__start_date', 'season_stats__end_date',
+                                'user_id', 'total_point'))
+    seasons = dict()
+    for season_id, start_date, end_date, user_id, total_point in stats_users:
+        seasons.setdefault((season_id, start_date, end_date), dict())[user_id] = total_point or 0
+    for (season_id, start_date, end_date), stored in seasons.items():
+        season_period = PeriodSeason(from_date=start_date, to_date=end_date)
+        points = period_points(season_period, stored.keys())
+        for user_id, total_point in stored.items():
+            if abs(round(points.get(user_id, 0), 5) - total_point) > tolerance:
+                stale_seasons.append({'season': season_id, 'start_date': start_date, 'user': user_id,
+                                      'stored': total_point, 'orders': points.get(user_id, 0)})
+    return {'pending': len(pending), 'point': stale_points, 'season': stale_seasons}
@@ -24,3 +24,15 @@ def send_report_email(nvtt_email, encoded_output_content, file_name):
         return 'Email sent successfully'
     except Exception as e:
         return str(e)
+
+
+@shared_task
+def recompute_dirty_order_stats():
+    from marketing.order.stats import process_dirty_stats
+    return process_dirty_stats()
+
+
+@shared_task
+def import_orders_task(job_id, encoded_file):
+    from marketing.order.import_orders import run_import_job
+    return run_import_job(job_id, base64.b64decode(encoded_file))
@@ -0,0 +1,105 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import connection
+
+from marketing.order.models import Order, OrderDetail
+
+TOTAL_FIELDS = ['order_point', 'order_price', 'total_box', 'total_quantity']
+# Float totals are compared with this tolerance
+TOLERANCE = 0.001
+
+_deferred = threading.local()
+
+
+def _totals_query(where):
+    order_table = Order._meta.db_table
+    detail_table = OrderDetail._meta.db_table
+    return f"""
+        SELECT o.id,
+               COALESCE(ROUND(SUM(d.point_get)::numeric, 5), 0) AS order_point,
+               COALESCE(SUM(d.product_price), 0) AS order_price,
+               COALESCE(ROUND(SUM(d.order_box)::numeric, 5), 0) AS total_box,
+               COALESCE(SUM(d.order_quantity), 0) AS total_quantity
+        FROM {order_table} o
+        LEFT JOIN {detail_table} d ON d.order_id_id = o.id
+        WHERE {where}
+        GROUP BY o.id
+    """
+
+
+def order_detail_totals(details) -> dict:
+    """ Stored order totals of bulk created details, same as refresh_order_totals """
+    return {
+        # Line prices are rounded to the BigInteger column when lines are built, round() keeps same values
+        'order_price': sum(round(detail.product_price) for detail in details if detail.product_price is not None),
+        'order_point': round(sum(detail.point_get for detail in details if detail.point_get is not None), 5),
+        'total_box': round(sum(detail.order_box for detail in details if detail.order_box is not None), 5),
+        'total_quantity': sum(detail.order_quantity for detail in details if detail.order_quantity is not None),
+    }
+
+
+def refresh_order_totals(order_ids):
+    """ Recompute order_point, order_price, total_box, total_quantity of orders from details in one UPDATE """
+    order_ids = [order_id for order_id in set(order_ids) if order_id]
+    if not order_ids:
+        return 0
+    query = f"""
+        UPDATE {Order._meta.db_table} o
+        SET order_point = totals.order_point,
+            order_price = totals.order_price,
+            total_box = totals.total_box,
+            total_quantity = totals.total_quantity
+        FROM ({_totals_query('o.id = ANY(%s)')}) totals
+        WHERE o.id = totals.id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query, (order_ids,))
+        return cursor.rowcount
+
+
+def detail_changed(order_id):
+    """ OrderDetail row saved or deleted: refresh its order now, or when deferred_totals block ends """
+    order_ids = getattr(_deferred, 'order_ids', None)
+    if order_ids is not None:
+        order_ids.add(order_id)
+    else:
+        refresh_order_totals([order_id])
+
+
+@contextmanager
+def deferred_totals():
+    """ Orders of details saved or deleted in this block are refreshed once at its end, not once per row """
+    if getattr(_deferred, 'order_ids', None) is not None:
+        # Nested block, outer one refreshes
+        yield
+        return
+    _deferred.order_ids = set()
+    try:
+        yield
+    finally:
+        order_ids, _deferred.order_ids = _deferred.order_ids, None
+    refresh_order_totals(order_ids)
+
+
+def find_total_drift(order_ids=None, limit=1000):
+    """ Orders whose stored totals differ from their details: [{'id', 'stored', 'details'}] """
+    where = 'o.id = ANY(%s)' if order_ids is not None else 'TRUE'
+    params = (list(order_ids),) if order_ids is not None else ()
+    query = f"""
+        SELECT o.id, o.order_point, o.order_price, o.total_box, o.total_quantity,
+               t.order_point, t.order_price, t.total_box, t.total_quantity
+        FROM {Order._meta.db_table} o
+        JOIN ({_totals_query(where)}) t ON t.id = o.id
+        WHERE ABS(COALESCE(o.order_point, 0) - t.order_point) > {TOLERANCE}
+           OR ABS(COALESCE(o.order_price, 0) - t.order_price) > {TOLERANCE}
+           OR ABS(o.total_box - t.total_box) > {TOLERANCE}
+           OR o.total_quantity <> t.total_quantity
+        ORDER BY o.id
+        LIMIT {int(limit)}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    return [{'id': row[0], 'stored': dict(zip(TOTAL_FIELDS, row[1:5])), 'details': dict(zip(TOTAL_FIELDS, row[5:9]))}
+            for row in rows]
@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 
 from marketing.pick_number.api.views import ApiEventNumber, ApiUserJoinEvent, ApiNumberList, ApiPickNumber, \
     ApiAwardNumber, ApiPrizeEvent, ApiPickNumberLog, ApiUserAward, ApiExportEventNumber, ApiExportEventNumberUser, \
-    ApiUserNumberPdf, ApiUserNumberPdf2, RandomNumber, ApiAutoPick
+    ApiUserNumberPdf, ApiUserNumberPdf2, RandomNumber, ApiAutoPick, ApiEventCertificates
 from utils.constants import actions_views, actions_detail
 
 app_name = "api_pick_number"
@@ -60,4 +60,5 @@ urlpatterns = [
 
     path('user-info/<pk>/view-number/', ApiUserNumberPdf.as_view()),
     path('user-info/<pk>/view-number2/', ApiUserNumberPdf2.as_view()),
+    path('<pk>/certificates/', ApiEventCertificates.as_view()),
 ]
@@ -1,18 +1,14 @@
 import os
-import random
 import sys
-import tempfile
 import traceback
 from functools import partial
-from io import BytesIO
 from types import SimpleNamespace
 
 import pandas as pd
 from django.conf import settings
 from django.db import transaction
-from django.db.models import QuerySet, F
-from django.http import HttpResponse
-from django.template.loader import render_to_string
+from django.db.models import QuerySet
+from django.http import FileResponse
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, Border, Side
 from openpyxl.utils.dataframe import dataframe_to_rows
@@ -20,8 +16,7 @@ from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from weasyprint import HTML
+from account.authentication import JWTAuthentication
 
 from account.handlers.perms import perm_queryset
 from account.handlers.validate_perm import ValidatePermRest
@@ -30,8 +25,11 @@ from app.logs import app_log
 from marketing.pick_number.api.serializers import UserJoinEventSerializer, EventNumberSerializer, NumberListSerializer, \
     UserJoinEventNumberSerializer, PrizeEventSerializer, PickNumberLogSerializer, \
     AwardUserSerializer
+from marketing.pick_number.certificates import ensure_certificate, selected_numbers, certificate_filename
 from marketing.pick_number.models import UserJoinEvent, EventNumber, NumberList, PrizeEvent, AwardNumber, PickNumberLog, \
     NumberSelected
+from marketing.pick_number.pool import draw_numbers, auto_pick
+from system_func.api.views import report_job_response
 from user_system.employee_profile.models import EmployeeProfile
 from utils.model_filter_paginate import filter_data
 
@@ -254,173 +252,158 @@ class ApiPickNumberLog(viewsets.GenericViewSet, mixins.ListModelMixin):
 class ApiExportEventNumber(APIView):
     def get(self, request, *args, **kwargs):
         event_id = self.kwargs.get('pk')
-        event = EventNumber.objects.filter(id=event_id).select_related('table_point').first()
-        if event is None:
+        if not EventNumber.objects.filter(id=event_id).exists():
             return Response({'message': 'Event ID is required'}, status=400)
-
-        # Tạo workbook và các sheet
-        wb = Workbook()
-        ws1 = wb.active
-        ws1.title = "Báo cáo sự kiện"
-        ws2 = wb.create_sheet(title="Danh sách số")
-
-        # Xử lý và ghi dữ liệu vào sheet 1
-        self.process_event_data(event, ws1)
-
-        # Xử lý và ghi dữ liệu vào sheet 2
-        number_lists = event.number_list.all().order_by('number')
-        data = [
-            {'Tem số': nl.number, 'Tem dư': nl.repeat_count} for nl in number_lists
-        ]
-        df = pd.DataFrame(data)
-        for r in dataframe_to_rows(df, index=False, header=True):
-            ws2.append(r)
-
-        # Lưu workbook vào BytesIO stream và trả về response
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-        response = HttpResponse(
-            output,
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename="report_{event_id}.xlsx"'
-
-        return response
-
-    def process_event_data(self, event, ws):
-        # Định nghĩa font và border
-        header_font = Font(size=13, bold=True)
-        center_alignment = Alignment(horizontal="center", vertical="center")
-        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
-                             top=Side(style='thin'), bottom=Side(style='thin'))
-
-        # Tạo header
-        headers = ["Mã KH", "Số đã chọn"]
-        ws.append(headers)
-
-        # Định dạng header
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num)
-            cell.font = header_font
-            cell.alignment = center_alignment
-            cell.border = thin_border
-        ws.column_dimensions['B'].width = 13
-        # Thêm dữ liệu
-        users_join_event = UserJoinEvent.objects.filter(event=event).select_related('user').prefetch_related(
-            'number_selected__number')
-
-        for user_join_event in users_join_event:
-            user = user_join_event.user
-            selected_numbers = user_join_event.number_selected.all().order_by('created_at')
-            for number_selected in selected_numbers:
-                ws.append([user.id, number_selected.number.number])
+        return report_job_response(request, 'event_numbers', {'pk': event_id})
+
+
+def export_event_number_file(params, output):
+    event_id = params['pk']
+    event = EventNumber.objects.filter(id=event_id).select_related('table_point').get()
+
+    # Tạo workbook và các sheet
+    wb = Workbook()
+    ws1 = wb.active
+    ws1.title = "Báo cáo sự kiện"
+    ws2 = wb.create_sheet(title="Danh sách số")
+
+    # Xử lý và ghi dữ liệu vào sheet 1
+    process_event_data(event, ws1)
+
+    # Xử lý và ghi dữ liệu vào sheet 2
+    number_lists = event.number_list.all().order_by('number')
+    data = [
+        {'Tem số': nl.number, 'Tem dư': nl.repeat_count} for nl in number_lists
+    ]
+    df = pd.DataFrame(data, columns=['Tem số', 'Tem dư'])
+    for r in dataframe_to_rows(df, index=False, header=True):
+        ws2.append(r)
+
+    wb.save(output)
+    return f"report_{event_id}.xlsx"
+
+
+def process_event_data(event, ws):
+    # Định nghĩa font và border
+    header_font = Font(size=13, bold=True)
+    center_alignment = Alignment(horizontal="center", vertical="center")
+    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
+                         top=Side(style='thin'), bottom=Side(style='thin'))
+
+    # Tạo header
+    headers = ["Mã KH", "Số đã chọn"]
+    ws.append(headers)
+
+    # Định dạng header
+    for col_num, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col_num)
+        cell.font = header_font
+        cell.alignment = center_alignment
+        cell.border = thin_border
+    ws.column_dimensions['B'].width = 13
+    # Thêm dữ liệu
+    selected_numbers = NumberSelected.objects.filter(user_event__event=event).select_related(
+        'user_event', 'number').order_by('user_event_id', 'created_at')
+    for number_selected in selected_numbers:
+        ws.append([number_selected.user_event.user_id, number_selected.number.number])
 
 
 class ApiExportEventNumberUser(APIView):
     def get(self, request, *args, **kwargs):
         event_id = self.kwargs.get('pk')
-        event = EventNumber.objects.filter(id=event_id).select_related('table_point').first()
-        if event is None:
+        if not EventNumber.objects.filter(id=event_id).exists():
             return Response({'message': 'event id is required'}, status=400)
-
-        # Tạo workbook và worksheet
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Báo cáo sự kiện"
-
-        # Định nghĩa font và border
-        title_font = Font(size=12, bold=True, underline="single")
-        header_font = Font(size=14, bold=True)
-        data_font = Font(size=12)
-        center_alignment = Alignment(horizontal="center", vertical="center")
-        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
-                             top=Side(style='thin'), bottom=Side(style='thin'))
-
-        # Tạo tiêu đề cho báo cáo
-        ws.merge_cells('A1:F1')
-        title_cell = ws['A1']
-        title_cell.value = f"Báo cáo sự kiện {event.name}"
-        title_cell.font = title_font
-        # title_cell.alignment = center_alignment
-
-        ws.append([])  # Thêm dòng trống
-
-        # Tạo header
-        headers = ["Mã KH", "Tên KH",
-                   "Mã NVTT", "Tên NVTT",
-                   "Tổng tem đạt", "Tem chưa chọn", "Số đã chọn"]
-        ws.append(headers)
-
-        # Định dạng header
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=3, column=col_num)
-            cell.font = header_font
-            cell.alignment = center_alignment
-            cell.border = thin_border
-
-        ws.column_dimensions['A'].width = 12.73  # Đặt độ rộng cột "Mã KH"
-        ws.column_dimensions['B'].width = 20
-
-        ws.column_dimensions['C'].width = 12.73
-        ws.column_dimensions['D'].width = 20
-        ws.column_dimensions['E'].width = 12.73
-        ws.column_dimensions['F'].width = 12.73
-        ws.column_dimensions['G'].width = 32
-
-        # Lấy danh sách user_join_event với prefetch_related cho NumberSelected
-        users_join_event = UserJoinEvent.objects.filter(event=event).select_related('user').prefetch_related(
-            'number_selected__number')
-        nvtt_ids = {user_join_event.user.clientprofile.nvtt_id for user_join_event in users_join_event}
-
-        nvtt_profiles = EmployeeProfile.objects.filter(employee_id__in=nvtt_ids).values_list('employee_id_id', 'register_name').distinct()
-        nvtt_profiles = dict(nvtt_profiles)
-        row_num = 4  # Bắt đầu từ hàng thứ 4 do tiêu đề và header đã chiếm 3 hàng
-        for user_join_event in users_join_event:
-            user = user_join_event.user
-            # print(f"Test: {nvtt_profiles[user.clientprofile.nvtt_id]}")
-            selected_numbers: QuerySet = user_join_event.number_selected.all().order_by('created_at')
-            turn_pick = user_join_event.turn_pick or 0
-            turn_not_pick = turn_pick - selected_numbers.count()
-
-            try:
-                register_name = user.clientprofile.register_name
-            except AttributeError:
-                register_name = ''
-
-            picked_numbers = selected_numbers.values_list('number__number', flat=True).distinct()
-            split_numbers = ",".join(map(str, list(picked_numbers)))
-            try:
-                nvtt_name = nvtt_profiles[user.clientprofile.nvtt_id]
-            except Exception:
-                nvtt_name = ''
-            export_data = [user.id, register_name, user.clientprofile.nvtt_id,
-                           nvtt_name, turn_pick, turn_not_pick, split_numbers]
-            self._write_to_sheet(ws, row_num, export_data, data_font, center_alignment, thin_border)
-            row_num += 1
-
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-
-        # Tạo HttpResponse để trả về file Excel
-        response = HttpResponse(
-            output,
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename=Bao_cao_su_kien_{event_id}.xlsx'
-
-        return response
-
-    def _write_to_sheet(self, worksheet, row_num, data, font, alignment, border):
-        """Helper function to write a row of data to the worksheet with formatting."""
-        for col_num, value in enumerate(data, 1):
-            cell = worksheet.cell(row=row_num, column=col_num)
-            cell.value = value
-            cell.font = font
-            if col_num == 2:  # Căn giữa cột "Số đã chọn"
-                cell.alignment = alignment
-            cell.border = border
+        return report_job_response(request, 'event_number_users', {'pk': event_id})
+
+
+def export_event_number_user_file(params, output):
+    event_id = params['pk']
+    event = EventNumber.objects.filter(id=event_id).select_related('table_point').get()
+
+    # Tạo workbook và worksheet
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Báo cáo sự kiện"
+
+    # Định nghĩa font và border
+    title_font = Font(size=12, bold=True, underline="single")
+    header_font = Font(size=14, bold=True)
+    data_font = Font(size=12)
+    center_alignment = Alignment(horizontal="center", vertical="center")
+    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
+                         top=Side(style='thin'), bottom=Side(style='thin'))
+
+    # Tạo tiêu đề cho báo cáo
+    ws.merge_cells('A1:F1')
+    title_cell = ws['A1']
+    title_cell.value = f"Báo cáo sự kiện {event.name}"
+    title_cell.font = title_font
+
+    ws.append([])  # Thêm dòng trống
+
+    # Tạo header
+    headers = ["Mã KH", "Tên KH",
+               "Mã NVTT", "Tên NVTT",
+               "Tổng tem đạt", "Tem chưa chọn", "Số đã chọn"]
+    ws.append(headers)
+
+    # Định dạng header
+    for col_num, header in enumerate(headers, 1):
+        cell = ws.cell(row=3, column=col_num)
+        cell.font = header_font
+        cell.alignment = center_alignment
+        cell.border = thin_border
+
+    ws.column_dimensions['A'].width = 12.73  # Đặt độ rộng cột "Mã KH"
+    ws.column_dimensions['B'].width = 20
+
+    ws.column_dimensions['C'].width = 12.73
+    ws.column_dimensions['D'].width = 20
+    ws.column_dimensions['E'].width = 12.73
+    ws.column_dimensions['F'].width = 12.73
+    ws.column_dimensions['G'].width = 32
+
+    # Lấy danh sách user_join_event với prefetch_related cho NumberSelected
+    users_join_event = UserJoinEvent.objects.filter(event=event).select_related(
+        'user', 'user__clientprofile').prefetch_related('number_selected__number')
+    nvtt_ids = {getattr(getattr(user_join_event.user, 'clientprofile', None), 'nvtt_id', None)
+                for user_join_event in users_join_event}
+
+    nvtt_profiles = EmployeeProfile.objects.filter(employee_id__in=nvtt_ids).values_list('employee_id_id', 'register_name').distinct()
+    nvtt_profiles = dict(nvtt_profiles)
+    row_num = 4  # Bắt đầu từ hàng thứ 4 do tiêu đề và header đã chiếm 3 hàng
+    for user_join_event in users_join_event:
+        user = user_join_event.user
+        # Số đã chọn từ prefetch, theo thứ tự chọn
+        selected_numbers = sorted(user_join_event.number_selected.all(), key=lambda selected: selected.created_at)
+        turn_pick = user_join_event.turn_pick or 0
+        turn_not_pick = turn_pick - len(selected_numbers)
+
+        client_profile = getattr(user, 'clientprofile', None)
+        register_name = client_profile.register_name if client_profile else ''
+        nvtt_id = client_profile.nvtt_id if client_profile else None
+
+        picked_numbers = list(dict.fromkeys(selected.number.number for selected in selected_numbers))
+        split_numbers = ",".join(map(str, picked_numbers))
+        nvtt_name = nvtt_profiles.get(nvtt_id, '')
+        export_data = [user.id, register_name, nvtt_id,
+                       nvtt_name, turn_pick, turn_not_pick, split_numbers]
+        _write_to_sheet(ws, row_num, export_data, data_font, center_alignment, thin_border)
+        row_num += 1
+
+    wb.save(output)
+    return f"Bao_cao_su_kien_{event_id}.xlsx"
+
+
+def _write_to_sheet(worksheet, row_num, data, font, alignment, border):
+    """Helper function to write a row of data to the worksheet with formatting."""
+    for col_num, value in enumerate(data, 1):
+        cell = worksheet.cell(row=row_num, column=col_num)
+        cell.value = value
+        cell.font = font
+        if col_num == 2:  # Căn giữa cột "Số đã chọn"
+            cell.alignment = alignment
+        cell.border = border
 
 
 class ApiUserAward(viewsets.GenericViewSet, mixins.ListModelMixin):
@@ -444,110 +427,46 @@ class ApiUserAward(viewsets.GenericViewSet, mixins.ListModelMixin):
 
 
 
-class ApiUserNumberPdf2(APIView):
-    def get(self, request, pk):
-        try:
-            # Lấy thông tin người dùng và sự kiện dựa trên primary key
-            user_event = UserJoinEvent.objects.select_related('user__clientprofile', 'event').get(pk=pk)
-            event = user_event.event
-
-            # Lấy danh sách các số đã chọn
-            numbers_selected = NumberSelected.objects.filter(user_event=user_event).order_by(
-                'number__number').values_list('number__number', flat=True)
-            if user_event.turn_pick is None:
-                user_event.turn_pick = 0
-            if user_event.turn_per_point is None:
-                user_event.turn_per_point = 0
-            point_redundant = user_event.total_point - (user_event.turn_pick * user_event.turn_per_point)
-            if point_redundant < 0:
-                point_redundant = 0
-            turn_not_pick = user_event.turn_pick - user_event.turn_selected
-            print(f"Test turn not pick: {turn_not_pick}")
-            # Tạo context để render template
-            context = {
-                'data': {
-                    'event_name': event.name,
-                    'username': user_event.user.clientprofile.register_name,
-                    'usercode': user_event.user.id,
-                    'turn_roll': user_event.turn_pick,
-                    'turn_chosen': user_event.turn_selected,
-                    'turn_not_pick': turn_not_pick,
-                    'total_point': user_event.total_point,
-                    'user_point': point_redundant,  # Giả sử 'total_point' là 'user_point'
-                    'number_rolled_str': ', '.join(map(str, numbers_selected)),
-                },
-                'number_rolled': numbers_selected,
-            }
-
-            # Render template HTML thành chuỗi
-            html_string = render_to_string('pdfs/user_numbers.html', context)
+def certificate_response(pk):
+    """ Stored certificate of user event, rendered here only when worker has not done it yet """
+    try:
+        user_event = UserJoinEvent.objects.select_related('user__clientprofile', 'event').get(pk=pk)
+    except UserJoinEvent.DoesNotExist:
+        return Response({'error': 'UserJoinEvent not found'}, status=status.HTTP_404_NOT_FOUND)
+    numbers_selected = selected_numbers([user_event.id])[user_event.id]
+    path = os.path.join(settings.MEDIA_ROOT, ensure_certificate(user_event, numbers_selected))
+    try:
+        pdf_file = open(path, 'rb')
+    except FileNotFoundError:
+        # Replaced by newer version meanwhile
+        user_event.refresh_from_db()
+        numbers_selected = selected_numbers([user_event.id])[user_event.id]
+        pdf_file = open(os.path.join(settings.MEDIA_ROOT, ensure_certificate(user_event, numbers_selected)), 'rb')
+    return FileResponse(pdf_file, as_attachment=True, filename=certificate_filename(user_event),
+                        content_type='application/pdf')
 
-            # Tạo một tệp PDF tạm thời
-            with tempfile.NamedTemporaryFile(delete=True) as output:
-                HTML(string=html_string).write_pdf(output.name)
-                # Đọc PDF
-                output.seek(0)
-                pdf = output.read()
 
-            # Thiết lập HttpResponse
-            response = HttpResponse(pdf, content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="{user_event.user.username}_number.pdf"'
-            return response
-        except UserJoinEvent.DoesNotExist:
-            return Response({'error': 'UserJoinEvent not found'}, status=status.HTTP_404_NOT_FOUND)
+class ApiUserNumberPdf2(APIView):
+    def get(self, request, pk):
+        return certificate_response(pk)
 
 
 class ApiUserNumberPdf(APIView):
     def get(self, request, pk):
-        try:
-            # Lấy thông tin người dùng và sự kiện dựa trên primary key
-            user_event = UserJoinEvent.objects.select_related('user__clientprofile', 'event').get(pk=pk)
-            event = user_event.event
-
-            # Lấy danh sách các số đã chọn
-            numbers_selected = NumberSelected.objects.filter(user_event=user_event).order_by(
-                'number__number').values_list('number__number', flat=True)
-            if user_event.turn_pick is None:
-                user_event.turn_pick = 0
-            if user_event.turn_per_point is None:
-                user_event.turn_per_point = 0
-
-            point_redundant = user_event.total_point - (user_event.turn_pick * user_event.turn_per_point)
-            if point_redundant < 0:
-                point_redundant = 0
-            turn_not_pick = user_event.turn_pick - user_event.turn_selected
-            print(f"Test turn not pick: {turn_not_pick}")
-            # Tạo context để render template
-            context = {
-                'request': request,
-                'data': {
-                    'event_name': event.name,
-                    'username': user_event.user.clientprofile.register_name,
-                    'usercode': user_event.user.id,
-                    'turn_roll': user_event.turn_pick,
-                    'turn_chosen': user_event.turn_selected,
-                    'turn_not_pick': turn_not_pick,
-                    'total_point': user_event.total_point,
-                    'user_point': point_redundant,  # Giả sử 'total_point' là 'user_point'
-                    'number_rolled_str': ', '.join(map(str, numbers_selected)),
-                },
-                'number_rolled': numbers_selected,
-            }
+        return certificate_response(pk)
 
-            # Render template HTML thành chuỗi
-            html_string = render_to_string('pdfs/user_numbers.html', context)
 
-            # Sử dụng BytesIO để tạo PDF
-            pdf_file = BytesIO()
-            HTML(string=html_string).write_pdf(pdf_file)
-            pdf_file.seek(0)  # Quay về đầu file để chuẩn bị gửi dữ liệu
+class ApiEventCertificates(APIView):
+    authentication_classes = [JWTAuthentication, BasicAuthentication, SessionAuthentication]
+    permission_classes = [partial(ValidatePermRest, model=EventNumber)]
 
-            # Thiết lập HttpResponse
-            response = HttpResponse(pdf_file.getvalue(), content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="{user_event.user.username}_number.pdf"'
-            return response
-        except UserJoinEvent.DoesNotExist:
-            return Response({'error': 'UserJoinEvent not found'}, status=status.HTTP_404_NOT_FOUND)
+    def get(self, request, pk):
+        event = EventNumber.objects.filter(id=pk).first()
+        if not event:
+            return Response({'message': f"không tìm thấy sự kiện quay số {pk}"}, 404)
+        # Perm of this event when it exists, rendering a whole event is heavy
+        self.check_object_permissions(request, event)
+        return report_job_response(request, 'event_certificates', {'pk': pk})
 
 
 class RandomNumber(APIView):
@@ -560,8 +479,7 @@ class RandomNumber(APIView):
                 random_times = int(random_times)
             except TypeError:
                 return Response({'message': 'random_times phải là một số integer'}, 400)
-            rand_nums, rand_nums_obj = get_random_numbers(user_event, random_times)
-            handle_selecting(user_event, rand_nums_obj)
+            rand_nums = draw_numbers(user_event, random_times)
             selected_numbers: QuerySet[NumberSelected] = user_event.number_selected.filter().values_list(
                 'number__number', flat=True)
             response = {
@@ -584,89 +502,7 @@ class ApiAutoPick(APIView):
             add_more_number = request.data.get('add_more_number', False)
             if not event:
                 return Response({'message': f'not found {pk}'}, 404)
-            users_event = event.user_join_event.annotate(
-                turns_left=F('turn_pick') - F('turn_selected')
-            ).filter(turns_left__gt=0)
-            for user_event in users_event:
-                random_times = user_event.turn_pick - user_event.turn_selected
-                rand_nums, rand_nums_obj = get_random_numbers(user_event, random_times)
-                first_loop = True
-                while add_more_number and len(rand_nums) < random_times and len(rand_nums_obj) < random_times:
-                    if first_loop:
-                        event.range_number += round((random_times - len(rand_nums_obj)) * 0.9)
-                    else:
-                        event.range_number += 1
-                    event.save()
-                    rand_nums, rand_nums_obj = get_random_numbers(user_event, random_times)
-                    if len(rand_nums) >= random_times and len(rand_nums_obj) >= random_times:
-                        break
-                handle_selecting(user_event, rand_nums_obj)
-
-            return Response({'message': 'success'})
+            result = auto_pick(event, add_more_number)
+            return Response({'message': 'success', **result})
         except Exception as e:
             raise e
-
-
-def handle_selecting(user_event, rand_nums_obj):
-    try:
-        with transaction.atomic():
-            numbers_selected = list()
-            saved_logs = list()
-            for rand_num_obj in rand_nums_obj:
-
-                while rand_num_obj.repeat_count <= 0:
-                    rand_nums, rand_num_obj = get_random_numbers(user_event, 1)
-                    if rand_num_obj.repeat_count > 0:
-                        break
-                new_added = NumberSelected(user_event=user_event, number=rand_num_obj)
-                add_log = PickNumberLog(event=user_event.event, user=user_event.user, number=rand_num_obj.number,
-                                        action='random')
-                saved_logs.append(add_log)
-                numbers_selected.append(new_added)
-                rand_num_obj.repeat_count -= 1
-                rand_num_obj.save()
-            NumberSelected.objects.bulk_create(numbers_selected)
-            PickNumberLog.objects.bulk_create(saved_logs)
-            selected_numbers = user_event.number_selected.filter().values_list(
-                'number__number', flat=True).count()
-            print(f"Test: {user_event}")
-            # user_event = user_event.first()
-            user_event.turn_selected = selected_numbers
-            user_event.save()
-    except Exception as e:
-        raise e
-
-
-def get_random_numbers(user_event: UserJoinEvent, random_times: int = 1):
-    event = user_event.event
-    selected_number = NumberSelected.objects.filter(user_event=user_event).values_list('number__number', flat=True)
-    available_number = event.number_list.filter(repeat_count__gt=0).exclude(number__in=selected_number).values_list(
-        'number', flat=True).distinct()
-    available_number = list(set(available_number))
-    if len(available_number) == 0:
-        return [], []
-    if random_times > len(available_number):
-        random_times = len(available_number)
-    random_elements = random.sample(available_number, random_times)
-
-    valid_numbers = []
-    for num in random_elements:
-        if event.number_list.filter(number=num, repeat_count__gt=0).exists():
-            valid_numbers.append(num)
-
-    while len(valid_numbers) < random_times:
-        remaining_count = random_times - len(valid_numbers)
-        available_number = event.number_list.filter(repeat_count__gt=0).exclude(number__int=selected_number).exclude(
-            number__in=valid_numbers).values_list(
-            'number', flat=True).distinct()
-        available_number = list(set(available_number))
-        if not available_number:
-            break
-        if remaining_count > len(available_number):
-            remaining_count = len(available_number)
-        number_list = random.sample(available_number, remaining_count)
-        for num in number_list:
-            if event.number_list.filter(number=num, repeat_count__gt=0).exists():
-                valid_numbers.append(num)
-    number_objs = event.number_list.filter(number__in=valid_numbers)
-    return valid_numbers, number_objs
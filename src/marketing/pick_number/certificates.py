@@ -0,0 +1,140 @@
+"""
+Number certificates (pdfs/user_numbers.html) of user events, rendered once per content and kept under
+MEDIA_ROOT/certificates/<event_id>/<user_event_id>/<version>.pdf.
+version is a hash of everything printed, so a file is valid until selections (or points/turns) change.
+Selections changes schedule rendering on the Celery workers after commit, views serve the stored file.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import zipfile
+
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import render_to_string
+
+from app.logs import app_log
+from marketing.pick_number.models import UserJoinEvent, NumberSelected
+from marketing.pick_number.tasks import render_certificates_task
+
+CERTIFICATE_DIR = 'certificates'
+# User events rendered by one task, tasks of a big draw are spread over the worker pool
+TASK_CHUNK = 100
+
+_pending = threading.local()
+
+
+def certificate_context(user_event: UserJoinEvent, numbers_selected: list) -> dict:
+    turn_pick = user_event.turn_pick or 0
+    turn_per_point = user_event.turn_per_point or 0
+    point_redundant = max(user_event.total_point - (turn_pick * turn_per_point), 0)
+    try:
+        username = user_event.user.clientprofile.register_name
+    except Exception:
+        username = ''
+    return {
+        'data': {
+            'event_name': user_event.event.name,
+            'username': username,
+            'usercode': user_event.user.id,
+            'turn_roll': turn_pick,
+            'turn_chosen': user_event.turn_selected,
+            'turn_not_pick': turn_pick - user_event.turn_selected,
+            'total_point': user_event.total_point,
+            'user_point': point_redundant,
+            'number_rolled_str': ', '.join(map(str, numbers_selected)),
+        },
+        'number_rolled': numbers_selected,
+    }
+
+
+def certificate_version(context: dict) -> str:
+    return hashlib.sha1(json.dumps(context, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def certificate_file(user_event: UserJoinEvent, version: str) -> str:
+    return os.path.join(CERTIFICATE_DIR, user_event.event_id, user_event.id, f"{version}.pdf")
+
+
+def certificate_filename(user_event: UserJoinEvent) -> str:
+    return f"{user_event.user.username}_number.pdf"
+
+
+def selected_numbers(user_event_ids) -> dict:
+    """ {user_event_id: [numbers]} sorted, one query """
+    numbers = {user_event_id: [] for user_event_id in user_event_ids}
+    for user_event_id, number in NumberSelected.objects.filter(user_event_id__in=list(user_event_ids)).order_by(
+            'number__number').values_list('user_event_id', 'number__number'):
+        numbers[user_event_id].append(number)
+    return numbers
+
+
+def ensure_certificate(user_event: UserJoinEvent, numbers_selected: list) -> str:
+    """ Path (relative to MEDIA_ROOT) of current certificate, rendered when missing, older versions removed """
+    context = certificate_context(user_event, numbers_selected)
+    relative_path = certificate_file(user_event, certificate_version(context))
+    path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    if os.path.exists(path):
+        return relative_path
+    # Rendering libs are loaded only by processes which render (workers, report jobs), not by signal imports
+    from weasyprint import HTML
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    HTML(string=render_to_string('pdfs/user_numbers.html', context)).write_pdf(tmp_path)
+    os.replace(tmp_path, path)
+    for name in os.listdir(os.path.dirname(path)):
+        if name.endswith('.pdf') and name != os.path.basename(path):
+            os.remove(os.path.join(os.path.dirname(path), name))
+    return relative_path
+
+
+def render_certificates(user_event_ids) -> int:
+    """ Celery worker: render certificates whose content changed """
+    start_time = time.time()
+    user_events = list(UserJoinEvent.objects.filter(id__in=list(user_event_ids)).select_related(
+        'user__clientprofile', 'event'))
+    numbers = selected_numbers([user_event.id for user_event in user_events])
+    for user_event in user_events:
+        try:
+            ensure_certificate(user_event, numbers[user_event.id])
+        except Exception as e:
+            app_log.error(f"Error render certificate {user_event.id}: {e}")
+    app_log.info(f"Rendered certificates of {len(user_events)} users in {time.time() - start_time:.2f}s")
+    return len(user_events)
+
+
+def mark_certificates_dirty(user_event_ids):
+    """ Render certificates of these user events after commit, once for all marks of the transaction """
+    if not hasattr(_pending, 'user_events'):
+        _pending.user_events = set()
+    _pending.user_events.update(user_event_id for user_event_id in user_event_ids if user_event_id)
+    transaction.on_commit(schedule_certificates)
+
+
+def schedule_certificates():
+    user_event_ids = sorted(getattr(_pending, 'user_events', ()))
+    if not user_event_ids:
+        return
+    _pending.user_events.clear()
+    try:
+        for i in range(0, len(user_event_ids), TASK_CHUNK):
+            render_certificates_task.delay(user_event_ids[i:i + TASK_CHUNK])
+    except Exception as e:
+        # Broker is not available, certificate is rendered when requested
+        app_log.error(f"Error schedule certificates: {e}")
+
+
+def export_event_certificates_file(params, output):
+    """ Report builder: zip of all certificates of event, missing ones are rendered here """
+    event_id = params['pk']
+    user_events = list(UserJoinEvent.objects.filter(event_id=event_id).select_related(
+        'user__clientprofile', 'event').order_by('id'))
+    numbers = selected_numbers([user_event.id for user_event in user_events])
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for user_event in user_events:
+            relative_path = ensure_certificate(user_event, numbers[user_event.id])
+            archive.write(os.path.join(settings.MEDIA_ROOT, relative_path), certificate_filename(user_event))
+    return f"certificates_{event_id}.zip"
@@ -0,0 +1,131 @@
+"""
+Counters kept from NumberSelected: UserJoinEvent.turn_selected (numbers held by user) and
+NumberList.repeat_count (limit_repeat - times number is selected).
+Bulk writers which know their changes (number pool) add deltas in their own transaction.
+Row writes (admin, pick/unpick, cascade deletes) mark rows dirty, rows marked in a transaction are
+recounted once after its commit with one grouped UPDATE per table.
+"""
+import threading
+
+from django.db import connection, transaction
+
+from app.logs import app_log
+from marketing.pick_number.models import EventNumber, NumberList, NumberSelected, UserJoinEvent
+
+_pending = threading.local()
+
+
+def _pending_keys():
+    if not hasattr(_pending, 'user_events'):
+        _pending.user_events = set()
+        _pending.numbers = set()
+    return _pending.user_events, _pending.numbers
+
+
+def mark_counters_dirty(user_event_ids=(), number_ids=()):
+    """ Recount these user events and numbers after commit, once for all marks of the transaction """
+    user_events, numbers = _pending_keys()
+    user_events.update(user_event_id for user_event_id in user_event_ids if user_event_id)
+    numbers.update(number_id for number_id in number_ids if number_id)
+    # Later callbacks of same commit find nothing pending, keys of a rolled back transaction are only recounted
+    transaction.on_commit(flush_counters)
+
+
+def flush_counters():
+    user_events, numbers = _pending_keys()
+    if not user_events and not numbers:
+        return
+    user_event_ids, number_ids = list(user_events), list(numbers)
+    user_events.clear()
+    numbers.clear()
+    try:
+        recount_counters(user_event_ids=user_event_ids, number_ids=number_ids)
+    except Exception as e:
+        # Fixed by utils.truncate.event_number
+        app_log.error(f"Error recount pick number counters: {e}")
+
+
+def _turn_selected_query(where):
+    return f"""
+        SELECT u.id, u.turn_selected, COUNT(s.id) AS selected
+        FROM {UserJoinEvent._meta.db_table} AS u
+        LEFT JOIN {NumberSelected._meta.db_table} AS s ON s.user_event_id = u.id
+        WHERE {where}
+        GROUP BY u.id
+    """
+
+
+def _repeat_count_query(where):
+    return f"""
+        SELECT n.id, n.repeat_count, e.limit_repeat - COUNT(s.id) AS repeat_left
+        FROM {NumberList._meta.db_table} AS n
+        JOIN {EventNumber._meta.db_table} AS e ON e.id = n.event_id
+        LEFT JOIN {NumberSelected._meta.db_table} AS s ON s.number_id = n.id
+        WHERE {where}
+        GROUP BY n.id, e.limit_repeat
+    """
+
+
+def _scope(user_event_ids, number_ids, event_id):
+    """ WHERE clauses and params of (user events, numbers), None when nothing to recount """
+    if event_id is not None:
+        return ('u.event_id = %s', [event_id]), ('n.event_id = %s', [event_id])
+    if user_event_ids is None and number_ids is None:
+        return ('TRUE', []), ('TRUE', [])
+    return (('u.id = ANY(%s)', [list(user_event_ids)]) if user_event_ids else None,
+            ('n.id = ANY(%s)', [list(number_ids)]) if number_ids else None)
+
+
+def recount_counters(user_event_ids=None, number_ids=None, event_id=None):
+    """
+    Set turn_selected and repeat_count from NumberSelected, only rows which differ are written.
+    Scope: given ids, or all rows of event_id, or everything when nothing given. Return (user events, numbers) fixed.
+    """
+    user_scope, number_scope = _scope(user_event_ids, number_ids, event_id)
+    fixed_users = fixed_numbers = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        if user_scope:
+            cursor.execute(f"""
+                UPDATE {UserJoinEvent._meta.db_table} AS t SET turn_selected = c.selected, updated_at = now()
+                FROM ({_turn_selected_query(user_scope[0])}) AS c
+                WHERE t.id = c.id AND t.turn_selected IS DISTINCT FROM c.selected
+            """, user_scope[1])
+            fixed_users = cursor.rowcount
+        if number_scope:
+            cursor.execute(f"""
+                UPDATE {NumberList._meta.db_table} AS t SET repeat_count = c.repeat_left, updated_at = now()
+                FROM ({_repeat_count_query(number_scope[0])}) AS c
+                WHERE t.id = c.id AND t.repeat_count IS DISTINCT FROM c.repeat_left
+            """, number_scope[1])
+            fixed_numbers = cursor.rowcount
+    return fixed_users, fixed_numbers
+
+
+def find_counter_drift(event_id=None, limit=1000):
+    """ Rows whose counter differs from NumberSelected: {'user_events': [(id, stored, real)], 'numbers': [...]} """
+    user_scope, number_scope = _scope(None, None, event_id)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM ({_turn_selected_query(user_scope[0])}) AS c "
+                       f"WHERE c.turn_selected IS DISTINCT FROM c.selected LIMIT {int(limit)}", user_scope[1])
+        user_events = cursor.fetchall()
+        cursor.execute(f"SELECT * FROM ({_repeat_count_query(number_scope[0])}) AS c "
+                       f"WHERE c.repeat_count IS DISTINCT FROM c.repeat_left LIMIT {int(limit)}", number_scope[1])
+        numbers = cursor.fetchall()
+    return {'user_events': user_events, 'numbers': numbers}
+
+
+def apply_counter_deltas(cursor, number_deltas: dict, user_event_deltas: dict):
+    """ Bulk writers: add {number_id: delta} to repeat_count and {user_event_id: delta} to turn_selected """
+    update_deltas(cursor, NumberList._meta.db_table, 'repeat_count', number_deltas)
+    update_deltas(cursor, UserJoinEvent._meta.db_table, 'turn_selected', user_event_deltas)
+
+
+def update_deltas(cursor, table, field, deltas: dict):
+    """ Add {id: delta} to integer field of table in one UPDATE """
+    if not deltas:
+        return
+    cursor.execute(f"""
+        UPDATE {table} AS t SET {field} = t.{field} + d.delta, updated_at = now()
+        FROM unnest(%s::varchar[], %s::int[]) AS d(id, delta)
+        WHERE t.id = d.id
+    """, (list(deltas.keys()), list(deltas.values())))
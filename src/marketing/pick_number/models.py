@@ -1,14 +1,14 @@
 import time
 
-from django.db import models, transaction
-from django.db.models import Sum, FloatField
+from django.db import models, transaction, connection
+from django.db.models import Sum, FloatField, Count
 from rest_framework.exceptions import ValidationError
 
 from account.models import User, PhoneNumber
 from app.logs import app_log
 from marketing.order.models import OrderDetail, Order, SeasonalStatistic
 from marketing.price_list.models import PriceList
-from utils.helpers import self_id
+from utils.helpers import insert_with_new_id
 
 
 # Create your models here.
@@ -37,22 +37,27 @@ class EventNumber(models.Model):
                 app_log.debug(f"Start saving EventNumber")
                 is_new = self._state.adding
                 old_limit_repeat = None
-                if not self.id or self.id == '':
-                    self.id = self_id('EVN', EventNumber, 4)
+                old_range_number = None
+                selected_counts = None
+                new_id = not self.id or self.id == ''
                 if not is_new:
-                    # Lưu giá trị limit_repeat cũ trước khi cập nhật
-                    old_event = EventNumber.objects.get(id=self.id)
-                    old_range_number = old_event.range_number
-                    old_limit_repeat = old_event.limit_repeat
-                    # Validate before updating existing EventNumber
-                    self.validate_update(old_limit_repeat)
-
-                super().save(*args, **kwargs)
+                    # Lưu giá trị range_number, limit_repeat cũ trước khi cập nhật (khóa event như khi quay số)
+                    old_range_number, old_limit_repeat = EventNumber.objects.select_for_update().filter(
+                        id=self.id).values_list('range_number', 'limit_repeat').get()
+                    if self.range_number != old_range_number or self.limit_repeat != old_limit_repeat:
+                        # Validate before updating existing EventNumber
+                        selected_counts = self.selected_counts()
+                        self.validate_update(selected_counts)
+
+                if new_id:
+                    insert_with_new_id(self, super().save, ('EVN', 4), *args, **kwargs)
+                else:
+                    super().save(*args, **kwargs)
 
                 if is_new:
                     self.create_number_list()
-                else:
-                    self.update_number_list(old_limit_repeat, old_range_number)
+                elif selected_counts is not None:
+                    self.update_number_list(old_range_number)
                 app_log.info(f"Time complete EventNumber: {time.time() - start_time}")
         except Exception as e:
             app_log.error(f"Error in saving EventNumber: {e}")
@@ -72,92 +77,55 @@ class EventNumber(models.Model):
         NumberList.objects.bulk_create(number_list)
         app_log.info(f"Time complete create new NumberList: {time.time() - start_time}")
 
-    def update_number_list(self, old_limit_repeat, old_range_number):
-        if self.range_number == old_range_number and self.limit_repeat == old_limit_repeat:
-            return
-        start_time = time.time()
-        current_numbers = NumberList.objects.filter(event=self).values_list('number', 'id', 'repeat_count')
-        new_numbers = set(range(1, self.range_number + 1))
-
-        current_numbers_dict = {num: {'id': nid, 'repeat_count': rcount} for num, nid, rcount in current_numbers}
-        current_numbers_set = set(current_numbers_dict.keys())
+    def selected_counts(self) -> dict:
+        """ {number: times selected} of numbers selected at least once, one grouped query """
+        return dict(NumberSelected.objects.filter(number__event=self).values('number__number').annotate(
+            selected=Count('id')).values_list('number__number', 'selected'))
 
-        numbers_to_add = new_numbers - current_numbers_set
-        numbers_to_remove = current_numbers_set - new_numbers
+    def update_number_list(self, old_range_number):
+        """
+        Apply new range_number/limit_repeat in three statements: delete numbers above range (validated as never
+        selected), set repeat_count = limit_repeat - times selected for all numbers, add missing numbers.
+        """
+        start_time = time.time()
+        number_table = NumberList._meta.db_table
+        selected_table = NumberSelected._meta.db_table
+        with connection.cursor() as cursor:
+            if self.range_number < old_range_number:
+                cursor.execute(f"DELETE FROM {number_table} WHERE event_id = %s AND number > %s",
+                               (self.id, self.range_number))
+            cursor.execute(f"""
+                UPDATE {number_table} AS n
+                SET repeat_count = %s - (SELECT COUNT(*) FROM {selected_table} AS s WHERE s.number_id = n.id),
+                    updated_at = now()
+                WHERE n.event_id = %s
+            """, (self.limit_repeat, self.id))
 
-        # Add new numbers
-        number_list_to_add = [
+        current_numbers = set(NumberList.objects.filter(event=self).values_list('number', flat=True))
+        NumberList.objects.bulk_create([
             NumberList(
                 id=f'{self.id}_{num}',
                 number=num,
                 repeat_count=self.limit_repeat,
                 event=self
             )
-            for num in numbers_to_add
-        ]
-
-        # Prepare list for bulk update
-        number_list_to_update = []
-
-        # Update existing numbers' repeat_count
-        for num in current_numbers_set:
-            number_list = NumberList.objects.get(id=current_numbers_dict[num]['id'])
-            number_selected_count = NumberSelected.objects.filter(number=number_list).count()
-
-            new_repeat_count = self.limit_repeat
-            # Ensure repeat_count does not go below the number of times it has been selected
-            if number_selected_count != 0:
-                app_log.info(f'New repeat count 1: {new_repeat_count}')
-                new_repeat_count = new_repeat_count - number_selected_count
-                app_log.info(f"\nDebug number: {num}")
-                app_log.info(f"Number selected count: {number_selected_count}")
-                app_log.info(f"New repeat count: {new_repeat_count} | Old: {old_limit_repeat}")
-            # if new_repeat_count + number_selected_count > old_limit_repeat:
-            #     raise ValueError(
-            #         f"Cannot reduce repeat_count below the number of times number {num} has been selected.")
-
-            number_list.repeat_count = new_repeat_count
-            number_list_to_update.append(number_list)
-
-        # Bulk update existing numbers
-        NumberList.objects.bulk_update(number_list_to_update, ['repeat_count'])
-
-        # Validate and possibly remove numbers
-        for num in numbers_to_remove:
-            number_list = NumberList.objects.get(event=self, number=num)
-            if NumberSelected.objects.filter(number=number_list).exists():
-                raise ValueError(f"Cannot reduce range_number, number {num} is already selected.")
-            number_list.delete()
-        NumberList.objects.bulk_create(number_list_to_add)
+            for num in range(1, self.range_number + 1) if num not in current_numbers
+        ], batch_size=5000)
 
         app_log.info(f"Time complete update NumberList: {time.time() - start_time}")
 
-    def validate_update(self, old_limit_repeat):
+    def validate_update(self, selected_counts: dict):
         start_time = time.time()
-        current_numbers = set(NumberList.objects.filter(event=self).values_list('number', flat=True))
-        new_numbers = set(range(1, self.range_number + 1))
-
-        numbers_to_remove = current_numbers - new_numbers
-
         # Validate that no selected number is removed
-        for num in numbers_to_remove:
-            number_list = NumberList.objects.get(event=self, number=num)
-            if NumberSelected.objects.filter(number=number_list).exists():
-                raise ValidationError(f"Cannot reduce range_number, number {num} is already selected.")
+        removed = sorted(num for num in selected_counts if num > self.range_number)
+        if removed:
+            raise ValidationError(f"Cannot reduce range_number, number {removed[0]} is already selected.")
 
         # Validate limit_repeat
-        number_selected = NumberSelected.objects.filter(user_event__event=self).values_list('number__number', flat=True)
-        smallest_repeat = NumberList.objects.filter(
-            event=self,
-            number__in=list(number_selected)
-        ).order_by('repeat_count').first()
-        print(f"Test smallest repeat: {smallest_repeat}")
-        if smallest_repeat:
-            result_reduce_limit = (self.limit_repeat - (old_limit_repeat - smallest_repeat.repeat_count))
-            app_log.info(f"Result reduce limit: {result_reduce_limit}")
-            if result_reduce_limit < 0:
-                raise ValidationError(f"Cannot reduce limit_repeat, "
-                                      f"numbers {smallest_repeat.number} have higher repeat count than the new limit.")
+        over_limit = sorted(num for num, selected in selected_counts.items() if selected > self.limit_repeat)
+        if over_limit:
+            raise ValidationError(f"Cannot reduce limit_repeat, "
+                                  f"numbers {over_limit[:20]} have higher repeat count than the new limit.")
         app_log.info(f"Time complete Validate before update: {time.time() - start_time}")
 
 
@@ -0,0 +1,240 @@
+"""
+Number pool of an event for draws: repeat_count left of every number in one NumPy array (index is the number)
+and numbers already held by each user event.
+The pool is loaded with the event row locked until commit, so draws of one event are serialized and
+sample-and-decrement never gives a number more than limit_repeat times nor twice to a user.
+Draw results are written in bulk: NumberSelected, PickNumberLog, then repeat_count and turn_selected deltas.
+Repeats left are counted from NumberSelected when loading, so the pool does not depend on counters being fresh.
+"""
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import F
+
+from app.logs import app_log
+from marketing.pick_number.certificates import mark_certificates_dirty
+from marketing.pick_number.counters import apply_counter_deltas
+from marketing.pick_number.models import EventNumber, NumberList, NumberSelected, PickNumberLog, UserJoinEvent
+
+BATCH_SIZE = 5000
+
+
+class NumberPool:
+    def __init__(self, event: EventNumber, counts, number_ids, selected, rng=None):
+        self.event = event
+        # counts[number]: repeat_count left, 0 for numbers not in NumberList (and index 0)
+        self.counts = counts
+        # number_ids[number]: id of NumberList row
+        self.number_ids = number_ids
+        # {user_event_id: set of numbers held}
+        self.selected = selected
+        self.rng = rng or np.random.default_rng()
+        # Drawn and not saved yet {user_event: [numbers]}
+        self.draws = defaultdict(list)
+
+    @classmethod
+    def load(cls, event: EventNumber, rng=None):
+        """ Lock event and read its pool, call inside transaction.atomic() """
+        list(EventNumber.objects.select_for_update().filter(pk=event.pk).values_list('pk', flat=True))
+        rows = list(NumberList.objects.filter(event=event).values_list('number', 'id'))
+        size = max([event.range_number] + [number for number, _ in rows]) + 1
+        counts = np.zeros(size, dtype=np.int64)
+        number_ids = [None] * size
+        for number, number_id in rows:
+            if number > 0:
+                counts[number] = event.limit_repeat
+                number_ids[number] = number_id
+
+        # Repeats left come from selections, not from repeat_count which row writes recount after commit
+        selected = defaultdict(set)
+        for user_event_id, number in NumberSelected.objects.filter(user_event__event=event).values_list(
+                'user_event_id', 'number__number'):
+            selected[user_event_id].add(number)
+            if 0 < number < size:
+                counts[number] -= 1
+        np.maximum(counts, 0, out=counts)
+        return cls(event, counts, number_ids, selected, rng)
+
+    def available(self, user_event_id):
+        """ Numbers user can still draw: repeat_count left and not held by user """
+        mask = self.counts > 0
+        held = self.selected.get(user_event_id)
+        if held:
+            mask[[number for number in held if number < len(mask)]] = False
+        return np.flatnonzero(mask)
+
+    def draw(self, user_event: UserJoinEvent, times: int = 1) -> list:
+        """ Sample up to `times` distinct numbers for user and take them from pool """
+        candidates = self.available(user_event.id)
+        times = min(times, len(candidates))
+        if times <= 0:
+            return []
+        numbers = self.rng.choice(candidates, size=times, replace=False)
+        self.counts[numbers] -= 1
+        numbers = numbers.tolist()
+        self.selected[user_event.id].update(numbers)
+        self.draws[user_event].extend(numbers)
+        return numbers
+
+    def allocate(self, turns: dict) -> dict:
+        """
+        Draw {user_event: times} for many users in one vectorized pass, return {user_event: [numbers]}.
+        Slots of the pool are laid out in layers (layer k has every number with more than k repeats left, shuffled),
+        users in random order take consecutive slots, so a number is used again only when each number was used.
+        Slots which break per-user uniqueness (same number twice, or already held) are given back and those users
+        draw the rest one by one.
+        """
+        user_events = [user_event for user_event, times in turns.items() if times > 0]
+        if not user_events:
+            return {}
+        user_events = [user_events[i] for i in self.rng.permutation(len(user_events))]
+        wanted = np.array([turns[user_event] for user_event in user_events], dtype=np.int64)
+
+        layers = []
+        for repeat in range(int(self.counts.max(initial=0))):
+            layer = np.flatnonzero(self.counts > repeat)
+            self.rng.shuffle(layer)
+            layers.append(layer)
+        slots = np.concatenate(layers) if layers else np.empty(0, dtype=np.int64)
+
+        total = min(int(wanted.sum()), len(slots))
+        owners = np.repeat(np.arange(len(user_events)), wanted)[:total]
+        numbers = slots[:total]
+        size = len(self.counts)
+        keys = owners * size + numbers
+        accepted = np.zeros(total, dtype=bool)
+        accepted[np.unique(keys, return_index=True)[1]] = True
+        held_keys = [i * size + number for i, user_event in enumerate(user_events)
+                     for number in self.selected.get(user_event.id, ()) if number < size]
+        if held_keys:
+            accepted &= ~np.isin(keys, np.array(held_keys, dtype=np.int64))
+        owners, numbers = owners[accepted], numbers[accepted]
+        self.counts -= np.bincount(numbers, minlength=size)
+
+        result = {}
+        bounds = np.searchsorted(owners, np.arange(len(user_events) + 1))
+        for i, user_event in enumerate(user_events):
+            drawn = numbers[bounds[i]:bounds[i + 1]].tolist()
+            if drawn:
+                self.selected[user_event.id].update(drawn)
+                self.draws[user_event].extend(drawn)
+            result[user_event] = drawn
+        # Given back slots are all in pool now
+        for i, user_event in enumerate(user_events):
+            missing = int(wanted[i]) - len(result[user_event])
+            if missing > 0 and self.counts.any():
+                result[user_event] += self.draw(user_event, missing)
+        return result
+
+    def required_growth(self, turns: dict) -> int:
+        """ New numbers needed so that pool has enough repeats for all turns and enough numbers for each user """
+        positive = self.counts > 0
+        distinct = int(positive.sum())
+        per_user = 0
+        for user_event, times in turns.items():
+            held = [number for number in self.selected.get(user_event.id, ()) if number < len(positive)]
+            free = distinct - int(positive[held].sum()) if held else distinct
+            per_user = max(per_user, times - free)
+        missing_repeats = sum(turns.values()) - int(self.counts.sum())
+        limit_repeat = max(self.event.limit_repeat, 1)
+        return max(per_user, -(-missing_repeats // limit_repeat), 0)
+
+    def grow(self, amount: int) -> int:
+        """ Add `amount` numbers after the last one (limit_repeat repeats each) to pool, NumberList and range_number """
+        if amount <= 0:
+            return 0
+        first = len(self.counts)
+        new_numbers = range(first, first + amount)
+        NumberList.objects.bulk_create([
+            NumberList(id=f"{self.event.id}_{number}", number=number, repeat_count=self.event.limit_repeat,
+                       event=self.event)
+            for number in new_numbers
+        ], batch_size=BATCH_SIZE)
+        self.event.range_number = new_numbers[-1]
+        EventNumber.objects.filter(pk=self.event.pk).update(range_number=self.event.range_number)
+        self.counts = np.concatenate([self.counts, np.full(amount, self.event.limit_repeat, dtype=np.int64)])
+        self.number_ids.extend(f"{self.event.id}_{number}" for number in new_numbers)
+        return amount
+
+    def save(self, action='random'):
+        """ Write drawn numbers, one statement per table whatever the number of users """
+        draws = {user_event: numbers for user_event, numbers in self.draws.items() if numbers}
+        if not draws:
+            return 0
+        start_time = time.time()
+        with transaction.atomic():
+            NumberSelected.objects.bulk_create([
+                NumberSelected(user_event=user_event, number_id=self.number_ids[number])
+                for user_event, numbers in draws.items() for number in numbers
+            ], batch_size=BATCH_SIZE)
+            PickNumberLog.objects.bulk_create([
+                PickNumberLog(event=self.event, user_id=user_event.user_id, number=number, action=action)
+                for user_event, numbers in draws.items() for number in numbers
+            ], batch_size=BATCH_SIZE)
+
+            taken = Counter(number for numbers in draws.values() for number in numbers)
+            picked = {user_event.id: len(numbers) for user_event, numbers in draws.items()}
+            with connection.cursor() as cursor:
+                apply_counter_deltas(cursor, {self.number_ids[number]: -count for number, count in taken.items()},
+                                     picked)
+            mark_certificates_dirty(picked.keys())
+        for user_event, numbers in draws.items():
+            if isinstance(user_event.turn_selected, int):
+                user_event.turn_selected += len(numbers)
+        self.draws.clear()
+        total = sum(picked.values())
+        app_log.info(f"Saved {total} numbers of {len(picked)} users in {time.time() - start_time:.2f}s")
+        return total
+
+
+def draw_numbers(user_event: UserJoinEvent, times: int = 1, action='random') -> list:
+    """ Draw and save numbers of one user """
+    with transaction.atomic():
+        pool = NumberPool.load(user_event.event)
+        numbers = pool.draw(user_event, times)
+        pool.save(action)
+    return numbers
+
+
+def auto_pick(event: EventNumber, add_more_number=False) -> dict:
+    """
+    Draw all turns left of every user in event: turns are read up front, range_number grows once (when
+    add_more_number) to what the turns need, numbers are allocated in one pass and written in one transaction.
+    """
+    timings = {}
+    start_time = time.time()
+    with transaction.atomic():
+        pool = NumberPool.load(event)
+        users_event = event.user_join_event.annotate(
+            turns_left=F('turn_pick') - F('turn_selected')
+        ).filter(turns_left__gt=0)
+        turns = {user_event: user_event.turns_left for user_event in users_event}
+        timings['load'] = round(time.time() - start_time, 3)
+
+        step_time = time.time()
+        grown = pool.grow(pool.required_growth(turns)) if add_more_number else 0
+        timings['grow'] = round(time.time() - step_time, 3)
+
+        step_time = time.time()
+        drawn = pool.allocate(turns)
+        short = {user_event: times - len(drawn.get(user_event, [])) for user_event, times in turns.items()
+                 if len(drawn.get(user_event, [])) < times}
+        if add_more_number and short:
+            # Rare: holdings of some users leave them without enough distinct numbers
+            grown += pool.grow(max(short.values()))
+            for user_event, missing in short.items():
+                pool.draw(user_event, missing)
+            short = {user_event: missing for user_event, missing in short.items()
+                     if len(pool.draws[user_event]) < turns[user_event]}
+        timings['allocate'] = round(time.time() - step_time, 3)
+
+        step_time = time.time()
+        picked = pool.save()
+        timings['save'] = round(time.time() - step_time, 3)
+    timings['total'] = round(time.time() - start_time, 3)
+    result = {'users': len(turns), 'numbers': picked, 'short_users': len(short), 'grown': grown,
+              'range_number': event.range_number, 'timings': timings}
+    app_log.info(f"Auto pick {event.id}: {result}")
+    return result
@@ -1,7 +1,9 @@
-from django.db.models.signals import pre_delete, post_save, post_delete
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete
 from django.dispatch import receiver
 
 from app.logs import app_log
+from marketing.pick_number.certificates import mark_certificates_dirty
+from marketing.pick_number.counters import mark_counters_dirty
 from marketing.pick_number.models import UserJoinEvent, NumberSelected
 
 """
@@ -57,32 +59,24 @@ def update_user_join_event(sender, instance, created, **kwargs):
 #     number_selected.delete()
 
 
-def update_number_counts(instance):
-    # Log the action
-    app_log.info(f"Updating counts for NumberSelected: {instance.id}")
-
-    # Update selected numbers count
-    user_join_event = instance.user_event
-    selected_numbers = user_join_event.number_selected.all().count()
-    user_join_event.turn_selected = selected_numbers
-    user_join_event.save(update_fields=['turn_selected'])
-
-    # Update repeat counts
-    number_list = instance.number
-    number_selected = NumberSelected.objects.filter(number=number_list).count()
-    number_list.repeat_count = instance.user_event.event.limit_repeat - number_selected
-    number_list.save(update_fields=['repeat_count'])
-
-    app_log.info(f"Updated repeat count: {number_list.repeat_count} for number_list: {number_list.id}")
+@receiver(pre_save, sender=NumberSelected)
+def pre_save_update(sender, instance, **kwargs):
+    # Selection moved to other user event or number: old ones are recounted too
+    if not instance.pk:
+        return
+    old = NumberSelected.objects.filter(pk=instance.pk).values_list('user_event_id', 'number_id').first()
+    if old:
+        mark_counters_dirty([old[0]], [old[1]])
+        mark_certificates_dirty([old[0]])
 
 
 @receiver(post_save, sender=NumberSelected)
 def post_save_update(sender, instance, **kwargs):
-    app_log.info("Post save signal triggered")
-    update_number_counts(instance)
+    mark_counters_dirty([instance.user_event_id], [instance.number_id])
+    mark_certificates_dirty([instance.user_event_id])
 
 
 @receiver(post_delete, sender=NumberSelected)
 def post_delete_update(sender, instance, **kwargs):
-    app_log.info("Post delete signal triggered")
-    update_number_counts(instance)
+    mark_counters_dirty([instance.user_event_id], [instance.number_id])
+    mark_certificates_dirty([instance.user_event_id])
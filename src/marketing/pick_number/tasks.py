@@ -5,3 +5,9 @@ from app.settings import pusher_client
 @shared_task
 def trigger_pusher(channel, event, data):
     pusher_client.trigger(channel, event, data)
+
+
+@shared_task
+def render_certificates_task(user_event_ids):
+    from marketing.pick_number.certificates import render_certificates
+    return render_certificates(user_event_ids)
@@ -1,3 +1,129 @@
+from collections import Counter
+from datetime import date, timedelta
+
+import numpy as np
 from django.test import TestCase
+from rest_framework.exceptions import ValidationError
+
+from account.models import User
+from marketing.pick_number.counters import find_counter_drift
+from marketing.pick_number.models import EventNumber, NumberList, NumberSelected, UserJoinEvent
+from marketing.pick_number.pool import NumberPool, auto_pick
+
+
+def create_event(range_number, limit_repeat, participants, turns):
+    today = date.today()
+    event = EventNumber(name='Test event', date_start=today, date_close=today + timedelta(days=30),
+                        range_number=range_number, limit_repeat=limit_repeat)
+    event.save()
+    users = User.objects.bulk_create([
+        User(id=f'TESTND{i:03d}', username=f'TESTND{i:03d}', password='!', user_type='farmer', status='active')
+        for i in range(participants)
+    ])
+    user_events = UserJoinEvent.objects.bulk_create([
+        UserJoinEvent(id=f'{event.id}_{user.id}', user=user, event=event, turn_pick=turns) for user in users
+    ])
+    return event, user_events
+
+
+def selections(event):
+    return list(NumberSelected.objects.filter(user_event__event=event).values_list('user_event_id', 'number__number'))
+
 
 # Create your tests here.
+class NumberPoolTest(TestCase):
+    def load_pool(self, event):
+        return NumberPool.load(event, rng=np.random.default_rng(7))
+
+    def assert_valid_selections(self, event):
+        rows = selections(event)
+        self.assertEqual(len(set(rows)), len(rows), "number selected twice by a user")
+        self.assertLessEqual(max(Counter(number for _, number in rows).values(), default=0), event.limit_repeat)
+        self.assertTrue(all(1 <= number <= event.range_number for _, number in rows))
+        self.assertEqual(find_counter_drift(event.id), {'user_events': [], 'numbers': []})
+        return rows
+
+    def test_allocate(self):
+        event, user_events = create_event(20, 2, 6, 5)
+        pool = self.load_pool(event)
+        drawn = pool.allocate({user_event: 5 for user_event in user_events})
+        self.assertEqual(sorted(len(numbers) for numbers in drawn.values()), [5] * 6)
+        self.assertTrue(all(len(set(numbers)) == 5 for numbers in drawn.values()))
+        self.assertEqual(int(pool.counts.sum()), 20 * 2 - 30)
+
+        self.assertEqual(pool.save(), 30)
+        self.assertEqual(len(self.assert_valid_selections(event)), 30)
+        self.assertEqual(set(UserJoinEvent.objects.filter(event=event).values_list('turn_selected', flat=True)), {5})
+
+    def test_allocate_skips_numbers_user_holds(self):
+        event, user_events = create_event(6, 2, 2, 4)
+        pool = self.load_pool(event)
+        held = pool.draw(user_events[0], 4)
+        pool.save()
+
+        pool = self.load_pool(event)
+        drawn = pool.allocate({user_events[0]: 2, user_events[1]: 4})
+        self.assertFalse(set(drawn[user_events[0]]) & set(held))
+        self.assertEqual(len(drawn[user_events[0]]), 2)
+        pool.save()
+        self.assert_valid_selections(event)
+
+    def test_allocate_when_pool_is_short(self):
+        event, user_events = create_event(5, 2, 4, 5)
+        pool = self.load_pool(event)
+        drawn = pool.allocate({user_event: 5 for user_event in user_events})
+        self.assertEqual(sum(len(numbers) for numbers in drawn.values()), 10)
+        self.assertFalse(pool.counts.any())
+        pool.save()
+        self.assert_valid_selections(event)
+
+    def test_auto_pick_grows_range(self):
+        event, user_events = create_event(5, 2, 4, 5)
+        result = auto_pick(event, add_more_number=True)
+        self.assertEqual((result['numbers'], result['short_users']), (20, 0))
+        event.refresh_from_db()
+        self.assertEqual(event.range_number, result['range_number'])
+        self.assertEqual(NumberList.objects.filter(event=event).count(), event.range_number)
+        self.assert_valid_selections(event)
+
+
+class EventNumberResizeTest(TestCase):
+    def setUp(self):
+        self.event, user_events = create_event(10, 2, 2, 3)
+        pool = NumberPool.load(self.event, rng=np.random.default_rng(7))
+        pool.draw(user_events[0], 2)
+        pool.draw(user_events[1], 2)
+        pool.save()
+        self.selected = Counter(number for _, number in selections(self.event))
+
+    def resize(self, range_number, limit_repeat):
+        event = EventNumber.objects.get(pk=self.event.pk)
+        event.range_number, event.limit_repeat = range_number, limit_repeat
+        event.save()
+        return event
+
+    def repeat_counts(self):
+        return dict(NumberList.objects.filter(event=self.event).values_list('number', 'repeat_count'))
+
+    def test_grow(self):
+        self.resize(15, 3)
+        self.assertEqual(self.repeat_counts(), {number: 3 - self.selected[number] for number in range(1, 16)})
+
+    def test_shrink_removes_free_numbers(self):
+        range_number = max(self.selected)
+        self.resize(range_number, 2)
+        self.assertEqual(self.repeat_counts(),
+                         {number: 2 - self.selected[number] for number in range(1, range_number + 1)})
+
+    def test_shrink_below_selected_number_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self.resize(max(self.selected) - 1, 2)
+        self.assertEqual(NumberList.objects.filter(event=self.event).count(), 10)
+
+    def test_limit_below_selections_is_rejected(self):
+        # Free number selected by both users
+        number = next(number for number in range(1, 11) if number not in self.selected)
+        for user_event in UserJoinEvent.objects.filter(event=self.event):
+            NumberSelected.objects.create(user_event=user_event, number_id=f'{self.event.id}_{number}')
+        with self.assertRaises(ValidationError):
+            self.resize(10, 1)
@@ -2,7 +2,7 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from marketing.price_list.api.views import GenericApiPriceList, ApiSpecialOffer, ApiSpecialOfferConsider, \
-    ApiImportProductPL, ApiImportProductSO, ApiSOProduct, ApiPLProduct
+    ApiImportProductPL, ApiImportProductSO, ApiSOProduct, ApiPLProduct, ApiCatalogStats
 from utils.constants import actions_views, actions_detail
 
 app_name = 'api_price_list'
@@ -42,4 +42,5 @@ urlpatterns = [
 
     path('<pk>/export-products/', GenericApiPriceList.as_view({'get': 'export_products'})),
     path('<pk>/export-users/', GenericApiPriceList.as_view({'get': 'export_users'})),
+    path('catalog-stats/', ApiCatalogStats.as_view()),
 ]
@@ -3,10 +3,10 @@ from django.db import transaction
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from account.handlers.perms import get_full_permname, get_perm_name
+from account.handlers.perms import get_full_permname, has_object_perms
 from account.handlers.restrict_serializer import BaseRestrictSerializer
-from account.models import GroupPerm, Perm
-from account.queries import get_user_by_permname_sql, get_user_like_permname_sql
+from account.models import GroupPerm, Perm, UserGroupPerm
+from account.queries import get_user_by_permname_sql
 from app.logs import app_log
 from marketing.price_list.models import PriceList, ProductPrice, SpecialOfferProduct, SpecialOffer
 from marketing.product.models import Product
@@ -191,7 +191,7 @@ class PriceListSerializer(BaseRestrictSerializer):
 
         if allow_nhom:
             for group_name in allow_nhom:
-                group_users = get_user_like_permname_sql(group_name)
+                group_users = UserGroupPerm.objects.filter(group_id=group_name).values('user_id')
                 overlapping_price_lists = PriceList.objects.filter(
                     type='sub',
                     date_start__lte=date_end,
@@ -355,9 +355,7 @@ class SpecialOfferSerializer(BaseRestrictSerializer):
                     self.handle_restrict_import_users_id(import_users, perm_data, user_actions)
 
                 restrict = perm_data.get('restrict')
-                perm_name = get_perm_name(self.Meta.model)
-                perm_name = perm_name + f"_{instance.id}"
-                if restrict or Perm.objects.filter(name__endswith=perm_name).exists():
+                if restrict or has_object_perms(self.Meta.model, instance.id):
                     self.handle_restrict(perm_data, instance.id, self.Meta.model)
                 return instance
         except ValidationError as ve:
@@ -18,17 +18,19 @@ from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 
 from account.handlers.perms import perm_queryset, get_perm_name, export_users_has_perm
-from account.handlers.restrict_serializer import add_perm, create_full_perm, list_user_has_perm
+from account.handlers.restrict_serializer import create_full_perm, grant_object_perms
 from account.handlers.validate_perm import ValidatePermRest
 from account.models import User
 from app.logs import app_log
+from marketing.price_list.catalog import invalidate_catalog, catalog_stats, PRICE_LIST, SPECIAL_OFFER
 from marketing.price_list.api.serializers import PriceListSerializer, SpecialOfferSerializer, PriceList2Serializer, \
     SpecialOfferProductSerializer, ProductPriceSerializer
 from marketing.price_list.models import PriceList, SpecialOffer, ProductPrice, SpecialOfferProduct
 from marketing.product.models import Product
+from system_func.api.views import report_job_response
 from utils.constants import so_type, data_status, so_type_list, perm_actions
 from utils.datetime_handle import convert_date_format
 from utils.model_filter_paginate import filter_data
@@ -81,72 +83,51 @@ class GenericApiPriceList(viewsets.GenericViewSet, mixins.ListModelMixin, mixins
         return Response(response)
 
     def export_products(self, request, *args, **kwargs):
-        try:
-            pk = kwargs.get('pk')
-            pl: PriceList = PriceList.objects.filter(id=pk).first()
-            if not pl:
-                return Response({'message': f'không tìm thấy bảng giá với id {pk}'}, status=404)
-
-            products = ProductPrice.objects.filter(price_list=pl)
-
-            # Tạo Workbook mới
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-
-            # Ghi tiêu đề cột
-            columns = ['Mã thuốc', 'Tên thuốc', 'Số lượng', 'Đơn giá', 'Điểm']
-            for col_num, column_title in enumerate(columns, 1):
-                column_letter = get_column_letter(col_num)
-                sheet[f'{column_letter}1'] = column_title
-
-            # Ghi dữ liệu sản phẩm vào các hàng tiếp theo
-            for row_num, product_price in enumerate(products, 2):
-                sheet[f'A{row_num}'] = product_price.product.id  # Cột Mã thuốc
-                sheet[f'B{row_num}'] = product_price.product.name  # Cột Tên thuốc
-                sheet[f'C{row_num}'] = product_price.quantity_in_box  # Cột Số lượng
-                sheet[f'D{row_num}'] = product_price.price  # Cột Đơn giá
-                sheet[f'E{row_num}'] = product_price.point if product_price.point is not None else 0  # Cột Điểm
+        pk = kwargs.get('pk')
+        if not PriceList.objects.filter(id=pk).exists():
+            return Response({'message': f'không tìm thấy bảng giá với id {pk}'}, status=404)
+        return report_job_response(request, 'price_list_products', {'pk': pk})
 
-            # Tạo HTTP response với nội dung file Excel
-            response = HttpResponse(
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            )
-            response['Content-Disposition'] = f'attachment; filename=product_prices_{pk}.xlsx'
-
-            # Lưu Workbook vào response
-            workbook.save(response)
+    def export_users(self, request, *args, **kwargs):
+        pk = kwargs.get('pk')
+        if not PriceList.objects.filter(id=pk).exists():
+            return Response({'message': f'không tìm thấy bảng giá với id {pk}'}, status=404)
+        return report_job_response(request, 'price_list_users', {'pk': pk})
 
-            return response
 
-        except Exception as e:
-            app_log.error(f"Error in price_list export_products: {e}")
-            return Response({'message': f'Error occurred: {str(e)}'}, status=500)
+def export_price_list_products_file(params, output):
+    pk = params['pk']
+    pl: PriceList = PriceList.objects.get(id=pk)
+    products = ProductPrice.objects.filter(price_list=pl).select_related('product')
 
-    def export_users(self, request, *args, **kwargs):
-        try:
-            pk = kwargs.get('pk')
-            pl: PriceList = PriceList.objects.filter(id=pk).first()
-            if not pl:
-                return Response({'message': f'không tìm thấy bảng giá với id {pk}'}, status=404)
-            perm_name = get_perm_name(pl)
-            perm_name_pk = perm_name + f'_{pk}'
+    # Tạo Workbook mới
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
 
-            workbook = export_users_has_perm(pl, pk)
+    # Ghi tiêu đề cột
+    columns = ['Mã thuốc', 'Tên thuốc', 'Số lượng', 'Đơn giá', 'Điểm']
+    for col_num, column_title in enumerate(columns, 1):
+        column_letter = get_column_letter(col_num)
+        sheet[f'{column_letter}1'] = column_title
 
-            response = HttpResponse(
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            )
-            response['Content-Disposition'] = f'attachment; filename="UserDungBangGia_{pk}.xlsx"'
+    # Ghi dữ liệu sản phẩm vào các hàng tiếp theo
+    for row_num, product_price in enumerate(products, 2):
+        sheet[f'A{row_num}'] = product_price.product.id  # Cột Mã thuốc
+        sheet[f'B{row_num}'] = product_price.product.name  # Cột Tên thuốc
+        sheet[f'C{row_num}'] = product_price.quantity_in_box  # Cột Số lượng
+        sheet[f'D{row_num}'] = product_price.price  # Cột Đơn giá
+        sheet[f'E{row_num}'] = product_price.point if product_price.point is not None else 0  # Cột Điểm
 
-            # Lưu workbook vào response
-            workbook.save(response)
+    workbook.save(output)
+    return f'product_prices_{pk}.xlsx'
 
-            return response
 
-        except Exception as e:
-            app_log.error(f"Error in price_list export_users: {e}")
-            # return Response({'message': f'Error occurred: {str(e)}'}, status=500)
-            raise e
+def export_price_list_users_file(params, output):
+    pk = params['pk']
+    pl: PriceList = PriceList.objects.get(id=pk)
+    workbook = export_users_has_perm(pl, pk)
+    workbook.save(output)
+    return f'UserDungBangGia_{pk}.xlsx'
 
 
 class ApiPLProduct(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin,
@@ -303,11 +284,8 @@ class ApiSpecialOffer(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.Cre
                         client_id = item['client_id']
                         actions = [perm_actions['view'], perm_actions['create']]
                         list_perm = create_full_perm(SpecialOffer, so_obj.id, actions)
-
-                        # Get user has perm
-                        existed_user_allow = list_user_has_perm(list_perm, True)
-
-                        add_perm({'type': 'users', 'data': [client_id], 'existed': existed_user_allow}, list_perm, True)
+                        # Each line adds one client, keep clients of previous lines
+                        grant_object_perms(list_perm, users=[client_id], replace=False)
 
                     except Exception as e:
                         error = {
@@ -344,6 +322,8 @@ class ApiSpecialOffer(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.Cre
                     }
                     update_products_offer.append(success)
                     SpecialOfferProduct.objects.bulk_create(products_offer)
+                    # bulk_create không gọi signal
+                    invalidate_catalog(SPECIAL_OFFER, so_obj.id)
                     if i == 5:
                         raise Exception("Break for testing")
             return update_products_offer, error_data
@@ -518,6 +498,8 @@ class ApiImportProductPL(APIView):
                 # Remove products not in the current Excel file
                 ProductPrice.objects.filter(price_list=price_list).exclude(
                     product__id__in=product_ids_in_excel).delete()
+                # bulk_create/bulk_update không gọi signal
+                invalidate_catalog(PRICE_LIST, price_list.id)
 
             data = PriceList2Serializer(price_list).data
             return Response(data, status=status.HTTP_200_OK)
@@ -610,6 +592,8 @@ class ApiImportProductSO(APIView):
                 # Remove products not in the current Excel file
                 SpecialOfferProduct.objects.filter(special_offer=special_offer).exclude(
                     product__id__in=product_in_excel).delete()
+                # bulk_create/bulk_update không gọi signal
+                invalidate_catalog(SPECIAL_OFFER, special_offer.id)
             data = SpecialOfferSerializer(special_offer).data
             return Response(data, status=status.HTTP_200_OK)
 
@@ -645,3 +629,12 @@ class ApiSOProduct(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.Create
                                **kwargs)
 
         return Response(response, status.HTTP_200_OK)
+
+
+class ApiCatalogStats(APIView):
+    """ Hit/miss counters of price list / special offer catalog cache for monitoring """
+    authentication_classes = [JWTAuthentication, BasicAuthentication, SessionAuthentication]
+    permission_classes = [partial(ValidatePermRest, model=PriceList)]
+
+    def get(self, request, *args, **kwargs):
+        return Response(catalog_stats(), status=status.HTTP_200_OK)
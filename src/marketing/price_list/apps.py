@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PriceListConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'marketing.price_list'
+
+    def ready(self):
+        import marketing.price_list.signals
@@ -0,0 +1,170 @@
+import json
+import threading
+from collections import OrderedDict, Counter
+from typing import NamedTuple
+
+import redis
+from django.apps import apps
+from django.db import transaction
+
+from app.logs import app_log
+from app.redis_db import redis_db, catalog_key, catalog_version_key, catalog_stats_key
+
+PRICE_LIST = 'price_list'
+SPECIAL_OFFER = 'special_offer'
+
+# Catalog in Redis is rebuilt at least this often even without invalidation
+CATALOG_TTL = 60 * 60
+# Catalogs kept in memory of each worker
+LOCAL_SIZE = 256
+# Push counters to Redis every N lookups
+STATS_FLUSH = 100
+
+
+class CatalogPrice(NamedTuple):
+    """ Same attributes as ProductPrice / SpecialOfferProduct used by pricing """
+    product_id: str
+    price: int
+    quantity_in_box: int
+    point: float
+    cashback: int = None
+    max_order_box: int = None
+
+
+class LocalCatalogs:
+    """ LRU of {(kind, catalog_id): (version, {product_id: CatalogPrice})} in this process """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None or item[0] != version:
+                return None
+            self.items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, version, prices):
+        with self.lock:
+            self.items[key] = (version, prices)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+local_catalogs = LocalCatalogs(LOCAL_SIZE)
+_stats = Counter()
+_pending_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+        _pending_stats[event] += 1
+        if sum(_pending_stats.values()) < STATS_FLUSH:
+            return
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+    try:
+        pipe = redis_db.pipeline()
+        for name, value in pending.items():
+            pipe.hincrby(catalog_stats_key(), name, value)
+        pipe.execute()
+    except redis.RedisError as e:
+        app_log.error(f"Error push catalog stats: {e}")
+
+
+def catalog_stats() -> dict:
+    """ Hit/miss counters of this process and of all workers (flushed part) """
+    with _stats_lock:
+        local = dict(_stats)
+    shared = dict()
+    try:
+        shared = {name: int(value) for name, value in redis_db.hgetall(catalog_stats_key()).items()}
+    except redis.RedisError as e:
+        app_log.error(f"Error get catalog stats: {e}")
+    return {'local': local, 'shared': shared, 'local_size': len(local_catalogs.items)}
+
+
+def build_catalog(kind, catalog_id) -> dict:
+    if kind == PRICE_LIST:
+        ProductPrice = apps.get_model('price_list', 'ProductPrice')
+        rows = (ProductPrice.objects.filter(price_list_id=catalog_id, product_id__isnull=False)
+                .values_list('product_id', 'price', 'quantity_in_box', 'point'))
+    else:
+        SpecialOfferProduct = apps.get_model('price_list', 'SpecialOfferProduct')
+        rows = (SpecialOfferProduct.objects.filter(special_offer_id=catalog_id, product_id__isnull=False)
+                .values_list('product_id', 'price', 'quantity_in_box', 'point', 'cashback', 'max_order_box'))
+    return {row[0]: CatalogPrice(*row) for row in rows}
+
+
+def get_catalog(kind, catalog_id) -> dict:
+    """
+    {product_id: CatalogPrice} of a price list or special offer.
+    Version from Redis decides, then local LRU, then Redis copy, build from database when missing.
+    """
+    if catalog_id is None:
+        return dict()
+    catalog_id = str(getattr(catalog_id, 'pk', catalog_id))
+    local_key = (kind, catalog_id)
+
+    version = None
+    try:
+        version = redis_db.get(catalog_version_key(kind, catalog_id)) or '0'
+        prices = local_catalogs.get(local_key, version)
+        if prices is not None:
+            _count('local_hit')
+            return prices
+        data = redis_db.get(catalog_key(kind, catalog_id, version))
+        if data:
+            prices = {row[0]: CatalogPrice(*row) for row in json.loads(data)}
+            local_catalogs.set(local_key, version, prices)
+            _count('redis_hit')
+            return prices
+    except redis.RedisError as e:
+        app_log.error(f"Error get catalog {kind} {catalog_id}: {e}")
+
+    _count('miss')
+    prices = build_catalog(kind, catalog_id)
+    if version is not None:
+        local_catalogs.set(local_key, version, prices)
+        try:
+            redis_db.setex(catalog_key(kind, catalog_id, version), CATALOG_TTL, json.dumps(list(prices.values())))
+        except redis.RedisError as e:
+            app_log.error(f"Error set catalog {kind} {catalog_id}: {e}")
+    return prices
+
+
+def get_price_list_prices(price_list_id) -> dict:
+    return get_catalog(PRICE_LIST, price_list_id)
+
+
+def get_special_offer_prices(special_offer_id) -> dict:
+    return get_catalog(SPECIAL_OFFER, special_offer_id)
+
+
+def _bump_versions(keys):
+    try:
+        pipe = redis_db.pipeline()
+        for kind, catalog_id in keys:
+            pipe.incr(catalog_version_key(kind, catalog_id))
+        pipe.execute()
+    except redis.RedisError as e:
+        app_log.error(f"Error invalidate catalog {keys}: {e}")
+
+
+def invalidate_catalog(kind, *catalog_ids):
+    """ Outdate catalogs now and again after commit, so a concurrent rebuild can't keep old data """
+    keys = [(kind, str(getattr(catalog_id, 'pk', catalog_id))) for catalog_id in catalog_ids if catalog_id]
+    if not keys:
+        return
+    _bump_versions(keys)
+    transaction.on_commit(lambda: _bump_versions(keys))
@@ -2,13 +2,13 @@ from datetime import datetime, timedelta
 
 from django.apps import apps
 from django.db import models
-from django.db.models import Q
+from django.db.models import Q, Sum
 from django.utils.timezone import make_aware
 
 from marketing.livestream.models import LiveStream
 from marketing.product.models import Product
 from utils.constants import so_type
-from utils.helpers import self_id
+from utils.helpers import insert_with_new_id
 
 
 # Create your models here.
@@ -27,19 +27,10 @@ class PriceList(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
-        if not self.pk:
-            char_id = "PL"
-            current_year = datetime.utcnow().year
-            two_digit_year = str(current_year)[-2:]
-            i = 1
-            while PriceList.objects.filter(id=f"{char_id}{two_digit_year}{i:04d}").exists():
-                i += 1
-            if i > 9999:
-                raise ValueError({'id': 'Out of index'})
-            _id = f"{char_id}{two_digit_year}{i:04d}"
-            self.id = _id
         if not self.status:
             self.status = 'active'
+        if not self.pk:
+            return insert_with_new_id(self, super().save, ('PL', 4), *args, **kwargs)
         return super().save(*args, **kwargs)
 
     def __str__(self):
@@ -88,13 +79,14 @@ class SpecialOffer(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
-        if not self.pk:
-            self.id = self_id('SO', SpecialOffer, 4, '%y%m')
+        new_pk = not self.pk
         if self.type_list == so_type.template:
             priority = self.priority
             while SpecialOffer.objects.filter(priority=priority).exists():
                 priority += 1
             self.priority = priority
+        if new_pk:
+            return insert_with_new_id(self, super().save, ('SO', 4, '%y%m'), *args, **kwargs)
         return super().save(*args, **kwargs)
 
 
@@ -135,7 +127,7 @@ def calculate_turnover(user, date):
         # & Q(Q(new_special_offer__isnull=True) & Q(new_special_offer__count_turnover=False))
     )
 
-    turnover = sum(order.order_price for order in orders_in_month if order.status != 'deactivate')
+    turnover = orders_in_month.exclude(status='deactivate').aggregate(turnover=Sum('order_price'))['turnover'] or 0
     print(f"Test user: {user.id} | {orders_in_month.count()} - {turnover}")
     sale_stat, created = SaleStatistic.objects.get_or_create(
         user=user,
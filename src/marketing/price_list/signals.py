@@ -0,0 +1,25 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .catalog import invalidate_catalog, PRICE_LIST, SPECIAL_OFFER
+from .models import PriceList, ProductPrice, SpecialOffer, SpecialOfferProduct
+
+
+@receiver([post_save, post_delete], sender=PriceList)
+def invalidate_price_list(sender, instance: PriceList, **kwargs):
+    invalidate_catalog(PRICE_LIST, instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ProductPrice)
+def invalidate_product_price(sender, instance: ProductPrice, **kwargs):
+    invalidate_catalog(PRICE_LIST, instance.price_list_id)
+
+
+@receiver([post_save, post_delete], sender=SpecialOffer)
+def invalidate_special_offer(sender, instance: SpecialOffer, **kwargs):
+    invalidate_catalog(SPECIAL_OFFER, instance.pk)
+
+
+@receiver([post_save, post_delete], sender=SpecialOfferProduct)
+def invalidate_special_offer_product(sender, instance: SpecialOfferProduct, **kwargs):
+    invalidate_catalog(SPECIAL_OFFER, instance.special_offer_id)
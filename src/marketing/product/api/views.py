@@ -5,7 +5,7 @@ from django.http import HttpResponse
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.response import Response
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 
 from account.handlers.validate_perm import ValidatePermRest
 from marketing.product.api.serializers import ProductTypeSerializer, ProductCateSerializer, RegistrationCertSerializer, \
@@ -1,7 +1,7 @@
 from django.db import models
 
 from marketing.company.models import Company
-from utils.helpers import normalize_vietnamese, self_id
+from utils.helpers import normalize_vietnamese, insert_with_new_id
 
 
 # Create your models here.
@@ -41,7 +41,7 @@ class RegistrationCert(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.pk or not self.id:
-            self.id = self_id('GDK', RegistrationCert, 4)
+            return insert_with_new_id(self, super().save, ('GDK', 4), *args, **kwargs)
         super().save(*args, **kwargs)
 
 
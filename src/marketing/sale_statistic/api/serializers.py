@@ -3,7 +3,6 @@ from django.db.models import Sum
 from rest_framework import serializers
 
 from account.handlers.restrict_serializer import BaseRestrictSerializer
-from marketing.order.models import OrderDetail
 from marketing.sale_statistic.models import SaleStatistic, SaleTarget, UserSaleStatistic, UsedTurnover
 from system_func.models import PeriodSeason
 from utils.constants import so_type
@@ -45,7 +44,7 @@ class UserSaleStatisticSerializer(serializers.ModelSerializer):
                                              )
                        # .exclude(new_special_offer__type_list=so_type.consider_user)
                        )
-            used_box = OrderDetail.objects.filter(order_id__in=user_so).aggregate(total_box=Sum('order_box'))
+            used_box = user_so.aggregate(total_box=Sum('total_box'))
             used_boxes =  used_box['total_box']
         representation['used_box'] = used_boxes
         return representation
@@ -4,21 +4,21 @@ import openpyxl
 import pandas as pd
 from django.db import transaction
 from django.db.models import Sum
-from django.http import HttpResponse
 from django.utils import timezone
 from openpyxl.utils import get_column_letter
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.response import Response
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 
 from account.handlers.validate_perm import ValidatePermRest
 from account.models import User
 from app.logs import app_log
-from marketing.order.models import OrderDetail
+from marketing.order.models import Order
 from marketing.sale_statistic.api.serializers import SaleStatisticSerializer, SaleMonthTargetSerializer, \
     UserSaleStatisticSerializer, UserUsedStatsSerializer
 from marketing.sale_statistic.models import SaleStatistic, SaleTarget, UserSaleStatistic, UsedTurnover
+from system_func.api.views import report_job_response
 from system_func.models import PeriodSeason
 from utils.helpers import local_time
 from utils.model_filter_paginate import filter_data
@@ -136,52 +136,50 @@ class ApiMainSaleStatistic(viewsets.GenericViewSet, mixins.ListModelMixin, mixin
             raise e
 
     def export_file(self, request, *args, **kwargs):
-        data = UserSaleStatistic.objects.all().order_by('user__id').values('user__id', 'turnover')
-
-        # Tạo Workbook mới
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "User Sale Statistics"
-
-        # Ghi tiêu đề cột
-        columns = ['MaKH', 'Doanh Số', 'Thùng ưu đãi đã dùng']
-        for col_num, column_title in enumerate(columns, 1):
-            column_letter = get_column_letter(col_num)
-            sheet[f'{column_letter}1'] = column_title
-
-        current_season: PeriodSeason = PeriodSeason.get_period_by_date('turnover')
-
-        for row_num, instance in enumerate(data, 2):
-            user_id = instance['user__id']
-            turnover = instance['turnover']
-
-            # Lấy đối tượng User
-            try:
-                user = User.objects.get(id=user_id)
-            except User.DoesNotExist:
-                continue
-
-            # Lấy dữ liệu used_box cho user
-            user_so = user.order_set.filter(
-                is_so=True,
-                date_get__gte=current_season.from_date,
-                date_get__lte=current_season.to_date
-            )
-
-            used_box = OrderDetail.objects.filter(order_id__in=user_so).aggregate(total_box=Sum('order_box'))
-
-            sheet[f'A{row_num}'] = user.id  # Cột MaKH
-            sheet[f'B{row_num}'] = turnover  # Cột Doanh Số
-            sheet[f'C{row_num}'] = used_box['total_box'] or 0  # Cột Used Box
-
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        )
-        response['Content-Disposition'] = 'attachment; filename=user_sale_statistics.xlsx'
-
-        workbook.save(response)
-
-        return response
+        return report_job_response(request, 'sale_statistics', {})
+
+
+def export_sale_statistic_context(params):
+    """ Used boxes are counted in the turnover season of today """
+    current_season = PeriodSeason.get_period_by_date('turnover')
+    return {'season': current_season.id if current_season else None}
+
+
+def export_sale_statistic_file(params, output):
+    data = UserSaleStatistic.objects.all().order_by('user__id').values('user__id', 'turnover')
+
+    # Tạo Workbook mới
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "User Sale Statistics"
+
+    # Ghi tiêu đề cột
+    columns = ['MaKH', 'Doanh Số', 'Thùng ưu đãi đã dùng']
+    for col_num, column_title in enumerate(columns, 1):
+        column_letter = get_column_letter(col_num)
+        sheet[f'{column_letter}1'] = column_title
+
+    current_season: PeriodSeason = PeriodSeason.get_period_by_date('turnover')
+
+    # Thùng ưu đãi đã dùng trong kỳ của tất cả user trong 1 query
+    used_boxes = dict(Order.objects.filter(
+        is_so=True,
+        date_get__gte=current_season.from_date,
+        date_get__lte=current_season.to_date
+    ).values('client_id').annotate(total_box=Sum('total_box')).values_list('client_id', 'total_box'))
+
+    row_num = 2
+    for instance in data:
+        user_id = instance['user__id']
+        if user_id is None:
+            continue
+        sheet[f'A{row_num}'] = user_id  # Cột MaKH
+        sheet[f'B{row_num}'] = instance['turnover']  # Cột Doanh Số
+        sheet[f'C{row_num}'] = used_boxes.get(user_id) or 0  # Cột Used Box
+        row_num += 1
+
+    workbook.save(output)
+    return 'user_sale_statistics.xlsx'
 
 
 class ApiUserUsedStatistic(viewsets.GenericViewSet, mixins.ListModelMixin):
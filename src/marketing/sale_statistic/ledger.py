@@ -0,0 +1,255 @@
+import time
+from collections import defaultdict
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import Sum, F
+
+from app.logs import app_log
+from marketing.order.models import Order, create_or_get_sale_stats_user
+from marketing.sale_statistic.models import TurnoverLedger, SaleStatistic, SaleTarget
+from system_func.models import PeriodSeason
+
+BATCH_SIZE = 2000
+
+
+def month_targets(months) -> dict:
+    """ {month: month_target}, create missing SaleTarget with default target same as before """
+    months = set(months)
+    targets = dict()
+    for month, target in SaleTarget.objects.filter(month__in=months).order_by('id').values_list('month', 'month_target'):
+        targets.setdefault(month, target)
+    for month in months - targets.keys():
+        targets[month] = SaleTarget.objects.create(month=month).month_target
+    return targets
+
+
+def order_turnover(order_ids) -> dict:
+    """
+    Current contribution of orders: {order_id: (user_id, month, credit, debit)}
+    credit is turnover of active order, debit is used turnover of special offer boxes.
+    """
+    orders = list(Order.objects.filter(id__in=list(order_ids), client_id__isnull=False, date_get__isnull=False)
+                  .values_list('id', 'client_id', 'date_get', 'status', 'is_so', 'new_special_offer__target',
+                               'order_price', 'total_box'))
+    targets = month_targets(order[2].replace(day=1) for order in orders)
+
+    result = dict()
+    for order_id, user_id, date_get, status, is_so, so_target, order_price, total_box in orders:
+        month = date_get.replace(day=1)
+        credit = 0 if status == 'deactivate' else int(order_price or 0)
+        debit = 0
+        if is_so:
+            target = so_target if so_target and so_target > 0 else targets[month]
+            debit = round((total_box or 0) * target)
+        result[order_id] = (user_id, month, credit, debit)
+    return result
+
+
+def posted_turnover(order_ids) -> dict:
+    """ Sum of ledger entries: {order_id: {(user_id, month): (credit, debit)}} """
+    result = defaultdict(dict)
+    rows = (TurnoverLedger.objects.filter(order_id__in=list(order_ids)).values('order_id', 'user_id', 'month')
+            .annotate(credit=Sum('credit'), debit=Sum('debit')))
+    for row in rows:
+        result[row['order_id']][(row['user_id'], row['month'])] = (row['credit'], row['debit'])
+    return result
+
+
+def record_order_turnover(order_ids, reason='order', apply_balance=True):
+    """
+    Post the difference between current order turnover and ledger as new entries.
+    Deleted orders are reversed, order moved to other month is reversed in old month.
+    Balances are changed by the posted deltas only, O(1) per order event.
+    """
+    order_ids = [order_id for order_id in order_ids if order_id]
+    current = order_turnover(order_ids)
+    posted = posted_turnover(order_ids)
+
+    entries = list()
+    balance_deltas = defaultdict(lambda: [0, 0])
+    for order_id in order_ids:
+        wanted = dict()
+        if order_id in current:
+            user_id, month, credit, debit = current[order_id]
+            wanted[(user_id, month)] = (credit, debit)
+        order_posted = posted.get(order_id, dict())
+        for key in wanted.keys() | order_posted.keys():
+            credit, debit = wanted.get(key, (0, 0))
+            posted_credit, posted_debit = order_posted.get(key, (0, 0))
+            delta_credit, delta_debit = credit - posted_credit, debit - posted_debit
+            if not delta_credit and not delta_debit:
+                continue
+            user_id, month = key
+            entries.append(TurnoverLedger(user_id=user_id, order_id=order_id, month=month, credit=delta_credit,
+                                          debit=delta_debit, reason=reason))
+            balance_deltas[key][0] += delta_credit
+            balance_deltas[key][1] += delta_debit
+
+    with transaction.atomic():
+        TurnoverLedger.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+        if apply_balance:
+            apply_balance_deltas(balance_deltas)
+    return entries
+
+
+def apply_balance_deltas(balance_deltas: dict):
+    """ Add {(user_id, month): [credit, debit]} to SaleStatistic, then refresh carry over of later months """
+    if not balance_deltas:
+        return
+    ensure_month_stats(balance_deltas.keys())
+    first_months = dict()
+    for (user_id, month), (credit, debit) in balance_deltas.items():
+        SaleStatistic.objects.filter(user_id=user_id, month=month).update(
+            total_turnover=F('total_turnover') + credit,
+            used_turnover=F('used_turnover') + debit,
+            available_turnover=F('available_turnover') + credit - debit,
+        )
+        first_months[user_id] = min(month, first_months.get(user_id, month))
+    for user_id, month in first_months.items():
+        refresh_carry_over(user_id, month)
+
+
+def ensure_month_stats(keys):
+    keys = set(keys)
+    users = {user_id for user_id, _ in keys}
+    months = {month for _, month in keys}
+    existed = set(SaleStatistic.objects.filter(user_id__in=users, month__in=months).values_list('user_id', 'month'))
+    SaleStatistic.objects.bulk_create([SaleStatistic(user_id=user_id, month=month) for user_id, month in keys - existed],
+                                      ignore_conflicts=True)
+
+
+def period_start():
+    current_period = PeriodSeason.get_period_by_date('turnover')
+    return current_period.from_date.replace(day=1) if current_period else None
+
+
+def carry_over(last_month_turnover, month_target):
+    """ bonus_turnover = last_month % month_target """
+    if not month_target:
+        return 0
+    return last_month_turnover % month_target
+
+
+def refresh_carry_over(user_id, from_month):
+    """
+    Recompute bonus_turnover from previous month stored balance for from_month and later months of user.
+    Usually only from_month itself, later months when an order of past month changed.
+    """
+    start = period_start()
+    with transaction.atomic():
+        stats = {stat.month: stat for stat in SaleStatistic.objects.select_for_update().filter(
+            user_id=user_id, month__gte=from_month - relativedelta(months=1)).order_by('month')}
+        months = sorted(month for month in stats if month >= from_month)
+        targets = month_targets(months)
+        changed = list()
+        for month in months:
+            stat = stats[month]
+            last_month = month - relativedelta(months=1)
+            last_stat = stats.get(last_month)
+            last_month_turnover = 0
+            if last_stat is not None and (start is None or last_month >= start):
+                last_month_turnover = last_stat.available_turnover
+            bonus = carry_over(last_month_turnover, targets[month])
+            if bonus == stat.bonus_turnover and last_month_turnover == stat.last_month_turnover:
+                continue
+            stat.total_turnover += bonus - stat.bonus_turnover
+            stat.available_turnover += bonus - stat.bonus_turnover
+            stat.bonus_turnover = bonus
+            stat.last_month_turnover = last_month_turnover
+            changed.append(stat)
+        # bulk_update skip SaleStatistic.save, bonus diff is already applied
+        SaleStatistic.objects.bulk_update(changed, ['total_turnover', 'available_turnover', 'bonus_turnover',
+                                                    'last_month_turnover'])
+
+
+def get_month_stats(user, month) -> SaleStatistic:
+    """ Balance of user in month from ledger, create empty balance with carry over when missing """
+    stats = SaleStatistic.objects.filter(user=user, month=month).first()
+    if stats is None:
+        ensure_month_stats([(user.id, month)])
+        refresh_carry_over(user.id, month)
+        stats = SaleStatistic.objects.get(user=user, month=month)
+    return stats
+
+
+def seed_ledger(start=None):
+    """ Post entries of orders from start month which are not in ledger yet """
+    start = start or period_start()
+    orders = Order.objects.filter(client_id__isnull=False, date_get__isnull=False)
+    if start:
+        orders = orders.filter(date_get__gte=start)
+    order_ids = set(orders.values_list('id', flat=True)) - set(
+        TurnoverLedger.objects.values_list('order_id', flat=True).distinct())
+    order_ids = sorted(order_ids)
+    for i in range(0, len(order_ids), BATCH_SIZE):
+        record_order_turnover(order_ids[i:i + BATCH_SIZE], reason='rebuild', apply_balance=False)
+    return len(order_ids)
+
+
+def replay_ledger(user_ids=None, start=None):
+    """ Rebuild SaleStatistic balances from start month by summing ledger, minus_turnover is kept """
+    start = start or period_start()
+    ledger = TurnoverLedger.objects.filter(user_id__isnull=False)
+    stats = SaleStatistic.objects.filter(user_id__isnull=False)
+    if start:
+        ledger = ledger.filter(month__gte=start)
+        stats = stats.filter(month__gte=start)
+    if user_ids is not None:
+        ledger = ledger.filter(user_id__in=list(user_ids))
+        stats = stats.filter(user_id__in=list(user_ids))
+
+    sums = {(row['user_id'], row['month']): (row['credit'], row['debit'])
+            for row in ledger.values('user_id', 'month').annotate(credit=Sum('credit'), debit=Sum('debit'))}
+    ensure_month_stats(sums.keys())
+    stats = list(stats.order_by('user_id', 'month'))
+    targets = month_targets({stat.month for stat in stats})
+
+    balances = dict()
+    for stat in stats:
+        credit, debit = sums.get((stat.user_id, stat.month), (0, 0))
+        last_stat = balances.get((stat.user_id, stat.month - relativedelta(months=1)))
+        last_month_turnover = last_stat.available_turnover if last_stat is not None else 0
+        stat.last_month_turnover = last_month_turnover
+        stat.bonus_turnover = carry_over(last_month_turnover, targets[stat.month])
+        stat.total_turnover = credit - stat.minus_turnover + stat.bonus_turnover
+        stat.used_turnover = debit
+        stat.available_turnover = stat.total_turnover - stat.used_turnover
+        balances[(stat.user_id, stat.month)] = stat
+    SaleStatistic.objects.bulk_update(stats, ['last_month_turnover', 'bonus_turnover', 'total_turnover',
+                                              'used_turnover', 'available_turnover'], batch_size=BATCH_SIZE)
+    return balances
+
+
+def verify_ledger(balances: dict, sample=None):
+    """
+    Compare ledger balances with old recursive create_or_get_sale_stats_user.
+    Recursive result is computed in a rolled back savepoint, return list of mismatches.
+    """
+    mismatches = list()
+    keys = sorted(balances)[:sample] if sample else sorted(balances)
+    for user_id, month in keys:
+        stat = balances[(user_id, month)]
+        with transaction.atomic():
+            savepoint = transaction.savepoint()
+            legacy = create_or_get_sale_stats_user(stat.user, month)
+            legacy_values = (legacy.total_turnover, legacy.used_turnover, legacy.available_turnover) if legacy else None
+            transaction.savepoint_rollback(savepoint)
+        ledger_values = (stat.total_turnover, stat.used_turnover, stat.available_turnover)
+        if legacy_values is not None and legacy_values != ledger_values:
+            mismatches.append({'user': user_id, 'month': month, 'ledger': ledger_values, 'recursive': legacy_values})
+    return mismatches
+
+
+def rebuild_turnover_ledger(user_ids=None, verify=True, sample=None):
+    """ Seed missing order entries, replay ledger to balances and verify with recursive result """
+    start_time = time.time()
+    with transaction.atomic():
+        seeded = seed_ledger()
+        balances = replay_ledger(user_ids)
+    app_log.info(f"Rebuild turnover ledger: {seeded} orders seeded, {len(balances)} balances "
+                 f"in {time.time() - start_time}")
+    mismatches = verify_ledger(balances, sample) if verify else []
+    for mismatch in mismatches:
+        app_log.info(f"Turnover mismatch: {mismatch}")
+    return balances, mismatches
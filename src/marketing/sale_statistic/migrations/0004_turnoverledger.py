@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sale_statistic', '0003_usersalestatistic_usedturnover'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TurnoverLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.CharField(max_length=24)),
+                ('month', models.DateField()),
+                ('credit', models.BigIntegerField(default=0)),
+                ('debit', models.BigIntegerField(default=0)),
+                ('reason', models.CharField(choices=[('order', 'tạo toa'), ('order_update', 'sửa toa'), ('order_delete', 'xoá toa'), ('rebuild', 'đồng bộ lại')], max_length=24)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='turnover_ledger', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['order_id'], name='turnover_ledger_order_idx'),
+                    models.Index(fields=['user', 'month'], name='turnover_ledger_user_idx'),
+                ],
+            },
+        ),
+    ]
@@ -123,3 +123,25 @@ class UsedTurnover(models.Model):
     note = models.TextField(null=True)
 
     created_at = models.DateField(auto_now_add=True)
+
+
+class TurnoverLedger(models.Model):
+    """
+    Append-only turnover entries of orders, never updated or deleted.
+    Sum of entries of an order is its current turnover (credit) and used turnover (debit) in month,
+    SaleStatistic keeps the running monthly balance of entries.
+    """
+    user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='turnover_ledger')
+    order_id = models.CharField(max_length=24)
+    month = models.DateField()
+    credit = models.BigIntegerField(default=0)
+    debit = models.BigIntegerField(default=0)
+    reason = models.CharField(max_length=24, choices=(('order', 'tạo toa'), ('order_update', 'sửa toa'),
+                                                      ('order_delete', 'xoá toa'), ('rebuild', 'đồng bộ lại')))
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order_id'], name='turnover_ledger_order_idx'),
+            models.Index(fields=['user', 'month'], name='turnover_ledger_user_idx'),
+        ]
@@ -3,7 +3,7 @@ from functools import partial
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.response import Response
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 
 from account.handlers.validate_perm import ValidatePermRest
 from system.file_upload.api.serializers import FileUploadSerializer, ContentFileSerialier, FileProductSerializer, \
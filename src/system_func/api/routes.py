@@ -1,6 +1,6 @@
 from django.urls import path
 
-from system_func.api.views import ApiPeriodSeason, ApiSystemConfig
+from system_func.api.views import ApiPeriodSeason, ApiSystemConfig, ApiReportJob, ApiReportDownload
 from utils.constants import actions_detail, actions_views
 
 app_name = 'system_func'
@@ -17,4 +17,7 @@ urlpatterns = [
 
     path('period/', period_season_views, name='api_period_season_views'),
     path('period/<pk>', period_season_details, name='api_period_season_details'),
+
+    path('report/<job_id>', ApiReportJob.as_view(), name='api_report_job'),
+    path('report/<job_id>/download', ApiReportDownload.as_view(), name='api_report_download'),
 ]
@@ -1,14 +1,22 @@
+import os
 from functools import partial
 
+from django.apps import apps
+from django.http import FileResponse
+from django.urls import reverse
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.views import APIView
+from account.authentication import JWTAuthentication
 
-from account.handlers.validate_perm import ValidatePermRest
+from account.handlers.perms import get_perm_name
+from account.handlers.validate_perm import ValidatePermRest, check_perm
 from system_func.api.serializers import PeriodSeasonSerializer, SystemConfigSerializer
 from system_func.models import PeriodSeason, SystemConfig
+from system_func.reports import get_report_job, report_file_path, submit_report, REPORTS, CONTENT_TYPES
+from utils.constants import perm_actions
 from utils.model_filter_paginate import filter_data
 
 
@@ -51,3 +59,71 @@ class ApiSystemConfig(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.Cre
         response = filter_data(self, request, ['name', 'id'],
                                **kwargs)
         return Response(response, status.HTTP_200_OK)
+
+
+def report_job_data(request, job_id, state):
+    data = {
+        'job_id': job_id,
+        'kind': state.get('kind'),
+        'status': state.get('status'),
+        'cached': bool(int(state.get('cached') or 0)),
+        'created_at': state.get('created_at'),
+        'finished_at': state.get('finished_at') or None,
+        'status_url': request.build_absolute_uri(
+            reverse('api_routes:api_system_func:api_report_job', kwargs={'job_id': job_id})),
+    }
+    if state.get('status') == 'done':
+        data['filename'] = state.get('filename')
+        data['download_url'] = request.build_absolute_uri(
+            reverse('api_routes:api_system_func:api_report_download', kwargs={'job_id': job_id}))
+    if state.get('status') == 'failed':
+        data['message'] = state.get('message')
+    return data
+
+
+def can_view_report(user, kind_name):
+    """ Job id alone does not give access: status and file need view perm of the report permission model """
+    kind = REPORTS.get(kind_name)
+    if kind is None:
+        return False
+    perm_name = get_perm_name(apps.get_model(kind.perm_model))
+    return check_perm(user, f"{perm_actions['view']}_{perm_name}", perm_name)
+
+
+def report_job_response(request, kind, params):
+    """ Export endpoints submit their report, file is downloaded from download_url when status is done """
+    if not can_view_report(request.user, kind):
+        return Response({'message': 'bạn không đủ quyền để xem báo cáo này'}, status=status.HTTP_403_FORBIDDEN)
+    state = submit_report(kind, params, getattr(request.user, 'id', None))
+    data = report_job_data(request, state['job_id'], state)
+    return Response(data, status=status.HTTP_200_OK if data['status'] == 'done' else status.HTTP_202_ACCEPTED)
+
+
+class ApiReportJob(APIView):
+    authentication_classes = [JWTAuthentication, BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        state = get_report_job(job_id)
+        if state is None:
+            return Response({'message': f'report job {job_id} not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not can_view_report(request.user, state.get('kind')):
+            return Response({'message': 'bạn không đủ quyền để xem báo cáo này'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(report_job_data(request, job_id, state), status=status.HTTP_200_OK)
+
+
+class ApiReportDownload(APIView):
+    authentication_classes = [JWTAuthentication, BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        state = get_report_job(job_id)
+        if state is None or state.get('status') != 'done':
+            return Response({'message': f'report job {job_id} is not done'}, status=status.HTTP_404_NOT_FOUND)
+        if not can_view_report(request.user, state.get('kind')):
+            return Response({'message': 'bạn không đủ quyền để xem báo cáo này'}, status=status.HTTP_403_FORBIDDEN)
+        path = report_file_path(state)
+        if not os.path.exists(path):
+            return Response({'message': f'report file of {job_id} expired'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=state.get('filename') or None,
+                            content_type=CONTENT_TYPES[REPORTS[state['kind']].extension])
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SystemFuncConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'system_func'
+
+    def ready(self):
+        from system_func.reports import connect_report_signals
+        connect_report_signals()
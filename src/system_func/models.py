@@ -42,7 +42,6 @@ class PointOfSeason(models.Model):
 
     def auto_point(self):
         Order = apps.get_model('order', 'Order')
-        OrderDetail = apps.get_model('order', 'OrderDetail')
         current_period = PeriodSeason.objects.filter(type='point', period='current').first()
         start_date = current_period.from_date
         end_date = current_period.to_date
@@ -51,9 +50,7 @@ class PointOfSeason(models.Model):
                        .exclude(status='deactivate'))
         user_orders = (Order.objects.filter(Q(Q(client_id=self.user) & Q(date_get__range=(start_date, end_date))))
                        .exclude(status='deactivate'))
-        order_details = OrderDetail.objects.filter(order_id__in=user_orders)
-
-        total_points = order_details.aggregate(total_point=Sum('point_get'))['total_point'] or 0
+        total_points = user_orders.aggregate(total_point=Sum('order_point'))['total_point'] or 0
 
         print(f"Total points: {self.user} {total_points}")
         self.point = total_points
@@ -0,0 +1,246 @@
+"""
+Background report (export file) jobs.
+An export is submitted with its parameters, built by a Celery worker and saved under MEDIA_ROOT/reports.
+Artifact is keyed by hash of (kind, params, context, data version of its tables): identical requests reuse the
+file until one of the tables changes, or its context (day of export, current season) does.
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import NamedTuple
+
+import redis
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils.module_loading import import_string
+
+from app.logs import app_log
+from app.redis_db import redis_db, report_job_key, report_artifact_key, report_version_key
+from system_func.tasks import run_report_job_task
+
+REPORT_DIR = 'reports'
+# Job state and artifact index live as long as files are kept
+REPORT_TTL = 60 * 60 * 24 * 7
+CONTENT_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'zip': 'application/zip',
+}
+
+
+class ReportKind(NamedTuple):
+    # builder(params: dict, output: binary file) -> file name
+    builder: str
+    # Tables the file is built from, change on any of them makes new artifact
+    models: tuple
+    # Model whose view perm is required to read status and file of the job
+    perm_model: str
+    extension: str = 'xlsx'
+    # context(params) -> dict of what else the file depends on (date, current season), hashed with params
+    context: str = None
+
+
+REPORTS = {
+    'orders': ReportKind('marketing.order.api.views.export_orders_file',
+                         ('order.Order', 'order.OrderDetail', 'product.Product', 'client_profile.ClientProfile',
+                          'employee_profile.EmployeeProfile'), 'order.Order',
+                         context='system_func.reports.report_date'),
+    'season_stats': ReportKind('marketing.order.api.views.export_season_stats_file',
+                               ('order.SeasonalStatistic', 'order.SeasonalStatisticUser',
+                                'client_profile.ClientProfile', 'employee_profile.EmployeeProfile'),
+                               'order.SeasonalStatistic'),
+    'event_numbers': ReportKind('marketing.pick_number.api.views.export_event_number_file',
+                                ('pick_number.EventNumber', 'pick_number.NumberList', 'pick_number.UserJoinEvent',
+                                 'pick_number.NumberSelected'), 'pick_number.EventNumber'),
+    'event_number_users': ReportKind('marketing.pick_number.api.views.export_event_number_user_file',
+                                     ('pick_number.EventNumber', 'pick_number.UserJoinEvent',
+                                      'pick_number.NumberSelected', 'pick_number.NumberList',
+                                      'client_profile.ClientProfile', 'employee_profile.EmployeeProfile'),
+                                     'pick_number.EventNumber'),
+    'live_report': ReportKind('marketing.livestream.api.views.export_live_report_file',
+                              ('livestream.LiveStream', 'livestream.LiveStreamStatistic',
+                               'livestream.LiveStreamOfferRegister', 'livestream.LiveStreamTracking',
+                               'livestream.LiveStreamComment', 'account.PhoneNumber', 'client_profile.ClientProfile',
+                               'employee_profile.EmployeeProfile'), 'livestream.LiveStream'),
+    'price_list_products': ReportKind('marketing.price_list.api.views.export_price_list_products_file',
+                                      ('price_list.PriceList', 'price_list.ProductPrice', 'product.Product'),
+                                      'price_list.PriceList'),
+    'price_list_users': ReportKind('marketing.price_list.api.views.export_price_list_users_file',
+                                   ('price_list.PriceList', 'account.Perm', 'account.UserPerm',
+                                    'account.UserGroupPerm', 'account.GroupPermPerms'), 'price_list.PriceList'),
+    'sale_statistics': ReportKind('marketing.sale_statistic.api.views.export_sale_statistic_file',
+                                  ('sale_statistic.UserSaleStatistic', 'order.Order', 'system_func.PeriodSeason'),
+                                  'sale_statistic.UserSaleStatistic',
+                                  context='marketing.sale_statistic.api.views.export_sale_statistic_context'),
+    'event_certificates': ReportKind('marketing.pick_number.certificates.export_event_certificates_file',
+                                     ('pick_number.EventNumber', 'pick_number.UserJoinEvent',
+                                      'pick_number.NumberSelected', 'client_profile.ClientProfile'),
+                                     'pick_number.EventNumber', 'zip'),
+    'users': ReportKind('account.api.views.export_users_file',
+                        ('account.User', 'account.PhoneNumber', 'account.UserGroupPerm', 'account.GroupPerm',
+                         'client_profile.ClientProfile', 'employee_profile.EmployeeProfile'), 'account.User'),
+}
+
+
+def report_tables(kind):
+    return sorted({apps.get_model(label)._meta.db_table for label in REPORTS[kind].models})
+
+
+def bump_report_version(table):
+    try:
+        redis_db.incr(report_version_key(table))
+    except redis.RedisError as e:
+        app_log.error(f"Error bump report version {table}: {e}")
+
+
+def _table_changed(sender, **kwargs):
+    table = sender._meta.db_table
+    transaction.on_commit(lambda: bump_report_version(table))
+
+
+def connect_report_signals():
+    """ ORM writes of report tables bump their version right after commit (called in SystemFuncConfig.ready) """
+    labels = {label for kind in REPORTS.values() for label in kind.models}
+    for label in labels:
+        model = apps.get_model(label)
+        post_save.connect(_table_changed, sender=model, dispatch_uid=f'report_version_save_{label}')
+        post_delete.connect(_table_changed, sender=model, dispatch_uid=f'report_version_delete_{label}')
+
+
+def data_version(tables) -> dict:
+    """
+    Version of each table: Redis counter bumped by ORM signals, plus Postgres row modification counter
+    which also sees bulk_create/bulk_update, queryset update/delete and raw SQL.
+    """
+    versions = dict(zip(tables, redis_db.mget([report_version_key(table) for table in tables])))
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relname, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables "
+                           "WHERE relname = ANY(%s)", (list(tables),))
+            for table, modified in cursor.fetchall():
+                versions[table] = f"{versions.get(table) or 0}:{modified}"
+    return versions
+
+
+def report_date(params) -> dict:
+    """ Context of reports which print date of export """
+    return {'date': datetime.now().date()}
+
+
+def report_hash(kind, params: dict) -> str:
+    context = REPORTS[kind].context
+    payload = json.dumps({'kind': kind, 'params': params,
+                          'context': import_string(context)(params) if context else None,
+                          'version': data_version(report_tables(kind))},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def set_report_job(job_id, **state):
+    key = report_job_key(job_id)
+    redis_db.hset(key, mapping={name: '' if value is None else value for name, value in state.items()})
+    redis_db.expire(key, REPORT_TTL)
+
+
+def get_report_job(job_id):
+    return redis_db.hgetall(report_job_key(job_id)) or None
+
+
+def report_file_path(state):
+    return os.path.join(settings.MEDIA_ROOT, state['file']) if state and state.get('file') else None
+
+
+def _reusable(state):
+    if not state:
+        return False
+    if state.get('status') in ('pending', 'running'):
+        return True
+    path = report_file_path(state)
+    return state.get('status') == 'done' and path is not None and os.path.exists(path)
+
+
+def submit_report(kind, params: dict, user_id=None) -> dict:
+    """ Return job state of report, reuse job of same kind/params/data version when it is running or done """
+    if kind not in REPORTS:
+        raise ValueError(f"report {kind} không tồn tại")
+    params = {name: value for name, value in params.items() if value not in (None, '')}
+    digest = report_hash(kind, params)
+    artifact_key = report_artifact_key(digest)
+
+    job_id = redis_db.get(artifact_key)
+    state = get_report_job(job_id) if job_id else None
+    if _reusable(state):
+        state['job_id'] = job_id
+        state['cached'] = 1
+        return state
+
+    job_id = uuid.uuid4().hex
+    # Another request of same hash may win, then reuse its job
+    if not redis_db.set(artifact_key, job_id, ex=REPORT_TTL, nx=True):
+        other_id = redis_db.get(artifact_key)
+        other = get_report_job(other_id) if other_id else None
+        if _reusable(other):
+            other['job_id'] = other_id
+            other['cached'] = 1
+            return other
+        redis_db.set(artifact_key, job_id, ex=REPORT_TTL)
+
+    set_report_job(job_id, kind=kind, params=json.dumps(params, default=str), hash=digest, status='pending',
+                   created_by=user_id, created_at=datetime.now().isoformat())
+    run_report_job_task.delay(job_id)
+    state = get_report_job(job_id)
+    state['job_id'] = job_id
+    state['cached'] = 0
+    return state
+
+
+def run_report_job(job_id):
+    """ Celery worker: build file of job into MEDIA_ROOT/reports/<kind>/<hash>.<ext> """
+    state = get_report_job(job_id)
+    if state is None:
+        app_log.error(f"Report job {job_id} not found")
+        return None
+    kind = REPORTS[state['kind']]
+    relative_path = os.path.join(REPORT_DIR, state['kind'], f"{state['hash']}.{kind.extension}")
+    path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    tmp_path = f"{path}.{job_id}.tmp"
+    start_time = time.time()
+    try:
+        set_report_job(job_id, status='running', started_at=datetime.now().isoformat())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        builder = import_string(kind.builder)
+        with open(tmp_path, 'wb') as output:
+            filename = builder(json.loads(state['params']), output)
+        os.replace(tmp_path, path)
+        set_report_job(job_id, status='done', file=relative_path, filename=filename, size=os.path.getsize(path),
+                       duration=round(time.time() - start_time, 2), finished_at=datetime.now().isoformat())
+        return relative_path
+    except Exception as e:
+        app_log.error(f"Error report job {job_id} ({state['kind']}): {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            set_report_job(job_id, status='failed', message=f"{e}", finished_at=datetime.now().isoformat())
+            # Next submit of same params builds again
+            redis_db.delete(report_artifact_key(state['hash']))
+        except redis.RedisError:
+            pass
+        raise e
+
+
+def clean_report_files(max_age=REPORT_TTL):
+    """ Remove artifacts older than max_age seconds, their jobs are expired in Redis too """
+    root = os.path.join(settings.MEDIA_ROOT, REPORT_DIR)
+    removed = 0
+    now = time.time()
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed += 1
+    return removed
@@ -0,0 +1,13 @@
+from celery import shared_task
+
+
+@shared_task
+def run_report_job_task(job_id):
+    from system_func.reports import run_report_job
+    return run_report_job(job_id)
+
+
+@shared_task
+def clean_report_files_task():
+    from system_func.reports import clean_report_files
+    return clean_report_files()
@@ -1,3 +1,47 @@
-from django.test import TestCase
+import os
+import tempfile
+import uuid
+
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from account.models import User, Perm, UserPerm
+from account.perm_cache import invalidate_user_perms
+from app.redis_db import redis_db, report_job_key
+from system_func.api.views import ApiReportJob, ApiReportDownload
+from system_func.reports import set_report_job
+
+VIEW_PERM = 'view_account_user'
+
 
 # Create your tests here.
+class ReportJobPermTest(TestCase):
+    def setUp(self):
+        self.user, = User.objects.bulk_create([User(id='TESTRPT01', username='TESTRPT01', password='!',
+                                                    user_type='employee', status='active')])
+        invalidate_user_perms(self.user.id)
+        Perm.objects.create(name=VIEW_PERM)
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        os.makedirs(os.path.join(media_root, 'reports', 'users'))
+        with open(os.path.join(media_root, 'reports', 'users', 'test.xlsx'), 'wb') as output:
+            output.write(b'data')
+        self.job_id = uuid.uuid4().hex
+        set_report_job(self.job_id, kind='users', status='done', file='reports/users/test.xlsx',
+                       filename='users.xlsx')
+        self.addCleanup(redis_db.delete, report_job_key(self.job_id))
+
+    def request(self, view):
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=User.objects.get(id=self.user.id))
+        return view.as_view()(request, job_id=self.job_id)
+
+    def test_job_needs_view_perm_of_report(self):
+        self.assertEqual(self.request(ApiReportJob).status_code, 403)
+        self.assertEqual(self.request(ApiReportDownload).status_code, 403)
+
+        UserPerm.objects.create(user=self.user, perm_id=VIEW_PERM, allow=True)
+        self.assertEqual(self.request(ApiReportJob).status_code, 200)
+        response = self.request(ApiReportDownload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'data')
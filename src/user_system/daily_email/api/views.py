@@ -5,7 +5,7 @@ from rest_framework import mixins, viewsets, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from account.authentication import JWTAuthentication
 
 from account.handlers.validate_perm import ValidatePermRest
 from user_system.daily_email.api.serializers import EmailDetailSerializer, UserGetMailSerializer, \
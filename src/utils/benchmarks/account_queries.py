@@ -0,0 +1,58 @@
+"""
+Benchmark permission raw SQL with Django managed connection vs new psycopg2 connection per call.
+Run in shell: python manage.py shell -c "from utils.benchmarks.account_queries import run; run()"
+"""
+import time
+
+import psycopg2
+from django.db import connection
+
+from account.models import User
+from account.queries import get_all_user_perms_sql, get_user_perm_names, get_users_perm_names
+from utils.env import PGS_DB, PGS_PASSWORD, PGS_USER, PGS_HOST, PGS_PORT
+
+
+def connect_per_call(user_id):
+    """ Old behavior: open, query and close connection each call """
+    conn = psycopg2.connect(dbname=PGS_DB, user=PGS_USER, password=PGS_PASSWORD, host=PGS_HOST, port=PGS_PORT)
+    cur = conn.cursor()
+    cur.execute("SELECT perm_id FROM users_user_perm WHERE user_id = %s", (user_id,))
+    cur.fetchall()
+    cur.close()
+    conn.close()
+
+
+def managed_connection(user_id):
+    with connection.cursor() as cur:
+        cur.execute("SELECT perm_id FROM users_user_perm WHERE user_id = %s", (user_id,))
+        cur.fetchall()
+
+
+def timing(func, user_ids):
+    start_time = time.time()
+    for user_id in user_ids:
+        func(user_id)
+    return time.time() - start_time
+
+
+def run(amount=200):
+    user_ids = list(User.objects.values_list('id', flat=True)[:amount])
+    if not user_ids:
+        print("No user to benchmark")
+        return
+
+    per_call = timing(connect_per_call, user_ids)
+    managed = timing(managed_connection, user_ids)
+    perms_sql = timing(get_all_user_perms_sql, user_ids)
+    perm_names = timing(get_user_perm_names, user_ids)
+    start_time = time.time()
+    get_users_perm_names(user_ids)
+    bulk_names = time.time() - start_time
+
+    print(f"Users: {len(user_ids)}")
+    print(f"New connection per call: {per_call:.3f}s ({per_call / len(user_ids) * 1000:.2f}ms/call)")
+    print(f"Managed connection: {managed:.3f}s ({managed / len(user_ids) * 1000:.2f}ms/call)")
+    print(f"get_all_user_perms_sql: {perms_sql:.3f}s ({perms_sql / len(user_ids) * 1000:.2f}ms/call)")
+    print(f"get_user_perm_names: {perm_names:.3f}s ({perm_names / len(user_ids) * 1000:.2f}ms/call)")
+    print(f"get_users_perm_names (bulk): {bulk_names:.3f}s")
+    print(f"Connection setup per call: {(per_call - managed) / len(user_ids) * 1000:.2f}ms")
@@ -0,0 +1,48 @@
+"""
+Benchmark bulk_create_users against User.objects.create per row, data is rolled back after run.
+Run in shell: python manage.py shell -c "from utils.benchmarks.bulk_users import run; run()"
+"""
+import time
+
+from django.db import transaction
+
+from account.handlers.bulk_users import bulk_create_users
+from account.models import User, PhoneNumber
+
+
+def fake_users(amount, prefix='BENCH'):
+    return [{
+        'id': f'{prefix}{i:05d}',
+        'email': None,
+        'register_name': f'Benchmark {i}',
+        'main_phone': f'09{i:08d}',
+        'phone_number': f'08{i:08d}',
+        'line_number': i + 2,
+    } for i in range(amount)]
+
+
+def create_per_row(users_data):
+    for user_data in users_data:
+        user = User.objects.create(id=user_data['id'], user_type='client', status='active')
+        PhoneNumber.objects.create(phone_number=user_data['main_phone'], user=user, type='main')
+        PhoneNumber.objects.create(phone_number=user_data['phone_number'], user=user)
+
+
+def run(amount=10000, sample_per_row=200):
+    users_data = fake_users(amount)
+
+    with transaction.atomic():
+        start_time = time.time()
+        success, errors = bulk_create_users(users_data)
+        bulk_time = time.time() - start_time
+        transaction.set_rollback(True)
+
+    with transaction.atomic():
+        start_time = time.time()
+        create_per_row(fake_users(sample_per_row, 'BENCHROW'))
+        per_row_time = time.time() - start_time
+        transaction.set_rollback(True)
+
+    print(f"bulk_create_users: {amount} users in {bulk_time:.2f}s ({len(success)} success, {len(errors)} errors)")
+    print(f"User.objects.create: {sample_per_row} users in {per_row_time:.2f}s, "
+          f"estimate {per_row_time / sample_per_row * amount:.2f}s for {amount} users")
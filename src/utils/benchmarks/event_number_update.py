@@ -0,0 +1,69 @@
+"""
+Benchmark resize of a large event: EventNumber.save (set-based update_number_list) against the former
+per-number update (NumberList get + NumberSelected count for each number), on the same fake event with
+selections. Everything is rolled back after run.
+Run in shell: python manage.py shell -c "from utils.benchmarks.event_number_update import run; run()"
+"""
+import time
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from marketing.pick_number.models import EventNumber, NumberList, NumberSelected
+from marketing.pick_number.pool import auto_pick
+from utils.benchmarks.pick_number_pool import fake_event
+
+
+def update_per_number(event, old_limit_repeat, old_range_number):
+    """ Former EventNumber.validate_update + update_number_list """
+    current_numbers = set(NumberList.objects.filter(event=event).values_list('number', flat=True))
+    for num in current_numbers - set(range(1, event.range_number + 1)):
+        number_list = NumberList.objects.get(event=event, number=num)
+        if NumberSelected.objects.filter(number=number_list).exists():
+            raise ValueError(f"Cannot reduce range_number, number {num} is already selected.")
+    EventNumber.objects.filter(pk=event.pk).update(range_number=event.range_number, limit_repeat=event.limit_repeat)
+
+    current = {num: nid for num, nid in NumberList.objects.filter(event=event).values_list('number', 'id')}
+    to_update = []
+    for num, nid in current.items():
+        number_list = NumberList.objects.get(id=nid)
+        number_list.repeat_count = event.limit_repeat - NumberSelected.objects.filter(number=number_list).count()
+        to_update.append(number_list)
+    NumberList.objects.bulk_update(to_update, ['repeat_count'])
+    for num in set(current) - set(range(1, event.range_number + 1)):
+        NumberList.objects.get(event=event, number=num).delete()
+    NumberList.objects.bulk_create([
+        NumberList(id=f'{event.id}_{num}', number=num, repeat_count=event.limit_repeat, event=event)
+        for num in set(range(1, event.range_number + 1)) - set(current)
+    ])
+
+
+def measure(label, func):
+    with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+        start_time = time.time()
+        func()
+        elapsed = time.time() - start_time
+        transaction.set_rollback(True)
+    print(f"{label}: {elapsed:.2f}s, {len(queries)} queries")
+
+
+def run(numbers=30000, participants=2000, turns=5, grow=5000, limit_repeat=2):
+    with transaction.atomic():
+        event = fake_event(numbers, participants, turns, limit_repeat)
+        auto_pick(event)
+
+        def set_based():
+            resized = EventNumber.objects.get(pk=event.pk)
+            resized.range_number = numbers + grow
+            resized.limit_repeat = limit_repeat + 1
+            resized.save()
+
+        def per_number():
+            resized = EventNumber.objects.get(pk=event.pk)
+            resized.range_number = numbers + grow
+            resized.limit_repeat = limit_repeat + 1
+            update_per_number(resized, limit_repeat, numbers)
+
+        measure("EventNumber.save (set-based)", set_based)
+        measure("per-number update", per_number)
+        transaction.set_rollback(True)
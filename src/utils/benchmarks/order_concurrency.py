@@ -0,0 +1,98 @@
+"""
+Stress order id allocation: N parallel OrderSerializer.create (one thread and DB connection each) started at
+same time, like a live stream flash offer. Asserts every create succeeded with a distinct id.
+Orders are committed (threads can not share a transaction), they are deleted and their turnover/rollup
+reversed at the end: run on a local database.
+Run in shell: python manage.py shell -c "from utils.benchmarks.order_concurrency import run; run()"
+"""
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+from django.db import connection, IntegrityError
+
+from account.models import User
+from marketing.order.api.serializers import OrderSerializer
+from marketing.order.models import Order
+from marketing.order.rollup import refresh_rollup
+from marketing.price_list.models import PriceList, ProductPrice
+from marketing.sale_statistic.ledger import record_order_turnover
+
+
+def order_payload(details_per_order):
+    today = datetime.now().date()
+    price_list = PriceList.objects.filter(date_start__lte=today, date_end__gte=today).exclude(
+        status='deactivate').first()
+    if not price_list:
+        raise ValueError("Benchmark cần bảng giá đang hoạt động hôm nay")
+    product_ids = list(ProductPrice.objects.filter(price_list=price_list).values_list('product_id', flat=True)
+                       [:details_per_order])
+    client = User.objects.filter(user_type='client', clientprofile__isnull=False).first()
+    if not client or not product_ids:
+        raise ValueError("Benchmark cần ít nhất 1 client và sản phẩm trong bảng giá")
+    return {
+        'client_id': client.id,
+        'price_list_id': price_list.id,
+        'date_get': today.isoformat(),
+        'date_company_get': datetime.now().astimezone().isoformat(),
+        'list_type': 'cấp 2 gửi',
+        'order_detail': [{'product_id': product_id, 'order_quantity': 10} for product_id in product_ids],
+    }
+
+
+def create_order(payload, barrier, request):
+    barrier.wait()
+    start_time = time.time()
+    try:
+        serializer = OrderSerializer(data=payload, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        order = serializer.save()
+        return order.id, time.time() - start_time, None
+    except IntegrityError as e:
+        return None, time.time() - start_time, f"collision: {e}"
+    except Exception as e:
+        return None, time.time() - start_time, f"{e}"
+    finally:
+        connection.close()
+
+
+def cleanup(order_ids):
+    keys = set(Order.objects.filter(id__in=order_ids).values_list('client_id', 'date_get'))
+    Order.objects.filter(id__in=order_ids).delete()
+    # Deleted orders are reversed in ledger
+    record_order_turnover(order_ids, reason='benchmark')
+    refresh_rollup(keys)
+
+
+def run(orders=200, workers=50, details_per_order=3, keep=False):
+    payload = order_payload(details_per_order)
+    request = SimpleNamespace(headers={}, user=SimpleNamespace(id='BENCH'))
+    barrier = threading.Barrier(min(workers, orders))
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda _: create_order(dict(payload, order_detail=[
+            dict(detail) for detail in payload['order_detail']]), barrier, request), range(orders)))
+    elapsed = time.time() - start_time
+
+    order_ids = [order_id for order_id, _, _ in results if order_id]
+    errors = [error for _, _, error in results if error]
+    collisions = [error for error in errors if error.startswith('collision')]
+    latencies = sorted(latency for _, latency, _ in results)
+    try:
+        print(f"{orders} creates, {workers} workers: {elapsed:.2f}s, {len(order_ids) / elapsed:.1f} orders/s")
+        print(f"latency p50 {statistics.median(latencies) * 1000:.0f}ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f}ms, max {latencies[-1] * 1000:.0f}ms")
+        for error in errors[:10]:
+            print(f"error: {error}")
+        assert not collisions, f"{len(collisions)} id collisions"
+        assert not errors, f"{len(errors)} failed creates"
+        assert len(set(order_ids)) == len(order_ids) == orders, "duplicated order ids"
+        assert Order.objects.filter(id__in=order_ids).count() == orders, "orders missing after commit"
+        print(f"OK: {orders} distinct ids {min(order_ids)} .. {max(order_ids)}")
+    finally:
+        if not keep:
+            cleanup(order_ids)
@@ -0,0 +1,79 @@
+"""
+Benchmark order excel export: stream_order_excel (streaming writer) vs generate_order_excel (openpyxl in memory),
+on fake orders created in a transaction which is rolled back after run.
+Run in shell: python manage.py shell -c "from utils.benchmarks.order_export import run; run()"
+"""
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+from django.db import transaction
+
+from account.models import User
+from marketing.order.api.views import generate_order_excel
+from marketing.order.export import stream_order_excel
+from marketing.order.models import Order, OrderDetail
+from marketing.product.models import Product
+
+
+def fake_orders(lines, details_per_order):
+    client = User.objects.filter(user_type='client').first()
+    products = list(Product.objects.all()[:details_per_order])
+    if not client or not products:
+        raise ValueError("Benchmark cần ít nhất 1 client và sản phẩm")
+    today = datetime.now().date()
+    amount = lines // len(products)
+    orders = [Order(client_id=client, date_get=today, date_company_get=datetime.now().astimezone(),
+                    list_type='cấp 2 gửi', created_by='BENCH', note='{"notes": "benchmark"}')
+              for _ in range(amount)]
+    for order, order_id in zip(orders, Order.generate_pks(amount)):
+        order.id = order_id
+    Order.objects.bulk_create(orders, batch_size=2000)
+    OrderDetail.objects.bulk_create([
+        OrderDetail(order_id=order, product_id=product, order_quantity=10, order_box=1.5, product_price=1000000,
+                    point_get=2.5)
+        for order in orders for product in products
+    ], batch_size=5000)
+    return Order.objects.filter(id__in=[order.id for order in orders]).order_by('-date_get', '-id')
+
+
+def measure(func):
+    tracemalloc.start()
+    start_time = time.time()
+    size = func()
+    elapsed = time.time() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def run(lines=100000, details_per_order=5, compare=True):
+    today = datetime.now().date()
+    with transaction.atomic():
+        orders = fake_orders(lines, details_per_order)
+
+        def streaming():
+            first_byte = None
+            size = 0
+            start_time = time.time()
+            for chunk in stream_order_excel(orders, today):
+                if first_byte is None:
+                    first_byte = time.time() - start_time
+                size += len(chunk)
+            print(f"stream_order_excel: first bytes after {first_byte:.2f}s")
+            return size
+
+        def in_memory():
+            output = BytesIO()
+            generate_order_excel(orders, today).save(output)
+            return output.tell()
+
+        elapsed, peak, size = measure(streaming)
+        print(f"stream_order_excel: {lines} lines in {elapsed:.2f}s, peak {peak / 1024 / 1024:.1f}MB, "
+              f"{size / 1024 / 1024:.1f}MB file")
+        if compare:
+            elapsed, peak, size = measure(in_memory)
+            print(f"generate_order_excel: {lines} lines in {elapsed:.2f}s, peak {peak / 1024 / 1024:.1f}MB, "
+                  f"{size / 1024 / 1024:.1f}MB file")
+        transaction.set_rollback(True)
@@ -0,0 +1,53 @@
+"""
+Benchmark auto pick of a large event with the NumPy number pool: fake event, users and joins are created in a
+transaction which is rolled back after run. add_more_number=True with turns * participants above
+numbers * limit_repeat measures the growth of range_number too.
+Run in shell: python manage.py shell -c "from utils.benchmarks.pick_number_pool import run; run()"
+"""
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.db import transaction
+
+from account.models import User
+from marketing.pick_number.models import EventNumber, UserJoinEvent, NumberSelected
+from marketing.pick_number.pool import auto_pick
+
+
+def fake_event(numbers, participants, turns, limit_repeat, prefix='BENCHPN'):
+    today = datetime.now().date()
+    start_time = time.time()
+    event = EventNumber(name='Benchmark', date_start=today, date_close=today + timedelta(days=30),
+                        range_number=numbers, limit_repeat=limit_repeat)
+    event.save()
+    users = User.objects.bulk_create([
+        User(id=f'{prefix}{i:05d}', username=f'{prefix}{i:05d}', password='!', user_type='farmer', status='active')
+        for i in range(participants)
+    ], batch_size=5000)
+    UserJoinEvent.objects.bulk_create([
+        UserJoinEvent(id=f'{event.id}_{user.id}', user=user, event=event, turn_pick=turns)
+        for user in users
+    ], batch_size=5000)
+    print(f"Setup {numbers} numbers, {participants} users in {time.time() - start_time:.2f}s")
+    return event
+
+
+def check(event, turns, limit_repeat):
+    rows = list(NumberSelected.objects.filter(user_event__event=event).values_list('user_event_id', 'number__number'))
+    per_number = Counter(number for _, number in rows)
+    assert len(set(rows)) == len(rows), "number selected twice by a user"
+    assert max(per_number.values(), default=0) <= limit_repeat, "number selected more than limit_repeat"
+    short = UserJoinEvent.objects.filter(event=event, turn_selected__lt=turns).count()
+    print(f"{len(rows)} selections, {len(per_number)} numbers used, {short} users without all turns")
+
+
+def run(numbers=50000, participants=5000, turns=10, limit_repeat=2, add_more_number=False):
+    with transaction.atomic():
+        event = fake_event(numbers, participants, turns, limit_repeat)
+        start_time = time.time()
+        result = auto_pick(event, add_more_number)
+        print(f"auto_pick: {result['users']} users, {result['numbers']} numbers in {time.time() - start_time:.2f}s, "
+              f"range {numbers} -> {result['range_number']}, timings {result['timings']}")
+        check(event, turns, limit_repeat)
+        transaction.set_rollback(True)
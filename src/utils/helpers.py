@@ -9,6 +9,7 @@ from django.apps import apps
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
+from django.db import connection, transaction, IntegrityError
 from django.db.models import Max
 from django.utils import timezone
 from rest_framework import serializers
@@ -182,26 +183,12 @@ def old_db_connect(query):
 
 
 def generate_id(ma_nhom):
-    # Get last 2 number of year (2024 => get '24')
-    current_year = str(datetime.now().year)[-2:]
     if ma_nhom == maNhomND:
         code = 'ND'
     else:
         return None
-    id_template = f'{code}{current_year}'
     User = apps.get_model('account', 'User')
-    existing_ids = User.objects.filter(id__startswith=id_template).values_list('id', flat=True)
-
-    if not existing_ids:
-        new_id = f'{id_template}0001'
-    else:
-        last_id = max(existing_ids)
-        last_sequence_number = int(last_id[-4:])
-        new_sequence_number = last_sequence_number + 1
-
-        new_id = f'{id_template}{new_sequence_number:04d}'
-
-    return new_id
+    return self_id(code, User, 4)
 
 
 def phone_validate(phone):
@@ -278,27 +265,131 @@ def get_content(model):
 
 
 def self_id(prefix: str, models, last_count: int, time_suffix: str = '%y'):
-    # Tạo hậu tố thời gian dựa trên định dạng được chỉ định
-    current_time = datetime.now()
-    date_suffix = current_time.strftime(time_suffix)
+    return self_ids(prefix, models, last_count, 1, time_suffix)[0]
 
-    # Tạo tiền tố ID bao gồm cả prefix và date_suffix
-    id_prefix = f"{prefix}{date_suffix}"
 
-    # Lấy ID cuối cùng từ cơ sở dữ liệu bắt đầu bằng tiền tố này và có độ dài lớn nhất
-    last_id = models.objects.filter(id__startswith=id_prefix).aggregate(max_id=Max('id'))['max_id']
+def self_ids(prefix: str, models, last_count: int, amount: int, time_suffix: str = '%y'):
+    """
+    Allocate `amount` new ids like {prefix}{date_suffix}{number:0last_count}, one query for whole block.
+    Numbers come from a Postgres sequence of the prefix, see next_id_numbers.
+    """
+    id_prefix = id_prefix_of(prefix, time_suffix)
+    numbers = next_id_numbers(id_prefix, models, amount)
+    if numbers and numbers[-1] >= 10 ** last_count:
+        raise serializers.ValidationError({'id': f'Out of index {id_prefix}'})
+    return [f'{id_prefix}{number:0{last_count}d}' for number in numbers]
+
+
+def id_prefix_of(prefix: str, time_suffix: str = '%y') -> str:
+    # Tạo tiền tố ID bao gồm cả prefix và hậu tố thời gian theo định dạng được chỉ định
+    return f"{prefix}{datetime.now().strftime(time_suffix)}"
 
-    if last_id:
-        # Trích xuất phần số từ ID cuối cùng và tăng lên 1
-        last_number = int(last_id[len(id_prefix):])
-        new_id = f'{last_number + 1:0{last_count}d}'
-    else:
-        # Nếu không tìm thấy ID nào, bắt đầu từ 1
-        new_id = f'{1:0{last_count}d}'
 
-    # Tạo ID mới bằng cách nối tiền tố và số mới
-    _id = f'{id_prefix}{new_id}'
-    return _id
+def insert_with_new_id(instance, save, id_format: tuple, *args, prepare=None, **kwargs):
+    """
+    Insert new instance with id self_id(*id_format) (prefix, last_count[, time_suffix]).
+    Sequence numbers can be taken by rows written with explicit ids (files, admin, migrations), and save() of a set
+    pk updates the existing row: insert is forced and run in a savepoint, so the caller transaction stays usable.
+    When id is taken, sequence is moved past the largest id and insert is retried with next id, ID_RETRIES times.
+    `save` is the parent save of model, `prepare` sets fields derived from id before each try.
+    """
+    model = type(instance)
+    prefix, last_count, *time_suffix = id_format
+    kwargs['force_insert'] = True
+    for attempt in range(1, ID_RETRIES + 1):
+        instance.pk = self_id(prefix, model, last_count, *time_suffix)
+        if prepare:
+            prepare()
+        try:
+            with transaction.atomic():
+                return save(*args, **kwargs)
+        except IntegrityError:
+            if attempt == ID_RETRIES or not model.objects.filter(pk=instance.pk).exists():
+                instance.pk = None
+                raise
+            app_log.warning(f"{model.__name__} id {instance.pk} is taken, retry with next id")
+            sync_id_sequence(id_prefix_of(prefix, *time_suffix), model)
+
+
+def id_sequence_name(id_prefix: str) -> str:
+    return f"id_seq_{re.sub(r'[^a-z0-9_]', '_', id_prefix.lower())}"
+
+
+# Inserts tried with a new id when id is taken by a row written with explicit id
+ID_RETRIES = 3
+
+# Sequences known to exist in this process
+_id_sequences = set()
+
+
+def create_id_sequence(id_prefix: str, models):
+    """ Sequence of id_prefix, first number is after the last id of models table with this prefix """
+    sequence = id_sequence_name(id_prefix)
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute("SELECT to_regclass(%s)", (sequence,))
+            if cursor.fetchone()[0] is not None:
+                break
+            try:
+                with transaction.atomic():
+                    cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {sequence} "
+                                   f"START WITH {last_id_number(id_prefix, models) + 1}")
+                break
+            except IntegrityError:
+                # Created by concurrent transaction at same time, look again: it is gone if that one rolled back
+                continue
+    # Sequence seen here can be created by current transaction and is gone if it rolls back
+    transaction.on_commit(lambda: _id_sequences.add(sequence))
+    return sequence
+
+
+def next_id_numbers(id_prefix: str, models, amount: int = 1) -> list:
+    """
+    Take `amount` numbers from sequence of id_prefix, created on first use.
+    nextval() never blocks and never returns a number twice, whatever transaction is open: concurrent creates
+    can not collide and do not wait for each other. Numbers of rolled back transactions are skipped (gaps),
+    numbers of one call are increasing but not always contiguous when other calls run at same time.
+    """
+    if amount <= 0:
+        return []
+    sequence = id_sequence_name(id_prefix)
+    if sequence not in _id_sequences:
+        create_id_sequence(id_prefix, models)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(%s::regclass) FROM generate_series(1, %s)", (sequence, amount))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def sync_id_sequence(id_prefix: str, models, last_number: int = 0):
+    """ Move sequence of id_prefix past the largest id of models table with this prefix and past last_number """
+    sequence = create_id_sequence(id_prefix, models)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT setval(%s::regclass, GREATEST(last_value, %s, %s)) FROM {sequence}",
+                       (sequence, last_id_number(id_prefix, models), last_number))
+
+
+def sync_id_sequences(models, ids, prefixes, time_suffix: str = '%y'):
+    """
+    Rows written with explicit ids: move sequences of the prefixes past these ids,
+    so ids allocated after (or for the other rows of same bulk insert) do not take them.
+    """
+    for prefix in prefixes:
+        id_prefix = id_prefix_of(prefix, time_suffix)
+        numbers = [int(_id[len(id_prefix):]) for _id in ids
+                   if _id.startswith(id_prefix) and _id[len(id_prefix):].isdigit()]
+        if numbers:
+            sync_id_sequence(id_prefix, models, max(numbers))
+
+
+def last_id_number(id_prefix: str, models) -> int:
+    # Lấy ID cuối cùng từ cơ sở dữ liệu bắt đầu bằng tiền tố này
+    last_id = models.objects.filter(id__startswith=id_prefix).aggregate(max_id=Max('id'))['max_id']
+    if not last_id:
+        return 0
+    try:
+        return int(last_id[len(id_prefix):])
+    except ValueError:
+        return 0
 
 
 def check_email(email):
@@ -1,14 +1,19 @@
-from marketing.pick_number.models import EventNumber, NumberSelected
+"""
+Check UserJoinEvent.turn_selected and NumberList.repeat_count against NumberSelected, fix drifted rows.
+Run in shell: python manage.py shell -c "from utils.truncate.event_number import run; run()"
+One event: run(event_id='EVN240001'), fix: run(fix=True)
+"""
+from marketing.pick_number.counters import find_counter_drift, recount_counters
 
 
-def update_repeat_count(event_number_id):
-    evn = EventNumber.objects.get(pk=event_number_id)
-    numbers_list = evn.number_list.all()
-    numbers_selected = NumberSelected.objects.filter(user_event__event=evn)
-    numbers_selected_list = numbers_selected.values_list('number__number', flat=True).order_by('number__number').distinct()
-
-    for number_selected in numbers_selected_list:
-        number_in_list = numbers_list.filter(number=number_selected).first()
-        number_in_list.repeat_count = evn.limit_repeat - numbers_selected.filter(number__number=number_selected).count()
-        print(f"Test count: {number_selected} - {number_in_list.repeat_count}")
-        number_in_list.save(update_fields=['repeat_count'])
+def run(event_id=None, fix=False, limit=1000):
+    drift = find_counter_drift(event_id, limit=limit)
+    for name in ('user_events', 'numbers'):
+        rows = drift[name]
+        print(f"{name} drifted: {len(rows)}{' (limited)' if len(rows) >= limit else ''}")
+        for row_id, stored, real in rows[:50]:
+            print(f"{row_id}: stored {stored} | real {real}")
+    if fix and (drift['user_events'] or drift['numbers']):
+        fixed_users, fixed_numbers = recount_counters(event_id=event_id)
+        print(f"Fixed user events: {fixed_users}, numbers: {fixed_numbers}")
+    return drift
@@ -0,0 +1,21 @@
+"""
+Check OrderRollup against Order/OrderDetail, rebuild when drifted or after editing orders outside API/import.
+Run in shell: python manage.py shell -c "from utils.truncate.order_rollup import run; run()"
+Rebuild days: run(rebuild=True, date_from='2024-01-01', date_to='2024-12-31')
+"""
+from marketing.order.rollup import find_rollup_drift, refresh_rollup, rebuild_rollup
+
+
+def run(fix=False, rebuild=False, date_from=None, date_to=None, limit=1000):
+    if rebuild:
+        inserted = rebuild_rollup(date_from, date_to)
+        print(f"Rollup rows rebuilt: {inserted}")
+        return []
+    drift = find_rollup_drift(limit=limit)
+    print(f"(user, day) drifted: {len(drift)}{' (limited)' if len(drift) >= limit else ''}")
+    for item in drift[:50]:
+        print(f"{item['user_id']} {item['day']}: rollup {item['rollup']} | details {item['details']}")
+    if fix and drift:
+        inserted = refresh_rollup([(item['user_id'], item['day']) for item in drift])
+        print(f"Refreshed rows: {inserted}")
+    return drift
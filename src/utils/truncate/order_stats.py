@@ -0,0 +1,26 @@
+"""
+Check PointOfSeason and point SeasonalStatisticUser against orders, recompute stale users with fix=True.
+Run in shell: python manage.py shell -c "from utils.truncate.order_stats import run; run()"
+"""
+from datetime import date
+
+from marketing.order.stats import find_stale_stats, recompute_stats
+
+
+def run(fix=False):
+    stale = find_stale_stats()
+    print(f"Pending in queue: {stale['pending']}, stale point: {len(stale['point'])}, "
+          f"stale season: {len(stale['season'])}")
+    for item in stale['point'][:50]:
+        print(f"point {item['user']}: stored {item['stored']} | orders {item['orders']}")
+    for item in stale['season'][:50]:
+        print(f"season {item['season']} {item['user']}: stored {item['stored']} | orders {item['orders']}")
+
+    if fix:
+        month = date.today().replace(day=1)
+        items = {(item['user'], month) for item in stale['point']}
+        items.update((item['user'], item['start_date'].replace(day=1)) for item in stale['season'])
+        if items:
+            recompute_stats(items)
+        print(f"Recomputed: {len(items)}")
+    return stale
@@ -0,0 +1,16 @@
+"""
+Check stored Order totals (order_point, order_price, total_box, total_quantity) against OrderDetail.
+Run in shell: python manage.py shell -c "from utils.truncate.order_totals import run; run()"
+"""
+from marketing.order.totals import find_total_drift, refresh_order_totals
+
+
+def run(fix=False, limit=1000):
+    drift = find_total_drift(limit=limit)
+    print(f"Orders drifted: {len(drift)}{' (limited)' if len(drift) >= limit else ''}")
+    for item in drift[:50]:
+        print(f"{item['id']}: stored {item['stored']} | details {item['details']}")
+    if fix and drift:
+        updated = refresh_order_totals([item['id'] for item in drift])
+        print(f"Refreshed: {updated}")
+    return drift
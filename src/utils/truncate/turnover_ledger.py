@@ -0,0 +1,17 @@
+"""
+Rebuild SaleStatistic balances of current turnover period from TurnoverLedger and verify with recursive result.
+Run in shell: python manage.py shell -c "from utils.truncate.turnover_ledger import run; run()"
+"""
+from marketing.sale_statistic.ledger import rebuild_turnover_ledger
+
+
+def run(user_ids=None, verify=True, sample=500):
+    balances, mismatches = rebuild_turnover_ledger(user_ids, verify, sample)
+    print(f"Balances: {len(balances)}")
+    if verify:
+        checked = min(len(balances), sample) if sample else len(balances)
+        print(f"Verified: {checked}, mismatches: {len(mismatches)}")
+        for mismatch in mismatches[:50]:
+            print(f"{mismatch['user']} {mismatch['month']}: ledger {mismatch['ledger']} "
+                  f"| recursive {mismatch['recursive']}")
+    return mismatches
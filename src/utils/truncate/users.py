@@ -1,4 +1,6 @@
 import re
+from collections import defaultdict
+
 import regex
 
 import numpy as np
@@ -7,8 +9,10 @@ from django.db import transaction
 from django.db.models import F, Q
 from rest_framework.exceptions import ValidationError
 
+from account.handlers.bulk_users import BATCH_SIZE
 from account.models import GrantAccess, User, PhoneNumber
 from app.settings import PROJECT_DIR
+from user_system.client_profile.models import ClientProfile
 from utils.import_excel import file_data_to_dict
 
 
@@ -22,86 +26,97 @@ def inactive_users():
 
 
 def force_update_user():
+    """
+    Set npp, nvtt and phones of users in update_users.xlsx. Users, profiles and phones of the file are read once,
+    rows are applied in file order on those rows in memory, then written with one bulk statement per kind.
+    """
     file = PROJECT_DIR / 'test' / 'update_users.xlsx'
 
     datas = file_data_to_dict2(file)
     success = list()
     errors = list()
     npp_list = {data['npp'] for data in datas}
+    user_ids = {data['user_id'] for data in datas}
+    file_phones = {str(data[field]) for data in datas for field in ('main_phone', 'phone_1', 'phone_2', 'phone_3')
+                   if data.get(field) not in ['', 'nan', None]}
 
     npp_user = User.objects.filter(
         clientprofile__register_name__in=npp_list, clientprofile__is_npp=True
     ).annotate(name=F('clientprofile__register_name')).values_list('name', 'id')
     npp_user_dict = dict(npp_user)
-    for user_data in datas:
-        if user_data['user_id'] == 'KG040':
-            for key, value in user_data.items():
-                print(f"{key}: {value} - {type(value)}")
-        try:
-            with transaction.atomic():
-                print(f"Update user id: {user_data['user_id']}")
-                success_data = {
-                    'line': user_data.get('line_number')
-                }
-                user = User.objects.get(id=user_data['user_id'])
-                profile = user.clientprofile if user.clientprofile else user.create_profile()
-                profile.client_lv1_id = npp_user_dict[user_data.get('npp')]
-                profile.nvtt_id = user_data.get('nvtt')
-                success_data['profile'] = 'updated'
-                # Get phone data
-                main_phone_field = user_data.get('main_phone', None)
-                phones = [user_data['phone_1'], user_data['phone_2'], user_data['phone_3']]
-
-                if main_phone_field:
-                    main_phone = str(main_phone_field)
-                    main_phone_field = main_phone
-                    # Deactivate current main phone
-                    current_main_phone = user.phone_numbers.filter(type='main').first()
-                    if current_main_phone:
-                        current_main_phone.type = 'sub'
-                        current_main_phone.save()
-
-                    # Query main phone
-                    main_phone_q = PhoneNumber.objects.filter(phone_number=main_phone)
-                    # Handle create/update main phone
-                    if main_phone_q.exists():
-                        # Update if exist
-                        main_phone_obj: PhoneNumber = main_phone_q.first()
-                        if not main_phone_obj.user_id == user.id:
-                            main_phone_obj.user = user
-                        main_phone_obj.type = 'main'
-                        main_phone_obj.save(update_fields=['user', 'type'])
-                        success_data['main_phone'] = 'updated'
-                    else:
-                        # Create if not exist
-                        main_phone_obj = PhoneNumber.objects.create(phone_number=main_phone, user=user, type='main')
-                        success_data['main_phone'] = 'created'
+    users = User.objects.in_bulk(list(user_ids))
+    profiles = {profile.client_id_id: profile for profile in ClientProfile.objects.filter(client_id__in=users)}
+    phones = {phone.phone_number: phone for phone in PhoneNumber.objects.filter(
+        Q(user_id__in=users) | Q(phone_number__in=file_phones))}
+    user_phones = defaultdict(set)
+    for phone in phones.values():
+        user_phones[phone.user_id].add(phone.phone_number)
+    new_phones = set()
+    changed_phones = set()
+
+    def set_phone(phone_number, user_id, phone_type):
+        phone = phones.get(phone_number)
+        if phone is None:
+            phones[phone_number] = PhoneNumber(phone_number=phone_number, user_id=user_id, type=phone_type)
+            new_phones.add(phone_number)
+            user_phones[user_id].add(phone_number)
+            return 'created'
+        user_phones[phone.user_id].discard(phone_number)
+        phone.user_id, phone.type = user_id, phone_type
+        user_phones[user_id].add(phone_number)
+        if phone_number not in new_phones:
+            changed_phones.add(phone_number)
+        return 'updated'
 
-                # Handle sub phone
-                phone_numbers = {phone for phone in phones if phone not in ['', 'nan', None, main_phone_field]}
-                for i, phone_number in enumerate(phone_numbers):
-                    # Query sub phone
-                    phone_obj = PhoneNumber.objects.filter(phone_number=phone_number)
-                    if phone_obj.exists():
-                        # Update if exist
-                        phone_obj = phone_obj.first()
-                        if not phone_obj.user_id == user.id:
-                            phone_obj.user = user
-                        phone_obj.type = 'sub'
-                        phone_obj.save(update_fields=['user', 'type'])
-                        success_data[f'phone_{i}'] = 'updated'
-                    else:
-                        phone_obj = PhoneNumber.objects.create(phone_number=phone_number, user=user)
-                        success_data[f'phone_{i}'] = 'created'
-                success.append(success_data)
-        except User.DoesNotExist:
+    for user_data in datas:
+        user = users.get(user_data['user_id'])
+        if user is None:
             errors.append({
                 'line': user_data.get('line_number'),
                 'error': f"not found user {user_data['user_id']}"
             })
             continue
-        except Exception as e:
-            raise e
+        if user_data.get('npp') not in npp_user_dict:
+            errors.append({
+                'line': user_data.get('line_number'),
+                'error': f"not found npp {user_data.get('npp')}"
+            })
+            continue
+        success_data = {
+            'line': user_data.get('line_number')
+        }
+        if user.id not in profiles:
+            # Rare, profile and its group are created row by row
+            profiles[user.id] = user.create_profile()
+        profile = profiles[user.id]
+        profile.client_lv1_id = npp_user_dict[user_data.get('npp')]
+        profile.nvtt_id = user_data.get('nvtt')
+        success_data['profile'] = 'updated'
+        # Get phone data
+        main_phone_field = user_data.get('main_phone', None)
+        phones_data = [user_data['phone_1'], user_data['phone_2'], user_data['phone_3']]
+
+        if main_phone_field:
+            main_phone_field = str(main_phone_field)
+            # Deactivate current main phone
+            for phone_number in list(user_phones[user.id]):
+                if phones[phone_number].type == 'main':
+                    set_phone(phone_number, user.id, 'sub')
+            success_data['main_phone'] = set_phone(main_phone_field, user.id, 'main')
+
+        # Handle sub phone
+        phone_numbers = {str(phone) for phone in phones_data if phone not in ['', 'nan', None, main_phone_field]}
+        for i, phone_number in enumerate(phone_numbers):
+            success_data[f'phone_{i}'] = set_phone(phone_number, user.id, 'sub')
+        success.append(success_data)
+
+    with transaction.atomic():
+        ClientProfile.objects.bulk_update(profiles.values(), ['client_lv1_id', 'nvtt_id'], batch_size=BATCH_SIZE)
+        PhoneNumber.objects.bulk_update([phones[phone_number] for phone_number in changed_phones],
+                                        ['user', 'type'], batch_size=BATCH_SIZE)
+        PhoneNumber.objects.bulk_create([phones[phone_number] for phone_number in new_phones],
+                                        batch_size=BATCH_SIZE)
+    print(f"Updated {len(success)} users, {len(errors)} errors")
     return success, errors
 
 
@@ -0,0 +1,216 @@
+"""
+Minimal streaming XLSX writer: rows are written to the sheet XML and the zip is drained after each batch,
+so bytes go to the client while rows are produced and memory stays bounded whatever the row count.
+Styles are a fixed shared table (report styles of the project), cells refer to them by index.
+"""
+import math
+import re
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape, quoteattr
+
+# Shared cell styles, index of cellXfs in STYLES_XML
+DEFAULT = 0
+TITLE = 1
+NOTE = 2
+HEADER = 3
+BODY = 4
+DATE = 5
+BOLD = 6
+
+FONT = '<font>{bold}<sz val="{size}"/>{color}<name val="{name}"/></font>'
+FONTS = [
+    FONT.format(bold='', size=11, color='', name='Calibri'),
+    FONT.format(bold='<b/>', size=20, color='', name='Times New Roman'),
+    FONT.format(bold='', size=11, color='', name='Times New Roman'),
+    FONT.format(bold='<b/>', size=11, color='<color rgb="FFFFFFFF"/>', name='Times New Roman'),
+    FONT.format(bold='', size=10, color='', name='Times New Roman'),
+    FONT.format(bold='<b/>', size=11, color='', name='Times New Roman'),
+]
+CENTER = '<alignment horizontal="center" vertical="center"/>'
+# (font, fill, border, alignment) of each style index
+CELL_XFS = [
+    (0, 0, 0, ''),
+    (1, 0, 0, CENTER),
+    (2, 0, 0, CENTER),
+    (3, 2, 1, CENTER),
+    (2, 0, 0, ''),
+    (4, 0, 0, CENTER),
+    (5, 0, 0, ''),
+]
+
+
+def _xf(font, fill, border, alignment):
+    applies = ''.join(f' {name}="1"' for name, used in (('applyFont', font), ('applyFill', fill),
+                                                         ('applyBorder', border), ('applyAlignment', alignment))
+                      if used)
+    xf = f'<xf numFmtId="0" fontId="{font}" fillId="{fill}" borderId="{border}" xfId="0"{applies}'
+    return f'{xf}>{alignment}</xf>' if alignment else f'{xf}/>'
+
+
+MEDIUM = '<{side} style="medium"><color auto="1"/></{side}>'
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    f'<fonts count="{len(FONTS)}">{"".join(FONTS)}</fonts>'
+    '<fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FF33CC33"/><bgColor rgb="FF33CC33"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+    f'<border>{"".join(MEDIUM.format(side=side) for side in ("left", "right", "top", "bottom"))}<diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    f'<cellXfs count="{len(CELL_XFS)}">'
+    + ''.join(_xf(*xf) for xf in CELL_XFS)
+    + '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name={title} sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+ILLEGAL_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# Rows written between two drains of the zip buffer
+FLUSH_ROWS = 500
+
+
+class _StreamBuffer:
+    """ Write-only file for ZipFile, without tell()/seek() zipfile writes data descriptors and never seeks back """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def column_letter(col):
+    letters = ''
+    while col:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _cell(ref, value, style):
+    style_attr = f' s="{style}"' if style else ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)) and math.isfinite(value):
+        return f'<c r="{ref}"{style_attr}><v>{value}</v></c>'
+    text = ILLEGAL_CHARS.sub('', str(value))
+    space = ' xml:space="preserve"' if text != text.strip() else ''
+    return f'<c r="{ref}"{style_attr} t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'
+
+
+class XlsxStreamWriter:
+    """
+    Single sheet XLSX produced as a byte generator.
+    rows: iterable of (values, styles), styles is a style index for whole row or a sequence per column.
+    """
+
+    def __init__(self, sheet_title, column_widths=None, merge_cells=None):
+        self.sheet_title = sheet_title
+        self.column_widths = column_widths or []
+        self.merge_cells = merge_cells or []
+        self._letters = []
+
+    def _letter(self, col):
+        while len(self._letters) < col:
+            self._letters.append(column_letter(len(self._letters) + 1))
+        return self._letters[col - 1]
+
+    def _row(self, row_num, values, styles):
+        cells = []
+        for col, value in enumerate(values, 1):
+            style = styles if isinstance(styles, int) else (styles[col - 1] if col <= len(styles) else DEFAULT)
+            if value is None:
+                if style:
+                    cells.append(f'<c r="{self._letter(col)}{row_num}" s="{style}"/>')
+                continue
+            cells.append(_cell(f'{self._letter(col)}{row_num}', value, style))
+        return f'<row r="{row_num}">{"".join(cells)}</row>'
+
+    def _sheet_head(self):
+        head = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">')
+        if self.column_widths:
+            head += '<cols>' + ''.join(f'<col min="{col}" max="{col}" width="{width}" customWidth="1"/>'
+                                       for col, width in enumerate(self.column_widths, 1)) + '</cols>'
+        return head + '<sheetData>'
+
+    def _sheet_tail(self):
+        tail = '</sheetData>'
+        if self.merge_cells:
+            tail += (f'<mergeCells count="{len(self.merge_cells)}">'
+                     + ''.join(f'<mergeCell ref="{ref}"/>' for ref in self.merge_cells) + '</mergeCells>')
+        return tail + '</worksheet>'
+
+    def stream(self, rows):
+        buffer = _StreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+            archive.writestr('_rels/.rels', RELS_XML)
+            archive.writestr('xl/workbook.xml', WORKBOOK_XML.format(title=quoteattr(self.sheet_title[:31])))
+            archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML)
+            archive.writestr('xl/styles.xml', STYLES_XML)
+            with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+                sheet.write(self._sheet_head().encode())
+                pending = []
+                for row_num, (values, styles) in enumerate(rows, 1):
+                    if values is not None:
+                        pending.append(self._row(row_num, values, styles))
+                    if len(pending) >= FLUSH_ROWS:
+                        sheet.write(''.join(pending).encode())
+                        pending.clear()
+                        data = buffer.drain()
+                        if data:
+                            yield data
+                sheet.write((''.join(pending) + self._sheet_tail()).encode())
+        yield buffer.drain()